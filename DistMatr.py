@@ -10,6 +10,7 @@
 
 import Tree
 import pexp
+import numpy as np
 import inspect
 import sample
 
@@ -118,7 +119,8 @@ class DistanceMatrix:
     def _check_keys(self, keys, check_existing = False):
         """
         Acts on:    a DistanceMatrix
-        Input:      - keys, a string 2-tuple
+        Input:      - keys, a string 2-tuple (or integer 2-tuple, 
+                    LabelTable ids)
                     - check_existing, a boolean
         Output:     checks if keys is a string 2-tuple (if not gives and error
                     message), and if check_existing is True, also checks if 
@@ -126,11 +128,11 @@ class DistanceMatrix:
                     as keys
         Used in:    __getitem__, __setitem__
         """
-        if len(keys) != 2 or type(keys[0]) != str or type(keys[1]) != str:
-            raise TypeError("Expected a 2-tuple of strings.")
+        if (len(keys) != 2 or type(keys[0]) not in (str, int) 
+            or type(keys[1]) is not type(keys[0])):
+            raise TypeError("Expected a 2-tuple of strings or integers.")
         if check_existing:
-            K = self.keys
-            if keys[0] not in K or keys[1] not in K:  
+            if keys[0] not in self.data or keys[1] not in self.data:  
                 raise ValueError("At least one of the keys is not valid.")
         
     def __getitem__(self, keys):
@@ -159,10 +161,10 @@ class DistanceMatrix:
                     (alphabetically)
         Used in:    __setitem__
         """
-        old_keys = self.keys
-        if new_key in old_keys:
+        if new_key in self.data:
             return    
         else: 
+            old_keys = self.keys
             self.data[new_key] = dict()
             for key in old_keys:
                 if key < new_key:
@@ -254,10 +256,27 @@ class DistanceMatrix:
         """
         return eval(self.__repr__())
 
+    def to_array(self):
+        """
+        Acts on:    a DistanceMatrix
+        Input:      none
+        Output:     2-tuple of the list of keys in alphabetical order and the 
+                    NumPy float64 array of distances between them
+        """
+        keys = self.keys
+        n = len(keys)
+        M = np.zeros((n, n), dtype = np.float64)
+        for i in range(n):
+            row = self.data[keys[i]]
+            M[i, i + 1:] = [row[key] for key in keys[i + 1:]]
+        M = M + M.T
+        return (keys, M)
+
     def submatrix(self, list_names):
         for name in list_names:
-            if type(name) is not str:
-                raise TypeError("Input has to be a list of strings.")
+            if type(name) is not str and type(name) is not int:
+                raise TypeError('''Input has to be a list of strings or 
+                integers.''')
         newDistanceMatrix = DistanceMatrix(dict())
         for key1 in list_names:
             for key2 in list_names:
@@ -265,8 +284,8 @@ class DistanceMatrix:
         return newDistanceMatrix
     
     def append(self, label, dictionary):
-        if type(label) is not str:
-            raise TypeError("First input has to be a string.")
+        if type(label) is not str and type(label) is not int:
+            raise TypeError("First input has to be a string or an integer.")
         if type(dictionary) is not dict:
             raise TypeError("Second input has to be a dictionary.")
         for key in dictionary:
@@ -290,15 +309,28 @@ class DistanceMatrix:
         if (type(tree) is not Tree.CombinatorialTree 
             and type(tree) is not Tree.MetricTree):
             raise TypeError("Input has to be a Combinatorial or Metric Tree.")
-        newDistanceMatrix = cls(dict())
-        leaves = tree.leaves
-        for leaf1 in leaves:
-            name1 = leaf1.name
-            for leaf2 in leaves:
-                name2 = leaf2.name
-                value = leaf1.common_ancestor([leaf2]).height * 2.
-                newDistanceMatrix[name1, name2] = value
-        return newDistanceMatrix
+        (names, values) = tree.cophenetic_matrix()
+        return cls.FromArray(names, values)
+    
+    @classmethod
+    def FromArray(cls, names, array):
+        """
+        Acts on:   DistanceMatrix class
+        Input:     - names, list of n strings
+                   - array, n x n symmetric NumPy array of distances between 
+                   them
+        Output:    a DistanceMatrix with the same entries
+        Type:      classmethod
+        """
+        order = sorted(range(len(names)), key = lambda i: names[i])
+        names = [names[i] for i in order]
+        values = np.asarray(array, dtype = np.float64)[np.ix_(order, order)]
+        values = values.tolist()
+        # keys are sorted, so row i only keeps the columns j > i
+        data = dict()
+        for i in range(len(names)):
+            data[names[i]] = dict(zip(names[i + 1:], values[i][i + 1:]))
+        return cls(data)
     
     @classmethod
     def FromPexp(cls, pexp_input):
@@ -325,11 +357,5 @@ class DistanceMatrix:
         """
         if type(sample_input) is not sample.Sample:
             raise TypeError("Input has to be a Sample.")
-        M = cls(dict())
-        keys = sample_input.keys
-        N = len(keys)
-        for i in range(N):
-            for j in range(i, N):
-                M[keys[i], keys[j]] = sample.HummingDistance(sample_input[keys[i]], 
-                                                             sample_input[keys[j]])
-        return M
+        (keys, values) = sample_input.distance_array()
+        return cls.FromArray(keys, values)
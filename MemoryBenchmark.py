@@ -0,0 +1,71 @@
+import tracemalloc
+from Tree import *
+
+
+##############################################################################
+########################## MEMORY PER NODE BENCHMARK #########################
+##############################################################################
+
+
+class DictNode(object):
+    """
+    Node that keeps the same attributes as a MetricTree in a __dict__, 
+    the layout of MetricTree before it had __slots__.
+    """
+    def __init__(self, children, parent, height, name = None):
+        self._CombinatorialTree__parent = parent
+        self._CombinatorialTree__name = name
+        self._CombinatorialTree__children = children
+        self._CombinatorialTree__cache = None
+        self._MetricTree__height = height
+        for child in children:
+            child._CombinatorialTree__parent = self
+
+
+def measure(build):
+    """
+    Input:  build, a function with no inputs that returns a tree (a list of
+            nodes or an ArrayTree)
+    Output: number of bytes allocated by build that are still held by what
+            it returned
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def benchmark(N0, N):
+    """
+    Input:  - N0, number of leaves
+            - N, size of the population the tree is simulated in
+    Output: prints bytes per node of the same tree stored as slotted 
+            MetricTrees, as __dict__ based nodes and as an ArrayTree
+    """
+    template = ArrayTree.FromTree(MetricTree.EvolveFast(N0, N))
+    parents = template.parent.tolist()
+    heights = template.heights.tolist()
+    names = template.names
+    
+    def build(cls):
+        nodes = []
+        for i in range(template.size):
+            children = [nodes[c] for c in template.children(i).tolist()]
+            nodes.append(cls(children, None, heights[i], names[i]))
+        return nodes
+    
+    size = template.size
+    slotted = measure(lambda: build(MetricTree)) / size
+    with_dict = measure(lambda: build(DictNode)) / size
+    arrays = measure(lambda: ArrayTree.FromParents(parents, heights, 
+                                                   names)) / size
+    print('nodes:', template.size)
+    print('MetricTree with __slots__: %.1f bytes per node' % slotted)
+    print('node with __dict__:        %.1f bytes per node' % with_dict)
+    print('ArrayTree:                 %.1f bytes per node' % arrays)
+
+
+if __name__ == '__main__':
+    benchmark(10000, 10**6)
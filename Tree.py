@@ -1,10 +1,17 @@
 import DistMatr
 import pexp
+import sample
+import splits
 
 import random as rnd
+import math
+import collections
+import hashlib
+import struct
 import numpy as np
 import sys
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection
 import inspect
 
 
@@ -30,6 +37,9 @@ class CombinatorialTree(object):
 ############################################################################## 
 
 
+    # no per node __dict__, forests hold millions of nodes
+    __slots__ = ('__parent', '__children', '__name', '__cache')
+
     # pexp_class = pexp.Pexp
             
     # distmatr_class = DistMatr.DistanceMatrix
@@ -44,6 +54,10 @@ class CombinatorialTree(object):
         self.__parent = parent
         self.__name = name
         self.__children = children
+        # cached subtree aggregates (height, leaves, ...), a dictionary 
+        # created on first use and dropped by _invalidate whenever the 
+        # subtree below changes
+        self.__cache = None
         
         for child in children:
             child.__parent = self
@@ -116,15 +130,11 @@ class CombinatorialTree(object):
         Acts on:    a CombinatorialTree
         Input:      none
         Output:     depth of a combinatorial tree (unbalanced non metric tree)
-        Type:       property
+        Type:       property, cached
         """
-        if self.children == []:
-            return 0.
-        else:
-            d = 0.
-            for child in self.children:
-                d = max(d, child.height)
-            return d + 1.
+        return self._aggregate('height', 
+                               lambda node, values: max(values, default = -1.) 
+                               + 1.)
         
     @property
     def is_leaf(self):
@@ -157,16 +167,13 @@ class CombinatorialTree(object):
         Acts on:    a CombinatorialTree
         Input:      none
         Output:     a sorted list of names of leaves of the tree that is being 
-                    acted on
-        Type:       property
+                    acted on (cached, do not modify the returned list)
+        Type:       property, cached
         """
-        if self.children == []:
-            return [self.name]
-        else:
-            L = []
-            for child in self.children:
-                L = L + child.leaves_names
-            return sorted(L)
+        L = self._cached('leaves_names')
+        if L is None:
+            L = self._store('leaves_names', [leaf.name for leaf in self.leaves])
+        return L
         
     @property
     def leaves(self):
@@ -174,16 +181,28 @@ class CombinatorialTree(object):
         Acts on:    a CombinatorialTree
         Input:      none
         Output:     a list of trees of leaves the tree, which is being acted 
-                    on, has, sorted alphabetically
-        Type:       property
+                    on, has, sorted alphabetically (cached, do not modify the 
+                    returned list)
+        Type:       property, cached
         """
-        if self.children == []:
-            return [self]
-        else:
+        L = self._cached('leaves')
+        if L is None:
+            # only self keeps the list, subtrees that already have one 
+            # are not walked again
             L = []
-            for child in self.children:
-                L = L + child.leaves
-            return sorted(L, key = lambda x: x.name)
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                cached = node._cached('leaves')
+                if cached is not None:
+                    L.extend(cached)
+                elif node.children == []:
+                    L.append(node)
+                else:
+                    stack.extend(node.children)
+            L.sort(key = lambda x: x.name)
+            self._store('leaves', L)
+        return L
         
     @property
     def Nleaves(self):
@@ -191,16 +210,10 @@ class CombinatorialTree(object):
         Acts on:    a CombinatorialTree
         Input:      none
         Output:     number of leaves the tree has
-        Used in:    __plot
-        Type:       property
+        Type:       property, cached
         """
-        if self.children == []:
-            return 1
-        else:
-            L = 0
-            for child in self.children:
-                L = L + child.Nleaves
-            return L 
+        return self._aggregate('Nleaves', 
+                               lambda node, values: max(sum(values), 1))
     
     @property
     def _smallest_leaf_name(self):
@@ -208,17 +221,198 @@ class CombinatorialTree(object):
     
     @property
     def edges(self):
-        ans = len(self.children)
-        for child in self.children:
-            ans += child.edges
+        ans = 0
+        for node in self.preorder():
+            ans += len(node.children)
         return ans
     
+    @property
+    def canonical_hash(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     16 byte digest of the tree computed bottom-up from its 
+                    name, its height (MetricTree only) and the sorted digests 
+                    of its children, so that equal trees have equal digests 
+                    whatever the order of the children
+        Used in:    __eq__, __hash__
+        Type:       property, cached
+        """
+        return self._aggregate('canonical_hash', type(self)._node_hash)
+    
+    @property
+    def lca_index(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     an LCAIndex of the tree rooted at self, built on first 
+                    access; once the index of the root is built 
+                    common_ancestor answers in O(1)
+        Type:       property, cached
+        """
+        index = self._cached('lca_index')
+        if index is None:
+            index = self._store('lca_index', LCAIndex(self))
+        return index
+    
+    @property
+    def leaf_index(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     dictionary from names of leaves to the leaves of the 
+                    whole tree self is part of; it is kept at the root, 
+                    built on first access and then kept current by _link 
+                    and _unlink
+        Type:       property, cached at the root
+        """
+        root = self.my_root
+        index = root._cached('leaf_index')
+        if index is None:
+            index = dict()
+            for node in root.preorder():
+                if node.children == []:
+                    index[node.name] = node
+            root._store('leaf_index', index)
+        return index
+    
     
 ##############################################################################
 ################################## METHODS ###################################
 ############################################################################## 
 
 
+    def preorder(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     generator of the trees of the subtree of self, every tree 
+                    before its children (explicit stack, no recursion)
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+    
+    def postorder(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     generator of the trees of the subtree of self, every tree 
+                    after its children (explicit stack, no recursion)
+        """
+        stack = [(self, False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited:
+                yield node
+            else:
+                stack.append((node, True))
+                for child in reversed(node.children):
+                    stack.append((child, False))
+    
+    def levelorder(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     generator of the trees of the subtree of self, level by 
+                    level starting from self
+        """
+        queue = collections.deque([self])
+        while queue:
+            node = queue.popleft()
+            yield node
+            queue.extend(node.children)
+    
+    def _cached(self, key):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      key, a string, name of a cached value
+        Output:     the cached value, None if it is not cached
+        """
+        if self.__cache is None:
+            return None
+        return self.__cache.get(key)
+    
+    def _store(self, key, value):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      - key, a string, name of a cached value
+                    - value, its value (not None)
+        Output:     stores value in the cache of self and returns it
+        """
+        if self.__cache is None:
+            self.__cache = dict()
+        self.__cache[key] = value
+        return value
+    
+    def _aggregate(self, key, combine):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      - key, a string, name of the cached value
+                    - combine, function of a tree and the list of values of 
+                    its children (empty for leaves) giving the value of the 
+                    tree
+        Output:     the value for self, computed in postorder for every tree 
+                    below self that does not have it cached yet
+        Used in:    height, Nleaves, canonical_hash
+        """
+        value = self._cached(key)
+        if value is not None:
+            return value
+        stack = [(self, False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited:
+                value = node._store(key, combine(node, [child._cached(key) 
+                                                 for child in node.children]))
+            elif node._cached(key) is None:
+                stack.append((node, True))
+                for child in node.children:
+                    stack.append((child, False))
+        return value
+
+    def _node_hash(self, children_hashes):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      children_hashes, list of canonical hashes of the children
+        Output:     canonical hash of self
+        Used in:    canonical_hash
+        """
+        if self.__class__._check_height():
+            return CombinatorialTree._digest(self.name, self.height,
+                                             children_hashes)
+        return CombinatorialTree._digest(self.name, None, children_hashes)
+
+    def cophenetic_matrix(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     2-tuple of the sorted list of leaf names and NumPy matrix 
+                    of distances between the leaves (twice the height of 
+                    their common ancestor), computed in one postorder pass
+        """
+        return ArrayTree.FromTree(self).cophenetic_matrix()
+
+    def _invalidate(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     drops the cached aggregates of self and of every tree 
+                    up the parent chain to the root (but the leaf index)
+        Used in:    _link, _unlink
+        """
+        node = self
+        while node is not None:
+            if (node.__parent is None and node.__cache is not None 
+                and 'leaf_index' in node.__cache):
+                # the leaf index of the root is updated, not dropped
+                node.__cache = {'leaf_index': node.__cache['leaf_index']}
+            else:
+                node.__cache = None
+            node = node.__parent
+
     def _link(self, other): 
         """
         Acts on:    a CombinatorialTree
@@ -230,8 +424,17 @@ class CombinatorialTree(object):
             if self.height <= other.height:
                 raise TreeStructureError('''Child's height has to be greater  
                 than parent's.''')
+        root = self.my_root
+        index = root._cached('leaf_index')
+        if index is not None:
+            if self.__children == [] and index.get(self.__name) is self:
+                del index[self.__name]
+            index.update(other.leaf_index)
+        if other.__cache is not None:
+            other.__cache.pop('leaf_index', None)
         self.__children.append(other)
         other.__parent = self
+        self._invalidate()
         
     def _unlink(self, other):
         """
@@ -240,8 +443,21 @@ class CombinatorialTree(object):
         Output:     removes other from children of self and makes the parent 
                     of other None.
         """
-        self.__children.remove(other)
+        # by identity, == compares whole subtrees by their content
+        del self.__children[next(i for (i, child) 
+                                 in enumerate(self.__children) 
+                                 if child is other)]
         other.__parent = None
+        index = self.my_root._cached('leaf_index')
+        if other.__cache is not None:
+            other.__cache.pop('leaf_index', None)
+        if index is not None:
+            for (name, leaf) in other.leaf_index.items():
+                if index.get(name) is leaf:
+                    del index[name]
+            if self.__children == []:
+                index[self.__name] = self
+        self._invalidate()
     
     def _is_type_tree(self, other):
         """
@@ -290,44 +506,128 @@ class CombinatorialTree(object):
         Input:      none
         Output:     create a copy of the tree and all its children    
         """
-        if self.__class__._check_height():
-            newtree = MetricTree([], self.parent, self.height, self.name)
-        else:
-            newtree = CombinatorialTree([], self.parent, self.name)
-        for child in self.children:
-            newtree._link(child.copy())
-        return newtree
+        copies = dict()
+        for node in self.postorder():
+            children = [copies.pop(id(child)) for child in node.children]
+            if node is self:
+                parent = self.parent
+            else:
+                parent = None
+            if self.__class__._check_height():
+                copies[id(node)] = MetricTree(children, parent, node.height, 
+                                              node.name)
+            else:
+                copies[id(node)] = CombinatorialTree(children, parent, 
+                                                     node.name)
+        return copies[id(self)]
+    
+    def restrict(self, names):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      names, an iterable of names of leaves of self
+        Output:     new tree induced by the leaves with these names, where 
+                    trees left with one child are replaced by that child, 
+                    built in one postorder pass (None if names is empty)
+        """
+        return self.restrict_many([names])[0]
+    
+    def restrict_many(self, subsets):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      subsets, a list of iterables of names of leaves of self
+        Output:     list of the trees induced by the subsets (as restrict); 
+                    the nodes of self are listed once and each subset then 
+                    costs one pass over the list
+        """
+        nodes = list(self.postorder())
+        position = {id(node): k for (k, node) in enumerate(nodes)}
+        children = [[position[id(child)] for child in node.children] 
+                    for node in nodes]
+        # only the leaves under self, the leaf index is the one of the root
+        leaves = set(node.name for node in nodes if node.children == [])
+        metric = self.__class__._check_height()
+        restricted = []
+        for names in subsets:
+            names = set(names)
+            for name in names:
+                if name not in leaves:
+                    raise ValueError('Tree has no leaf ' + str(name) + '.')
+            built = [None] * len(nodes)
+            for (k, node) in enumerate(nodes):
+                if children[k] == []:
+                    if node.name not in names:
+                        continue
+                    kept = []
+                else:
+                    kept = [built[c] for c in children[k] 
+                            if built[c] is not None]
+                    if len(kept) == 0:
+                        continue
+                    if len(kept) == 1:
+                        built[k] = kept[0]
+                        continue
+                if metric:
+                    built[k] = MetricTree(kept, None, node.height, node.name)
+                else:
+                    built[k] = CombinatorialTree(kept, None, node.name)
+            restricted.append(built[-1])
+        return restricted
     
     def common_ancestor(self, name_or_tree_list):
         """
         Acts on:    a CombinatorialTree
-        Input:      a list of names (strings) or CombinatorialTrees of leaves 
-                    of a tree
+        Input:      a list of names (strings, or integer ids) or 
+                    CombinatorialTrees of leaves of a tree
         Output:     a CombinatorialTree of the common ancestor of the leaves 
-                    in the list and the tree that is being acted on
-        """
-        type_0 = type(name_or_tree_list[0])
-        if type_0 is not str and type_0 is not type(self):
-            raise TypeError('Input list has to be a string or Tree list.')
-        ancestor = self
-        if type_0 is str:
-            leaves_list = ancestor.leaves_names
-            for name_or_tree in name_or_tree_list:
-                if type(name_or_tree) is not str:
-                    raise TypeError('Input list has to be all strings.')
-        if type_0 is type(self):
-            leaves_list = ancestor.leaves
-            for name_or_tree in name_or_tree_list:
-                if type(name_or_tree) is not type(self):
-                    raise TypeError('Input list has to be all Trees.')
+                    in the list and the tree that is being acted on (uses 
+                    the LCAIndex of the root if it has been built, names are 
+                    found through the leaf index); raises ValueError if a 
+                    name is not a leaf of the tree
+        """
+        trees = isinstance(name_or_tree_list[0], CombinatorialTree)
         for name_or_tree in name_or_tree_list:
-            if name_or_tree not in leaves_list:
-                if ancestor.parent is None:
-                    return None
-                else:
-                    ancestor = ancestor.parent 
-                    return ancestor.common_ancestor(name_or_tree_list)
-        return ancestor
+            if isinstance(name_or_tree, CombinatorialTree) != trees:
+                if trees:
+                    raise TypeError('Input list has to be all Trees.')
+                raise TypeError('Input list has to be all names.')
+        index = self.my_root._cached('lca_index')
+        if index is not None:
+            return index.common_ancestor([self] + list(name_or_tree_list))
+        if not trees:
+            leaf_index = self.leaf_index
+            nodes = []
+            for name in name_or_tree_list:
+                if name not in leaf_index:
+                    raise ValueError('Leaf ' + str(name) + ''' is not in the 
+                    tree.''')
+                nodes.append(leaf_index[name])
+        else:
+            nodes = list(name_or_tree_list)
+        # ancestors of self, the answer is the highest one any node reaches
+        path = []
+        position = dict()
+        node = self
+        while node is not None:
+            position[id(node)] = len(path)
+            path.append(node)
+            node = node.parent
+        top = 0
+        for node in nodes:
+            while node is not None and id(node) not in position:
+                node = node.parent
+            if node is None:
+                return None
+            top = max(top, position[id(node)])
+        return path[top]
+
+    def leaf(self, name):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      name, name of a leaf
+        Output:     the leaf with that name in the tree self is part of, None
+                    if there is no such leaf; O(1) through the leaf index
+        """
+        return self.leaf_index.get(name)
 
     def delete(self):
         """
@@ -340,8 +640,13 @@ class CombinatorialTree(object):
         """
         if self.parent is not None:
             self.parent._unlink(self)
-        for child in self.children:
-            child.delete()
+        # nothing is left to look up, so the leaf index is not maintained
+        if self.__cache is not None:
+            self.__cache.pop('leaf_index', None)
+        # top-down, so every unlinked tree is already detached from above
+        for node in list(self.preorder()):
+            for child in node.children[:]:
+                node._unlink(child)
             
     def promote(self):
         """
@@ -352,11 +657,16 @@ class CombinatorialTree(object):
         turn combinatorial tree into metric tree. Change class
         and write depth into the height slots
         """
-        children = []
-        for child in self.children:
-            children.append(child.promote())
-        return MetricTree(children, self.parent, float(self.height), 
-                          self.name)
+        promoted = dict()
+        for node in self.postorder():
+            children = [promoted.pop(id(child)) for child in node.children]
+            if node is self:
+                parent = self.parent
+            else:
+                parent = None
+            promoted[id(node)] = MetricTree(children, parent, 
+                                            float(node.height), node.name)
+        return promoted[id(self)]
             
     def __str__(self):
         """
@@ -373,8 +683,13 @@ class CombinatorialTree(object):
         Input:      none
         Output:     prints the CombinatorialTree in the form that you get plug
                     back into python and create equivalent CombinatorialTree
+                    (through its ArrayTree if a leaf is not named by a 
+                    string, the Pexp form would read integer ids back as 
+                    strings)
         Short form: self (enter)
         """
+        if any(type(name) is not str for name in self.leaves_names):
+            return repr(ArrayTree.FromTree(self)) + '.to_tree()'
         if self.__class__._check_height():
             return ('MetricTree.FromPexp(' 
                     + pexp.Pexp.FromTree(self).__repr__() + ')')
@@ -386,29 +701,22 @@ class CombinatorialTree(object):
         """
         Acts on:    a CombinatorialTree
         Input:      other, a CombinatorialTree
-        Output:     a boolean indicating the equivalance of self and other
+        Output:     a boolean indicating the equivalance of self and other,
+                    O(1) once the canonical hashes are computed
         """
         self._is_type_tree(other)
-        if self.name != other.name:
-            return False
-        if self.__class__._check_height():
-            if self.height != other.height:
-                return False
-        if self.is_leaf and other.is_leaf:
-            return True
-        if len(self.children) != len(other.children):
-            return False
-        if set(self.leaves_names) != set(other.leaves_names):
-            return False
-        children1 = sorted(self.children, 
-                           key = lambda x: x._smallest_leaf_name)
-        children2 = sorted(other.children, 
-                           key = lambda x: x._smallest_leaf_name)
-        N = len(children1)
-        for i in range(N):
-            if children1[i] != children2[i]:
-                return False
-        return True
+        return self.canonical_hash == other.canonical_hash
+    
+    def __hash__(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     integer hash consistent with __eq__, taken from the 
+                    canonical hash (changes if the tree is modified, so do 
+                    not modify trees used in sets or as dictionary keys)
+        Short form: hash(self)
+        """
+        return int.from_bytes(self.canonical_hash[:8], 'little')
     
     
 ##############################################################################
@@ -416,41 +724,78 @@ class CombinatorialTree(object):
 ############################################################################## 
         
 
-    def __plot(self,leaves_left):
+    def _layout(self):
+        """
+        Acts on:    a CombinatorialTree
+        Input:      none
+        Output:     tuple of list of nodes in postorder, NumPy array of their
+                    x coordinates and NumPy array of their y coordinates 
+                    (heights); leaves are spread at 0, 1, 2, ... and every 
+                    other node sits above the middle of its first and last 
+                    child
+        Used in:    __plot
+        """
+        nodes = list(self.postorder())
+        index = {id(node): k for (k, node) in enumerate(nodes)}
+        xs = np.empty(len(nodes), dtype = np.float64)
+        ys = np.empty(len(nodes), dtype = np.float64)
+        leaves_left = 0
+        for (k, node) in enumerate(nodes):
+            children = node.children
+            if children == []:
+                xs[k] = leaves_left
+                leaves_left += 1
+            else:
+                xs[k] = (xs[index[id(children[0])]] 
+                         + xs[index[id(children[-1])]]) / 2
+            ys[k] = node.height
+        return (nodes, xs, ys)
+        
+
+    def __plot(self, ax, labels = True):
         """
         Acts on:    a CombinatorialTree
-        Input:      leaves_left, positive integer that is the number of leaves 
-                    that are situated to the left of the specified tree
+        Input:      - ax, matplotlib Axes to draw on
+                    - labels, a boolean, whether to write names of leaves
         Output:     Draws a graph of the tree of the tree, its children, and  
-                    its children's children, etc. (does not print yet)
+                    its children's children, etc. (does not print yet); all
+                    edges are drawn as one LineCollection
         Used in:    plot
         """
-        # plot a dot for self
-        # self.__children = sorted(self.__children, key = lambda x: x.first_leaf)
-        my_x = leaves_left + (self.Nleaves - 1.)/2
-        my_y = self.height
-        plt.scatter([my_x], [my_y])
-        if self.is_leaf:
-            plt.annotate(str(self.name), xy = (my_x, my_y), 
-                         xytext = (my_x + 0.1, my_y),)
-        # plot children subtrees
-        leaves_covered = leaves_left
-        for child in self.children :
-            ((x, y), leaves_covered) = child.__plot(leaves_covered)
-            plt.plot([my_x, x], [my_y, my_y], '-k')
-            plt.plot([x, x], [my_y, y],  '-k')
-        return ((my_x, my_y), leaves_left + self.Nleaves)        
+        (nodes, xs, ys) = self._layout()
+        index = {id(node): k for (k, node) in enumerate(nodes)}
+        segments = []
+        for (k, node) in enumerate(nodes):
+            for child in node.children:
+                c = index[id(child)]
+                segments.append(((xs[k], ys[k]), (xs[c], ys[k])))
+                segments.append(((xs[c], ys[k]), (xs[c], ys[c])))
+        ax.add_collection(LineCollection(segments, colors = 'k'))
+        ax.scatter(xs, ys, c = np.arange(len(nodes)) % 10, cmap = 'tab10', 
+                   s = 10, zorder = 2)
+        if labels:
+            for (k, node) in enumerate(nodes):
+                if node.is_leaf:
+                    ax.annotate(str(node.name), xy = (xs[k], ys[k]), 
+                                xytext = (xs[k] + 0.1, ys[k]))
+        ax.autoscale_view()
 
 
-    def plot(self):
+    def plot(self, filename = None, labels = True):
         """
         Acts on:    a CombinatorialTree
-        Input:      none
-        Output:     prints the corresponding tree graph for the tree
+        Input:      - filename, a string or None
+                    - labels, a boolean, whether to write names of leaves
+        Output:     prints the corresponding tree graph for the tree, or 
+                    saves it to filename without showing it if one is given
         """
-        plt.figure()
-        self.__plot(0)
-        plt.show()
+        fig = plt.figure()
+        self.__plot(fig.add_subplot(1, 1, 1), labels)
+        if filename is None:
+            plt.show()
+        else:
+            fig.savefig(filename)
+            plt.close(fig)
         
         
 ##############################################################################
@@ -466,7 +811,34 @@ class CombinatorialTree(object):
         Output:     True
         """
         return False
-    
+
+    @staticmethod
+    def _digest(name, height, children_hashes):
+        """
+        Acts on:    CombinatorialTree class
+        Input:      - name, name of a tree
+                    - height, a float (None for trees without heights)
+                    - children_hashes, list of canonical hashes of children
+        Output:     16 byte canonical hash of the tree
+        Used in:    _node_hash, PersistentTree
+        Type:       staticmethod
+        """
+        digest = hashlib.blake2b(digest_size = 16)
+        if name is None:
+            digest.update(b'-')
+        else:
+            if isinstance(name, str):
+                name = b's' + str(name).encode()
+            else:
+                name = b'r' + repr(name).encode()
+            digest.update(struct.pack('<q', len(name)) + name)
+        if height is not None:
+            # adding 0. turns -0. into 0.
+            digest.update(struct.pack('<d', height + 0.))
+        for child_hash in sorted(children_hashes):
+            digest.update(child_hash)
+        return digest.digest()
+
     
 ##############################################################################
 ################################ CLASSMETHODS ################################
@@ -478,27 +850,157 @@ class CombinatorialTree(object):
         """
         Acts on:    CombinatorialTree class
         Input:      a Pexp object
-        Output:     CombinatorialTree equivalent of the input Pexp object
+        Output:     CombinatorialTree equivalent of the input Pexp object 
+                    (read in one pass with a stack of open nodes, so deep
+                    trees do not reach the recursion limit)
         Type:       classmethod
         """
         if type(pexp_input) is not pexp.Pexp:
             raise TypeError("Input has to be a Pexp.")
+        metric = cls._check_height()
+        string = pexp_input.string
         if pexp_input.is_leaf:
-            name = pexp_input.string
-            if cls._check_height():
-                return cls([], None, 0., name)
+            if metric:
+                return cls([], None, 0., string)
+            return cls([], None, string)
+        stops = (pexp.Pexp.sepchildren, pexp.Pexp.closeparen)
+        # children found so far of every node whose ')' is not reached yet
+        opened = []
+        root = None
+        (i, n) = (0, len(string))
+        while i < n:
+            char = string[i]
+            if char == pexp.Pexp.openparen:
+                opened.append([])
+                i += 1
+                continue
+            if char == pexp.Pexp.sepchildren:
+                i += 1
+                continue
+            if opened == []:
+                raise pexp.PexpStructureError('Unbalanced parantheses.')
+            # a name, or the ':height' after a ')', runs up to ',' or ')'
+            j = i + 1
+            while j < n and string[j] not in stops:
+                j += 1
+            if char != pexp.Pexp.closeparen:
+                if metric:
+                    opened[-1].append(cls([], None, 0., string[i:j]))
+                else:
+                    opened[-1].append(cls([], None, string[i:j]))
+                i = j
+                continue
+            children = opened.pop()
+            if not metric:
+                node = cls(children, None)
+            elif pexp.Pexp.sepheight in string[i:j]:
+                height = string[i:j].split(pexp.Pexp.sepheight)[-1]
+                node = cls(children, None, float(height))
+            else:
+                node = cls(children, None, 0.)
+            if opened == []:
+                root = node
             else:
-                return cls([], None, name)
+                opened[-1].append(node)
+            i = j
+        if opened != [] or root is None:
+            raise pexp.PexpStructureError('Unbalanced parantheses.')
+        return root
+
+    @classmethod
+    def Consensus(cls, trees, threshold = 0.5, greedy = False, 
+                  max_clades = None):
+        """
+        Acts on:    CombinatorialTree or MetricTree class
+        Input:      - trees, an iterable (may be a generator, a TreeEnsemble 
+                    or a TreeFile) of trees with the same leaves
+                    - threshold, a float, clades found in more than this 
+                    fraction of the trees are kept
+                    - greedy, a boolean, if True clades are added in order 
+                    of decreasing count as long as they are compatible with 
+                    the ones added before, whatever their count
+                    - max_clades, a positive integer or None; if given, at 
+                    most that many clade counters are kept (Misra-Gries), 
+                    so counts may be low by at most the number of trees 
+                    divided by max_clades + 1 (it should be well above the 
+                    number of clades of one tree)
+        Output:     tree of the class acted on of the majority rule (or 
+                    greedy) consensus, its clades counted in a dictionary 
+                    keyed by leaf bitsets; a MetricTree has the depths of 
+                    the nodes as heights (as promote)
+        Type:       classmethod
+        """
+        if type(trees) is TreeEnsemble:
+            ensemble = trees
+            trees = (ensemble.array(r) for r in range(len(ensemble)))
+        if max_clades is not None and max_clades < 1:
+            raise ValueError('Number of clades has to be positive.')
+        index = None
+        counts = dict()
+        N = 0
+        for tree in trees:
+            if index is None:
+                index = splits.leaf_index(tree.leaves_names)
+            N += 1
+            for bits in splits.clades(tree, index):
+                if bits & (bits - 1) == 0:
+                    continue
+                if bits in counts:
+                    counts[bits] += 1
+                elif max_clades is None or len(counts) < max_clades:
+                    counts[bits] = 1
+                else:
+                    # no room: every counter, the new one included, loses 
+                    # one and the ones at zero are dropped
+                    counts = {b: c - 1 for (b, c) in counts.items() if c > 1}
+        if index is None:
+            raise ValueError('Input has to contain at least one tree.')
+        ordered = sorted(counts, key = lambda b: (-counts[b], 
+                                                  -bin(b).count('1'), b))
+        accepted = []
+        for bits in ordered:
+            if not greedy and counts[bits] <= threshold * N:
+                break
+            if all(bits & other == 0 or bits & other in (bits, other) 
+                   for other in accepted):
+                accepted.append(bits)
+        # larger clades first, each hung below the smallest one seen so far
+        # that holds its lowest leaf
+        names = sorted(index, key = lambda name: index[name])
+        metric = cls._check_height()
+        if metric:
+            leaves = [cls([], None, 0., name) for name in names]
         else:
-            children_trees = []
-            children = pexp_input.children
-            for child in children:
-                children_trees.append(cls.FromPexp(child))
-            if cls._check_height():
-                height = float(pexp_input.height)
-                return cls(children_trees, None, height)
+            leaves = [cls([], None, name) for name in names]
+        accepted.sort(key = lambda b: -bin(b).count('1'))
+        clade_of = [-1] * len(names)
+        children = [[] for _ in range(len(accepted) + 1)]
+        for (k, bits) in enumerate(accepted):
+            low = (bits & -bits).bit_length() - 1
+            children[clade_of[low]].append(k)
+            for leaf in range(len(names)):
+                if bits >> leaf & 1:
+                    clade_of[leaf] = k
+        for (leaf, k) in enumerate(clade_of):
+            children[k].append(len(accepted) + leaf)
+        # the root is clade -1, that is the last list of children
+        built = dict()
+        depth = dict()
+        for k in list(range(len(accepted) - 1, -1, -1)) + [-1]:
+            subtrees = []
+            below = 0.
+            for c in children[k]:
+                if c >= len(accepted):
+                    subtrees.append(leaves[c - len(accepted)])
+                else:
+                    subtrees.append(built.pop(c))
+                    below = max(below, depth.pop(c))
+            depth[k] = below + 1.
+            if metric:
+                built[k] = cls(subtrees, None, depth[k])
             else:
-                return cls(children_trees, None)
+                built[k] = cls(subtrees, None)
+        return built[-1]
 
 
 ##############################################################################
@@ -518,6 +1020,8 @@ class MetricTree(CombinatorialTree):
 
     first_letter = ord('a')
     
+    __slots__ = ('__height',)
+    
     
 ##############################################################################
 ################################# INITIALIZE #################################
@@ -592,10 +1096,35 @@ class MetricTree(CombinatorialTree):
         Output:     a CombinatorialTree equivalent where all the heights 
                     are removed
         """
-        children = []
+        demoted = dict()
+        for node in self.postorder():
+            children = [demoted.pop(id(child)) for child in node.children]
+            if node is self:
+                parent = self.parent
+            else:
+                parent = None
+            demoted[id(node)] = CombinatorialTree(children, parent, node.name)
+        return demoted[id(self)]
+
+    def _set_height(self, height):
+        """
+        Acts on:    a MetricTree
+        Input:      height, a float between the heights of the children and
+                    the height of the parent of self
+        Output:     moves self to the new height and drops the cached
+                    aggregates up to the root
+        """
+        if type(height) is not float and type(height) is not np.float64:
+            raise TypeError('Input (height) has to be a float.')
         for child in self.children:
-            children.append(child.demote())
-        return CombinatorialTree(children, self.parent, self.name)
+            if child.__height >= height:
+                raise TreeStructureError('''Height of children has to be
+                smaller than height of parent.''')
+        if self.parent is not None and self.parent.__height <= height:
+            raise TreeStructureError('''Child's height has to be smaller
+            than parent's.''')
+        self.__height = height
+        self._invalidate()
             
 
 ##############################################################################
@@ -611,6 +1140,58 @@ class MetricTree(CombinatorialTree):
         Output:     True
         """
         return True
+    
+    @staticmethod
+    def _check_population(N0, N):
+        """
+        Acts on:    MetricTree class
+        Input:      - N0, natural number of leaf trees 
+                    - N, natural number of individuals in each generation
+        Output:     nothing if N0 and N are valid inputs of Evolve, an error 
+                    message otherwise
+        Used in:    Evolve, EvolveFast, EvolveMany, Kingman
+        """
+        if type(N0) is not int: 
+            raise TypeError('First input has to be integer.')
+        if N0 <= 0:
+            raise ValueError('First input has to be a positive integer.')
+        if type(N) is not int:
+            raise TypeError('Second input has to be integer.')
+        if N < N0:
+            raise ValueError('''Second input has to be greater than or equal 
+            to the first input.''')
+    
+    @staticmethod
+    def _leaf_name(i):
+        """
+        Acts on:    MetricTree class
+        Input:      i, a nonnegative integer
+        Output:     name of leaf i: a, b, ..., z, aa, ab, ..., az, ba, ...
+        Used in:    _leaf_names, LabelTable.Default
+        """
+        name = ''
+        i += 1
+        while i > 0:
+            (i, letter) = divmod(i - 1, 26)
+            name = chr(MetricTree.first_letter + letter) + name
+        return name
+    
+    @staticmethod
+    def _leaf_names(N0, integer_ids):
+        """
+        Acts on:    MetricTree class
+        Input:      - N0, natural number of leaves
+                    - integer_ids, a boolean
+        Output:     list of names of the leaves, 0, ..., N0 - 1 if 
+                    integer_ids is True (LabelTable.Default(N0) turns them 
+                    into the letter names)
+        Used in:    Evolve, EvolveFast, Kingman, EvolveMany
+        """
+        if type(integer_ids) is not bool:
+            raise TypeError('Input integer_ids has to be a boolean.')
+        if integer_ids:
+            return list(range(N0))
+        return [MetricTree._leaf_name(i) for i in range(N0)]
         
         
 ##############################################################################
@@ -619,28 +1200,51 @@ class MetricTree(CombinatorialTree):
               
               
     @classmethod
-    def Evolve(cls, N0, N):
+    def _merge(cls, a, b, height):
+        """
+        Acts on:    the tree class
+        Input:      - a, b, two roots
+                    - height, a float, height at which they merge
+        Output:     root of the merged tree: a new tree with children a and 
+                    b, or a (or b) itself if it is an internal tree of that 
+                    height already, so merges at the same height join into 
+                    one node. A merge at the height of a leaf is placed just
+                    above it.
+        Used in:    Kingman, FromDistArray, UPGMA
+        """
+        height = max(height, a.height, b.height)
+        a_joins = (not a.is_leaf and a.height == height)
+        b_joins = (not b.is_leaf and b.height == height)
+        if a_joins and b_joins:
+            for child in b.children[:]:
+                b._unlink(child)
+                a._link(child)
+            return a
+        elif a_joins:
+            a._link(b)
+            return a
+        elif b_joins:
+            b._link(a)
+            return b
+        if height <= max(a.height, b.height):
+            height = float(np.nextafter(height, np.inf))
+        return cls([a, b], None, height)
+    
+    @classmethod
+    def Evolve(cls, N0, N, integer_ids = False):
         """
         Acts on:    the tree class
         Input:      - N0, natural number of leaf trees 
                     - N, natural number of individuals in each generation  
                     parents are chosen from (N >= N0)
+                    - integer_ids, a boolean, if True leaves are named 
+                    0, ..., N0 - 1 instead of a, b, ...
         Output:     a tree, that contains in itself a tree with N0 leaves
         Type:       classmethod
         """
-        if type(N0) is not int: 
-            raise TypeError('First input has to be integer.')
-        if N0 <= 0:
-            raise ValueError('First input has to be a positive integer.')
-        if type(N) is not int:
-            raise TypeError('Second input has to be integer.')
-        if N < N0:
-            raise ValueError('''Second input has to be greater than or equal 
-            to the first input.''')
-        trees = []
-        for i in range(N0):
-            newtree = cls([], None, 0., chr(MetricTree.first_letter + i))
-            trees.append(newtree)
+        cls._check_population(N0, N)
+        trees = [cls([], None, 0., name) 
+                 for name in cls._leaf_names(N0, integer_ids)]
         t = 0.
         while len(trees) > 1:     
             t += 1.
@@ -654,62 +1258,1584 @@ class MetricTree(CombinatorialTree):
                 else:
                     klist.append(k)
                     hist.append([tree])    
-            index = 0
+            merged = set()
+            new_trees = []
             for nlist in hist:
                 freq = len(nlist)
                 if freq > 1:
-                    newtree = cls(nlist, None, t)
-                    trees.append(newtree)
-                    for tree in newtree.children:
-                        trees.remove(tree)
+                    new_trees.append(cls(nlist, None, t))
+                    merged.update(id(tree) for tree in nlist)
+            # by identity, == compares whole subtrees by their content
+            trees = ([tree for tree in trees if id(tree) not in merged] 
+                     + new_trees)
+        [root] = trees
+        return root
+    
+    @classmethod
+    def EvolveFast(cls, N0, N, integer_ids = False):
+        """
+        Acts on:    the tree class
+        Input:      - N0, natural number of leaf trees 
+                    - N, natural number of individuals in each generation  
+                    parents are chosen from (N >= N0)
+                    - integer_ids, a boolean, if True leaves are named 
+                    0, ..., N0 - 1 instead of a, b, ...
+        Output:     a tree with N0 leaves with the same distribution as the 
+                    output of Evolve, simulated event by event: generations 
+                    without coalescence are skipped with a geometric waiting
+                    time and nodes are only created at merges
+        Type:       classmethod
+        """
+        cls._check_population(N0, N)
+        trees = [cls([], None, 0., name) 
+                 for name in cls._leaf_names(N0, integer_ids)]
+        t = 0.
+        while len(trees) > 1:
+            k = len(trees)
+            # no_merge[j] is the probability that j lineages choose j 
+            # distinct parents
+            no_merge = [1., 1.]
+            for i in range(1, k):
+                no_merge.append(no_merge[-1] * (1. - i / N))
+            p0 = no_merge[-1]
+            # number of generations until one with a coalescence
+            if p0 > 0.:
+                u = 1. - rnd.random()
+                t += max(1., math.ceil(math.log(u) / math.log(p0)))
+            else:
+                t += 1.
+            # in that generation the first lineage to choose an already 
+            # chosen parent is lineage j with probability proportional to
+            # no_merge[j] - no_merge[j + 1]
+            u = rnd.random() * (1. - p0)
+            j = 1
+            while j < k - 1 and 1. - no_merge[j + 1] <= u:
+                j += 1
+            # by symmetry the first j distinct parents can be labeled 
+            # 0, ..., j - 1, lineage j picks one of them and the rest of
+            # the lineages pick any of the N parents
+            families = dict()
+            for i in range(j):
+                families[i] = [trees[i]]
+            families[rnd.randrange(j)].append(trees[j])
+            for tree in trees[j + 1:]:
+                k_parent = rnd.randrange(N)
+                if k_parent in families:
+                    families[k_parent].append(tree)
+                else:
+                    families[k_parent] = [tree]
+            trees = []
+            for nlist in families.values():
+                if len(nlist) > 1:
+                    trees.append(cls(nlist, None, t))
+                else:
+                    trees.append(nlist[0])
+        [root] = trees
+        return root
+    
+    @classmethod
+    def Kingman(cls, N0, N, discrete = False, integer_ids = False):
+        """
+        Acts on:    the tree class
+        Input:      - N0, natural number of leaf trees 
+                    - N, natural number of individuals in each generation  
+                    (N >= N0)
+                    - discrete, a boolean
+                    - integer_ids, a boolean, if True leaves are named 
+                    0, ..., N0 - 1 instead of a, b, ...
+        Output:     a tree with N0 leaves drawn from the Kingman coalescent 
+                    with heights in generations: while there are k lineages 
+                    the time to the next merge is exponential with rate 
+                    k(k-1)/(2N) and a uniformly random pair merges.
+                    If discrete is True heights are rounded up to integer
+                    generations like in Evolve, merges falling into the same 
+                    generation join into one node.
+        Type:       classmethod
+        """
+        cls._check_population(N0, N)
+        trees = [cls([], None, 0., name) 
+                 for name in cls._leaf_names(N0, integer_ids)]
+        t = 0.
+        while len(trees) > 1:
+            k = len(trees)
+            t += rnd.expovariate(k * (k - 1) / (2. * N))
+            # random pair: the merged tree takes the place of the first one, 
+            # the last tree takes the place of the second one
+            i = rnd.randrange(k)
+            j = rnd.randrange(k - 1)
+            if j >= i:
+                j += 1
+            (i, j) = (min(i, j), max(i, j))
+            (a, b) = (trees[i], trees[j])
+            trees[j] = trees[-1]
+            trees.pop()
+            if not discrete:
+                trees[i] = cls([a, b], None, t)
+                continue
+            trees[i] = cls._merge(a, b, max(1., float(math.ceil(t))))
         [root] = trees
         return root
     
+    @classmethod
+    def EvolveMany(cls, N0, N, R, integer_ids = False):
+        """
+        Acts on:    the tree class
+        Input:      - N0, natural number of leaf trees 
+                    - N, natural number of individuals in each generation  
+                    parents are chosen from (N >= N0)
+                    - R, natural number of replicates
+                    - integer_ids, a boolean, if True leaves are named 
+                    0, ..., N0 - 1 instead of a, b, ...
+        Output:     a TreeEnsemble of R independent trees with N0 leaves 
+                    each, distributed as the output of Evolve and simulated 
+                    together with the same events as EvolveFast, one 
+                    coalescence per replicate at each step
+        Type:       classmethod
+        """
+        cls._check_population(N0, N)
+        if type(R) is not int:
+            raise TypeError('Third input has to be integer.')
+        if R <= 0:
+            raise ValueError('Third input has to be a positive integer.')
+        M = 2 * N0 - 1
+        parent = np.full((R, M), -1, dtype = np.int64)
+        heights = np.zeros((R, M), dtype = np.float64)
+        sizes = np.full(R, N0, dtype = np.int64)
+        # lineages[r, :k[r]] are the nodes of the lineages of replicate r
+        lineages = np.tile(np.arange(N0, dtype = np.int64), (R, 1))
+        k = np.full(R, N0, dtype = np.int64)
+        t = np.zeros(R, dtype = np.float64)
+        # no_merge[j] is the probability that j lineages choose j distinct 
+        # parents
+        no_merge = np.ones(N0 + 1, dtype = np.float64)
+        no_merge[2:] = np.cumprod(1. - np.arange(1, N0) / N)
+        active = np.flatnonzero(k > 1)
+        while len(active) > 0:
+            kk = k[active]
+            p0 = no_merge[kk]
+            # geometric number of generations until one with a coalescence
+            u = 1. - np.random.random(len(active))
+            with np.errstate(divide = 'ignore'):
+                wait = np.ceil(np.log(u) / np.log(p0))
+            t[active] += np.where(p0 > 0., np.maximum(wait, 1.), 1.)
+            # first lineage j to choose an already chosen parent 
+            u = np.random.random(len(active)) * (1. - p0)
+            j = np.searchsorted(-no_merge, u - 1., side = 'right') - 1
+            j = np.clip(j, 1, kk - 1)
+            # labels of parents of all lineages of all active replicates
+            rep = np.repeat(np.arange(len(active)), kk)
+            start = np.concatenate(([0], np.cumsum(kk)[:-1]))
+            pos = np.arange(len(rep)) - start[rep]
+            jj = j[rep]
+            labels = np.where(pos < jj, pos, np.random.randint(0, N, len(rep)))
+            first_hit = (pos == jj)
+            labels[first_hit] = (np.random.random(len(j)) * j).astype(np.int64)
+            nodes = lineages[active[rep], pos]
+            (keys, first, inverse, counts) = np.unique(
+                rep * N + labels, return_index = True, return_inverse = True, 
+                return_counts = True)
+            group_rep = rep[first]
+            # number of every group among the groups of its replicate
+            n_groups = np.bincount(group_rep, minlength = len(active))
+            group_start = np.concatenate(([0], np.cumsum(n_groups)[:-1]))
+            group_pos = np.arange(len(keys)) - group_start[group_rep]
+            merged = (counts > 1)
+            n_merged = np.bincount(group_rep[merged], minlength = len(active))
+            merged_rank = np.cumsum(merged) - 1
+            merged_start = np.concatenate(([0], np.cumsum(n_merged)[:-1]))
+            group_node = nodes[first]
+            new_node = (sizes[active[group_rep]] + merged_rank 
+                        - merged_start[group_rep])
+            group_node[merged] = new_node[merged]
+            # link lineages of merging groups to the new nodes
+            lineage_merged = merged[inverse]
+            rows = active[rep[lineage_merged]]
+            parent[rows, nodes[lineage_merged]] = group_node[
+                inverse[lineage_merged]]
+            heights[active[group_rep[merged]], group_node[merged]] = t[
+                active[group_rep[merged]]]
+            sizes[active] += n_merged
+            lineages[active[group_rep], group_pos] = group_node
+            k[active] = n_groups
+            active = active[n_groups > 1]
+        names = cls._leaf_names(N0, integer_ids)
+        return TreeEnsemble(parent, heights, sizes, names)
+    
     @classmethod
     def FromDistMatr(cls, distmatr):
+        """
+        Acts on:    the tree class
+        Input:      distmatr, a DistanceMatrix of an ultrametric
+        Output:     the MetricTree whose distances between leaves are given 
+                    by distmatr (None for an empty matrix), see FromDistArray
+        Type:       classmethod
+        """
         if type(distmatr) is not DistMatr.DistanceMatrix:
             raise TypeError("Input has to be a DistMatr.")
-        leaves = distmatr.keys
+        (leaves, D) = distmatr.to_array()
         if len(leaves) == 0:
             return None
-        if len(leaves) == 1:
-            T = cls([], None, 0., leaves[0])
-            return T
-        usedleaves = leaves[:2]
-        leaf1 = cls([], None, 0., usedleaves[0])
-        leaf2 = cls([], None, 0., usedleaves[1])
-        T = cls([leaf1, leaf2], None, 
-                distmatr[usedleaves[0],usedleaves[1]]*1./2)
-        for leaf in leaves[2:]:
-            hist = []
-            for usedleaf in usedleaves:
-                dist = distmatr[usedleaf, leaf] * 1. / 2
-                state = False
-                for h in hist:
-                    if dist == h[0]:
-                        h[1].append(usedleaf)
-                        state = True
-                if state == False:
-                    hist.append((dist, [usedleaf]))
-            hist_sorted = sorted(hist, key = lambda x: x[0])
-            L = hist_sorted[0][1]
-            R = []
-            for h in hist_sorted[1:]:
-                R += h[1]
-            R = sorted(R)
-            for aleaf in T.leaves:
-                if L[0] == aleaf.name:
-                    baseleaf = aleaf
-            ca_L = baseleaf.common_ancestor(L)
-            if ca_L.leaves_names != L:
-                raise ValueError("Error.")
-            for l in L:
-                for r in R:
-                    if distmatr[l, r] != distmatr[leaf, r]:
-                        raise ValueError("Error.")
-            newleaf = cls([], None, 0., leaf)
-            newtree = cls([newleaf], None, distmatr[L[0], leaf] * 1./ 2)
-            ca_L.insert(newtree)
-            T = T.my_root
-            usedleaves.append(leaf)
-        return T
+        return cls.FromDistArray(leaves, D)
+    
+    @classmethod
+    def FromDistArray(cls, names, D):
+        """
+        Acts on:    the tree class
+        Input:      - names, list of n names of leaves
+                    - D, n x n NumPy array of distances between the leaves
+        Output:     the MetricTree whose distances between leaves (twice the 
+                    height of their common ancestor) are given by D, built by 
+                    single linkage in O(n^2): clusters are merged along the 
+                    edges of a minimum spanning tree of D in increasing 
+                    order, and every pair of leaves is checked against D 
+                    once, when its clusters merge. Raises ValueError if D is 
+                    not an ultrametric.
+        Type:       classmethod
+        """
+        D = np.asarray(D, dtype = np.float64)
+        n = len(names)
+        if D.shape != (n, n):
+            raise ValueError("Distance array has to be n x n for n names.")
+        if n == 0:
+            return None
+        if not np.array_equal(D, D.T) or np.any(np.diag(D) != 0.):
+            raise ValueError('''Distance array has to be symmetric with 
+            zeroes on the diagonal.''')
+        # minimum spanning tree by Prim's algorithm, one row of D per step
+        in_tree = np.zeros(n, dtype = bool)
+        in_tree[0] = True
+        best = D[0].copy()
+        best_from = np.zeros(n, dtype = np.int64)
+        best[0] = np.inf
+        edges = []
+        for _ in range(n - 1):
+            j = int(np.argmin(best))
+            edges.append((best[j], int(best_from[j]), j))
+            in_tree[j] = True
+            best[j] = np.inf
+            closer = (D[j] < best) & ~in_tree
+            best[closer] = D[j][closer]
+            best_from[closer] = j
+        edges.sort(key = lambda x: x[0])
+        # clusters of leaves: union-find over leaves plus tree and members 
+        # of every cluster kept at its representative
+        find = list(range(n))
+        trees = [cls([], None, 0., name) for name in names]
+        members = [[i] for i in range(n)]
+        for (d, u, v) in edges:
+            while find[u] != u:
+                find[u] = find[find[u]]
+                u = find[u]
+            while find[v] != v:
+                find[v] = find[find[v]]
+                v = find[v]
+            if not np.all(D[np.ix_(members[u], members[v])] == d):
+                raise ValueError("Distance matrix is not an ultrametric.")
+            height = float(d) / 2
+            if height <= 0.:
+                raise ValueError('''Distances between different leaves have 
+                to be positive.''')
+            newtree = cls._merge(trees[u], trees[v], height)
+            # the smaller cluster joins the larger one
+            if len(members[u]) < len(members[v]):
+                (u, v) = (v, u)
+            find[v] = u
+            members[u].extend(members[v])
+            members[v] = None
+            trees[u] = newtree
+            trees[v] = None
+        root = 0
+        while find[root] != root:
+            root = find[root]
+        return trees[root]
+
+
+    @classmethod
+    def UPGMA(cls, names, D):
+        """
+        Acts on:    the tree class
+        Input:      - names, list of n names of leaves
+                    - D, n x n NumPy array of distances between the leaves
+                    (need not be an ultrametric)
+        Output:     MetricTree built by UPGMA: the two closest clusters merge 
+                    at half their distance and the distance of the merged 
+                    cluster to any other is the size weighted mean of the two.
+                    The closest cluster of every row is kept, so only rows 
+                    that pointed to a merged cluster are scanned again.
+        Type:       classmethod
+        """
+        D = np.array(D, dtype = np.float64)
+        n = len(names)
+        if D.shape != (n, n):
+            raise ValueError("Distance array has to be n x n for n names.")
+        if n == 0:
+            return None
+        trees = [cls([], None, 0., name) for name in names]
+        sizes = np.ones(n, dtype = np.float64)
+        active = np.ones(n, dtype = bool)
+        np.fill_diagonal(D, np.inf)
+        row_arg = D.argmin(axis = 1)
+        row_min = D[np.arange(n), row_arg]
+        i = 0
+        for _ in range(n - 1):
+            i = int(np.argmin(row_min))
+            j = int(row_arg[i])
+            trees[i] = cls._merge(trees[i], trees[j], float(D[i, j]) / 2)
+            trees[j] = None
+            new = (D[i] * sizes[i] + D[j] * sizes[j]) / (sizes[i] + sizes[j])
+            sizes[i] += sizes[j]
+            active[j] = False
+            new[~active] = np.inf
+            new[i] = np.inf
+            D[i, :] = new
+            D[:, i] = new
+            D[j, :] = np.inf
+            D[:, j] = np.inf
+            row_min[j] = np.inf
+            # rows whose closest cluster was i or j are scanned again
+            stale = np.flatnonzero(active & ((row_arg == i) | (row_arg == j)))
+            if len(stale) > 0:
+                row_arg[stale] = D[stale].argmin(axis = 1)
+                row_min[stale] = D[stale, row_arg[stale]]
+            closer = active & (new < row_min)
+            row_min[closer] = new[closer]
+            row_arg[closer] = i
+            row_arg[i] = np.argmin(D[i])
+            row_min[i] = D[i, row_arg[i]]
+        return trees[i]
+    
+    @classmethod
+    def NeighborJoining(cls, names, D):
+        """
+        Acts on:    the tree class
+        Input:      - names, list of n names of leaves
+                    - D, n x n NumPy array of distances between the leaves
+        Output:     MetricTree with the topology found by neighbor joining, 
+                    rooted at the midpoint of its longest path. The height 
+                    of every node is the mean distance to its leaves (raised
+                    just above its children where branch lengths disagree).
+                    Every row keeps a lower bound of its smallest Q, its 
+                    minimum of W[i, j] - r[j] when last scanned lowered by 
+                    how much any r grew since; only rows whose bound is 
+                    below the best Q found so far are scanned (in the spirit
+                    of RapidNJ), so Q is never recomputed as a whole.
+        Type:       classmethod
+        """
+        W = np.array(D, dtype = np.float64)
+        n = len(names)
+        if W.shape != (n, n):
+            raise ValueError("Distance array has to be n x n for n names.")
+        if n <= 2:
+            return cls.UPGMA(names, W)
+        # unrooted tree: leaves 0, ..., n - 1, joined nodes n, n + 1, ...
+        neighbors = [[] for _ in range(2 * n - 2)]
+        ids = list(range(n))
+        R = W.sum(axis = 1)
+        np.fill_diagonal(W, np.inf)
+        # Q[i, j] / (m - 2) = W[i, j] - r[i] - r[j] >= low[i] - grown - r[i]
+        r_old = R / (n - 2)
+        low = (W - r_old[None, :]).min(axis = 1)
+        grown = 0.
+        joined = None
+        block = 32
+        m = n
+        next_id = n
+        while m > 2:
+            r = R[:m] / (m - 2)
+            if joined is not None:
+                growth = r - r_old[:m]
+                growth[joined] = 0.
+                grown += max(float(growth.max()), 0.)
+                # the joined node is a new column of every row
+                low[:m] = np.minimum(low[:m], W[:m, joined] - r[joined] 
+                                     + grown)
+                low[joined] = (W[joined, :m] - r).min() + grown
+            bound = low[:m] - grown - r
+            order = np.argsort(bound)
+            best = np.inf
+            for start in range(0, m, block):
+                rows = order[start:start + block]
+                rows = rows[bound[rows] < best]
+                if len(rows) == 0:
+                    break
+                Q = W[rows, :m] - r[None, :]
+                low[rows] = Q.min(axis = 1) + grown
+                Q -= r[rows, None]
+                (k, l) = divmod(int(Q.argmin()), m)
+                if Q[k, l] < best:
+                    best = Q[k, l]
+                    (i, j) = (int(rows[k]), l)
+            if i > j:
+                (i, j) = (j, i)
+            dij = W[i, j]
+            li = 0.5 * dij + (R[i] - R[j]) / (2. * (m - 2))
+            li = min(max(li, 0.), max(dij, 0.))
+            lj = max(dij - li, 0.)
+            neighbors[next_id].append((ids[i], li))
+            neighbors[ids[i]].append((next_id, li))
+            neighbors[next_id].append((ids[j], lj))
+            neighbors[ids[j]].append((next_id, lj))
+            wi = W[i, :m].copy()
+            wj = W[j, :m].copy()
+            wi[i] = 0.
+            wj[j] = 0.
+            new = 0.5 * (wi + wj - dij)
+            new[i] = 0.
+            new[j] = 0.
+            R[:m] += new - wi - wj
+            R[i] = new.sum()
+            W[i, :m] = new
+            W[:m, i] = new
+            W[i, i] = np.inf
+            ids[i] = next_id
+            next_id += 1
+            r_old[:m] = r
+            # row j is replaced by the last row
+            last = m - 1
+            if j != last:
+                W[j, :m] = W[last, :m]
+                W[:m, j] = W[:m, last]
+                W[j, j] = np.inf
+                R[j] = R[last]
+                ids[j] = ids[last]
+                r_old[j] = r_old[last]
+                low[j] = low[last]
+            joined = i
+            m -= 1
+        d01 = max(W[0, 1], 0.)
+        neighbors[ids[0]].append((ids[1], d01))
+        neighbors[ids[1]].append((ids[0], d01))
+        return cls._FromUnrooted(names, neighbors)
+    
+    @classmethod
+    def _FromUnrooted(cls, names, neighbors):
+        """
+        Acts on:    the tree class
+        Input:      - names, list of n names of the leaves 0, ..., n - 1
+                    - neighbors, list of lists of (node, branch length) of 
+                    an unrooted tree
+        Output:     MetricTree rooted at the midpoint of the longest path 
+                    between two leaves, every node at the mean distance to 
+                    its leaves
+        Used in:    NeighborJoining
+        """
+        def farthest(start):
+            # distances and parents from start, found with an explicit stack
+            dist = {start: 0.}
+            parent = {start: None}
+            stack = [start]
+            while stack:
+                u = stack.pop()
+                for (v, length) in neighbors[u]:
+                    if v not in dist:
+                        dist[v] = dist[u] + length
+                        parent[v] = u
+                        stack.append(v)
+            end = max(range(len(names)), key = lambda x: dist[x])
+            return (end, dist, parent)
+        (a, _, _) = farthest(0)
+        (b, dist, parent) = farthest(a)
+        # walk back from b to the edge that contains the midpoint
+        half = dist[b] / 2
+        v = b
+        while parent[v] is not None and dist[parent[v]] > half:
+            v = parent[v]
+        u = parent[v]
+        if u is None:
+            # longest path of length 0 (all distances 0), any edge of b
+            # holds its midpoint
+            (u, length) = neighbors[b][0]
+            dist[u] = length
+        # root splits the edge u - v
+        root = len(neighbors)
+        neighbors = [list(x) for x in neighbors] + [[]]
+        for (node, other, length) in ((u, v, half - dist[u]), 
+                                      (v, u, dist[v] - half)):
+            neighbors[node] = [(x, l) for (x, l) in neighbors[node] 
+                               if x != other]
+            neighbors[node].append((root, max(length, 0.)))
+            neighbors[root].append((node, max(length, 0.)))
+        # orient from the root, children before parents in order
+        order = []
+        up = {root: None}
+        stack = [root]
+        while stack:
+            x = stack.pop()
+            order.append(x)
+            for (y, length) in neighbors[x]:
+                if y not in up:
+                    up[y] = (x, length)
+                    stack.append(y)
+        count = dict()
+        mean = dict()
+        trees = dict()
+        for x in reversed(order):
+            children = [(y, l) for (y, l) in neighbors[x] 
+                        if up[x] is None or y != up[x][0]]
+            if x < len(names):
+                count[x] = 1
+                mean[x] = 0.
+                trees[x] = cls([], None, 0., names[x])
+                continue
+            count[x] = sum(count[y] for (y, l) in children)
+            mean[x] = sum(count[y] * (l + mean[y]) 
+                          for (y, l) in children) / count[x]
+            subtrees = [trees.pop(y) for (y, l) in children]
+            height = float(mean[x])
+            top = max(tree.height for tree in subtrees)
+            if height <= top:
+                height = float(np.nextafter(top, np.inf))
+            trees[x] = cls(subtrees, None, height)
+        return trees[root]
+    
+    @classmethod
+    def FromSample(cls, sample_input, method = 'upgma', mu = None):
+        """
+        Acts on:    the tree class
+        Input:      - sample_input, a Sample
+                    - method, 'upgma', 'nj' (neighbor joining) or 'exact' 
+                    (FromDistArray, for ultrametric distances only)
+                    - mu, a float, mutation rate, or None
+        Output:     MetricTree reconstructed from the Humming distances 
+                    between the Genotypes of the sample. If mu is given the 
+                    fraction p of differing loci is turned into generations 
+                    by the two state correction -log(1 - 2p) / (2 mu), which
+                    adds up along branches and is close to the time of 
+                    Genotype.mutate while mu times the time is small.
+        Type:       classmethod
+        """
+        if type(sample_input) is not sample.Sample:
+            raise TypeError('First input has to be a Sample.')
+        (keys, D) = sample_input.distance_array()
+        if mu is not None:
+            p = np.clip(D / sample_input.length, 0., 0.5 - 1e-12)
+            D = -np.log(1. - 2. * p) / (2. * mu)
+        if method == 'upgma':
+            return cls.UPGMA(keys, D)
+        elif method == 'nj':
+            return cls.NeighborJoining(keys, D)
+        elif method == 'exact':
+            return cls.FromDistArray(keys, D)
+        else:
+            raise ValueError("Method has to be 'upgma', 'nj' or 'exact'.")
+
+
+##############################################################################
+##############################################################################
+############################### ARRAY TREE CLASS #############################
+##############################################################################
+##############################################################################
+
+
+class ArrayTree(object):
+    
+    
+    """Whole tree stored as parallel NumPy arrays. Nodes are numbered in 
+    postorder: every child comes before its parent and the root is the 
+    last node.
+    Attributes:
+    parent          -- int64 array, index of the parent of each node 
+                       (-1 for the root)
+    heights         -- float64 array, height of each node (depth for trees 
+                       that came from a CombinatorialTree)
+    child_offsets   -- int64 array of length n + 1, the children of node i  
+                       are child_index[child_offsets[i]:child_offsets[i+1]]
+    child_index     -- int64 array, concatenated lists of children
+    names           -- name table, list of names of the nodes (None for 
+                       nodes without a name)
+    metric          -- True if the tree converts back to a MetricTree, 
+                       False if it converts back to a CombinatorialTree
+
+    ClassMethods:
+    FromTree(T)     -- array representation of a Combinatorial/MetricTree
+    
+    Methods:
+    to_tree()       -- equivalent CombinatorialTree or MetricTree
+    """
+    
+    
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, parent, heights, child_offsets, child_index, names, 
+                 metric = True):
+        parent = np.asarray(parent, dtype = np.int64)
+        heights = np.asarray(heights, dtype = np.float64)
+        child_offsets = np.asarray(child_offsets, dtype = np.int64)
+        child_index = np.asarray(child_index, dtype = np.int64)
+        n = len(parent)
+        if len(heights) != n or len(names) != n:
+            raise TreeStructureError('''Parent, height and name arrays have 
+            to be of the same length.''')
+        if len(child_offsets) != n + 1 or len(child_index) != max(n - 1, 0):
+            raise TreeStructureError('''Child offsets have to be of length 
+            n + 1 and there have to be n - 1 children.''')
+        self.__parent = parent
+        self.__heights = heights
+        self.__child_offsets = child_offsets
+        self.__child_index = child_index
+        self.__names = list(names)
+        self.__metric = bool(metric)
+        
+        
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def parent(self):
+        return self.__parent
+    
+    @property
+    def heights(self):
+        return self.__heights
+    
+    @property
+    def child_offsets(self):
+        return self.__child_offsets
+    
+    @property
+    def child_index(self):
+        return self.__child_index
+    
+    @property
+    def names(self):
+        return self.__names
+    
+    @property
+    def metric(self):
+        return self.__metric
+    
+    
+##############################################################################
+################################# PROPERTIES #################################
+##############################################################################
+
+
+    @property
+    def size(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     number of nodes in the tree
+        Type:       property
+        """
+        return len(self.__parent)
+    
+    @property
+    def root(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     index of the root (the last node)
+        Type:       property
+        """
+        return self.size - 1
+    
+    @property
+    def n_children(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     int64 array with number of children of each node
+        Type:       property
+        """
+        return np.diff(self.__child_offsets)
+    
+    @property
+    def leaves(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     int64 array of indices of the leaves, in postorder
+        Type:       property
+        """
+        return np.flatnonzero(self.n_children == 0)
+    
+    @property
+    def leaves_names(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     a sorted list of names of leaves of the tree
+        Type:       property
+        """
+        return sorted(self.__names[i] for i in self.leaves)
+    
+    @property
+    def Nleaves(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     number of leaves the tree has
+        Type:       property
+        """
+        return int(np.count_nonzero(self.n_children == 0))
+    
+    
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def children(self, i):
+        """
+        Acts on:    an ArrayTree
+        Input:      i, index of a node
+        Output:     int64 array of indices of the children of node i
+        """
+        return self.__child_index[self.__child_offsets[i]:
+                                  self.__child_offsets[i + 1]]
+    
+    def to_tree(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     a MetricTree (if metric) or a CombinatorialTree 
+                    equivalent to the ArrayTree
+        """
+        nodes = []
+        offsets = self.__child_offsets.tolist()
+        child_index = self.__child_index.tolist()
+        heights = self.__heights.tolist()
+        for i in range(self.size):
+            children = [nodes[c] for c in child_index[offsets[i]:
+                                                      offsets[i + 1]]]
+            if self.__metric:
+                nodes.append(MetricTree(children, None, heights[i], 
+                                        self.__names[i]))
+            else:
+                nodes.append(CombinatorialTree(children, None, 
+                                               self.__names[i]))
+        return nodes[-1]
+    
+    def cophenetic_matrix(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     2-tuple of the sorted list of leaf names and the float64 
+                    matrix of distances between the leaves in that order, 
+                    where the distance is twice the height of the common 
+                    ancestor
+        """
+        # in postorder the leaves of every subtree form a contiguous range 
+        # [lo, hi) of the leaves, so each internal node fills the blocks
+        # between the ranges of each pair of its children in one pass
+        n = self.size
+        is_leaf = (self.n_children == 0)
+        leaf_rank = np.cumsum(is_leaf) - 1
+        nleaves = int(leaf_rank[-1]) + 1
+        offsets = self.__child_offsets.tolist()
+        child_index = self.__child_index.tolist()
+        heights = self.__heights.tolist()
+        lo = [0] * n
+        hi = [0] * n
+        D = np.zeros((nleaves, nleaves), dtype = np.float64)
+        for i in range(n):
+            children = child_index[offsets[i]:offsets[i + 1]]
+            if children == []:
+                lo[i] = int(leaf_rank[i])
+                hi[i] = lo[i] + 1
+                continue
+            lo[i] = lo[children[0]]
+            hi[i] = hi[children[-1]]
+            value = 2. * heights[i]
+            for a in range(len(children)):
+                ca = children[a]
+                for cb in children[a + 1:]:
+                    D[lo[ca]:hi[ca], lo[cb]:hi[cb]] = value
+                    D[lo[cb]:hi[cb], lo[ca]:hi[ca]] = value
+        leaves = np.flatnonzero(is_leaf)
+        order = sorted(range(nleaves), key = lambda j: self.__names[leaves[j]])
+        names = [self.__names[leaves[j]] for j in order]
+        order = np.array(order, dtype = np.int64)
+        return (names, D[np.ix_(order, order)])
+    
+    def __repr__(self):
+        """
+        Acts on:    an ArrayTree
+        Input:      none
+        Output:     string expression that if plugged back into python 
+                    would create an equivalent ArrayTree
+        Short form: self (enter)
+        """
+        return ('ArrayTree(' + repr(self.__parent.tolist()) + ', ' 
+                + repr(self.__heights.tolist()) + ', ' 
+                + repr(self.__child_offsets.tolist()) + ', '
+                + repr(self.__child_index.tolist()) + ', ' 
+                + repr(self.__names) + ', ' + repr(self.__metric) + ')')
+    
+    
+##############################################################################
+################################ CLASSMETHODS ################################
+##############################################################################
+
+
+    @classmethod
+    def FromTree(cls, tree):
+        """
+        Acts on:    ArrayTree class
+        Input:      tree, a CombinatorialTree or a MetricTree
+        Output:     ArrayTree equivalent of the subtree rooted at tree
+        Type:       classmethod
+        """
+        if not isinstance(tree, CombinatorialTree):
+            raise TypeError("Input has to be a Combinatorial or Metric Tree.")
+        order = list(tree.postorder())
+        n = len(order)
+        position = dict()
+        for i in range(n):
+            position[id(order[i])] = i
+        parent = np.full(n, -1, dtype = np.int64)
+        child_offsets = np.zeros(n + 1, dtype = np.int64)
+        child_index = []
+        names = []
+        for i in range(n):
+            node = order[i]
+            for child in node.children:
+                c = position[id(child)]
+                child_index.append(c)
+                parent[c] = i
+            child_offsets[i + 1] = len(child_index)
+            names.append(node.name)
+        metric = tree._check_height()
+        if metric:
+            heights = np.array([node.height for node in order], 
+                               dtype = np.float64)
+        else:
+            # depth of every node, children come first in postorder
+            heights = np.zeros(n, dtype = np.float64)
+            for i in range(n):
+                if parent[i] >= 0:
+                    heights[parent[i]] = max(heights[parent[i]], 
+                                             heights[i] + 1.)
+        return cls(parent, heights, child_offsets, child_index, names, metric)
+
+    
+    @classmethod
+    def FromAny(cls, tree):
+        """
+        Acts on:    ArrayTree class
+        Input:      tree, a Combinatorial/Metric/PersistentTree or ArrayTree
+        Output:     ArrayTree of the tree (the input itself if it is already
+                    an ArrayTree)
+        Type:       classmethod
+        Used in:    treestats, splits, topologies
+        """
+        if type(tree) is cls:
+            return tree
+        if type(tree) is PersistentTree:
+            tree = tree.to_tree()
+        if not isinstance(tree, CombinatorialTree):
+            raise TypeError('Input has to be a tree.')
+        return cls.FromTree(tree)
+
+    
+    @classmethod
+    def FromParents(cls, parent, heights, names, metric = True):
+        """
+        Acts on:    ArrayTree class
+        Input:      - parent, array of indices of parents of nodes in any 
+                    order (-1 for the root)
+                    - heights, array of heights of the nodes
+                    - names, list of names of the nodes
+                    - metric, a boolean
+        Output:     ArrayTree of the same tree with nodes renumbered in 
+                    postorder, children kept in increasing order of index
+        Type:       classmethod
+        """
+        parent = np.asarray(parent, dtype = np.int64)
+        heights = np.asarray(heights, dtype = np.float64)
+        n = len(parent)
+        roots = np.flatnonzero(parent < 0)
+        if len(roots) != 1:
+            raise TreeStructureError('Tree has to have exactly one root.')
+        # children of every node, grouped by parent with a stable sort
+        nonroot = np.flatnonzero(parent >= 0)
+        by_parent = nonroot[np.argsort(parent[nonroot], kind = 'stable')]
+        counts = np.bincount(parent[nonroot], minlength = n)
+        starts = np.concatenate(([0], np.cumsum(counts))).tolist()
+        by_parent = by_parent.tolist()
+        order = []
+        stack = [int(roots[0])]
+        while stack:
+            i = stack.pop()
+            order.append(i)
+            stack.extend(by_parent[starts[i]:starts[i + 1]])
+        order.reverse()
+        if len(order) != n:
+            raise TreeStructureError('All nodes have to descend from the root.')
+        order = np.array(order, dtype = np.int64)
+        position = np.empty(n, dtype = np.int64)
+        position[order] = np.arange(n)
+        new_parent = np.full(n, -1, dtype = np.int64)
+        new_parent[position[nonroot]] = position[parent[nonroot]]
+        # children of node i in the new numbering, kept in postorder
+        children = np.flatnonzero(new_parent >= 0)
+        children = children[np.argsort(new_parent[children], kind = 'stable')]
+        child_offsets = np.concatenate(([0], np.cumsum(np.bincount(
+            new_parent[new_parent >= 0], minlength = n))))
+        return cls(new_parent, heights[order], child_offsets, children, 
+                   [names[i] for i in order.tolist()], metric)
+
+##############################################################################
+##############################################################################
+############################### LCA INDEX CLASS ##############################
+##############################################################################
+##############################################################################
+
+
+class LCAIndex(object):
+    
+    
+    """Lowest common ancestor index of a tree: Euler tour of the tree plus
+    a sparse table of range minima of the depths along the tour. Building
+    takes O(n log n), every query afterwards takes O(1).
+    Methods:
+    leaf(name)             -- leaf of the tree with the given name
+    lca(u, v)              -- common ancestor of two nodes of the tree
+    common_ancestor(list)  -- common ancestor of a list of nodes/leaf names
+    height_matrix(nodes)   -- heights of common ancestors of all pairs
+    """
+    
+    
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, tree):
+        if not isinstance(tree, CombinatorialTree):
+            raise TypeError("Input has to be a Combinatorial or Metric Tree.")
+        nodes = []
+        depths = []
+        first = dict()
+        leaves = dict()
+        # explicit stack of (node, depth, index of the next child to visit)
+        stack = [(tree, 0, 0)]
+        while stack:
+            (node, depth, i) = stack.pop()
+            if i == 0:
+                first[id(node)] = len(nodes)
+                if node.is_leaf:
+                    leaves[node.name] = node
+            nodes.append(node)
+            depths.append(depth)
+            if i < len(node.children):
+                stack.append((node, depth, i + 1))
+                stack.append((node.children[i], depth + 1, 0))
+        self.__root = tree
+        self.__nodes = nodes
+        self.__first = first
+        self.__leaves = leaves
+        self.__depths = np.array(depths, dtype = np.int64)
+        self.__heights = np.array([node.height for node in nodes], 
+                                  dtype = np.float64)
+        # table[k][i] is the position of the shallowest node in the tour 
+        # between i and i + 2**k - 1
+        # (entries past the end of the tour are never queried)
+        m = len(nodes)
+        levels = m.bit_length()
+        table = np.zeros((levels, m), dtype = np.int64)
+        table[0] = np.arange(m)
+        for k in range(1, levels):
+            half = 2**(k - 1)
+            a = table[k - 1, :m - 2**k + 1]
+            b = table[k - 1, half:half + m - 2**k + 1]
+            table[k, :m - 2**k + 1] = np.where(self.__depths[a] 
+                                               <= self.__depths[b], a, b)
+        self.__table = table
+        
+        
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def root(self):
+        return self.__root
+    
+    
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def leaf(self, name):
+        """
+        Acts on:    an LCAIndex
+        Input:      name, a leaf name (string or integer id)
+        Output:     the leaf of the indexed tree with the given name, None 
+                    if there is no such leaf
+        """
+        return self.__leaves.get(name)
+    
+    def _position(self, node_or_name):
+        """
+        Acts on:    an LCAIndex
+        Input:      node_or_name, a tree node or a leaf name (anything 
+                    that is not a node, e.g. an integer id)
+        Output:     position of the first visit of the node in the Euler 
+                    tour, None if the node is not in the indexed tree; 
+                    raises ValueError if the name is not a leaf
+        """
+        if not isinstance(node_or_name, CombinatorialTree):
+            if node_or_name not in self.__leaves:
+                raise ValueError('Leaf ' + str(node_or_name) + ''' is not in
+                the indexed tree.''')
+            node_or_name = self.__leaves[node_or_name]
+        return self.__first.get(id(node_or_name))
+    
+    def _query(self, l, r):
+        """
+        Acts on:    an LCAIndex
+        Input:      l, r, positions in the Euler tour
+        Output:     position of the shallowest node of the tour between l 
+                    and r, which is the common ancestor of the two nodes
+        """
+        if l > r:
+            (l, r) = (r, l)
+        k = (r - l + 1).bit_length() - 1
+        a = self.__table[k, l]
+        b = self.__table[k, r - 2**k + 1]
+        if self.__depths[a] <= self.__depths[b]:
+            return a
+        return b
+    
+    def lca(self, u, v):
+        """
+        Acts on:    an LCAIndex
+        Input:      u, v, nodes of the indexed tree or names of its leaves
+        Output:     their lowest common ancestor, None if one of the nodes 
+                    is not in the indexed tree (ValueError for an unknown 
+                    name)
+        """
+        l = self._position(u)
+        r = self._position(v)
+        if l is None or r is None:
+            return None
+        return self.__nodes[self._query(l, r)]
+    
+    def common_ancestor(self, nodes_or_names):
+        """
+        Acts on:    an LCAIndex
+        Input:      nodes_or_names, a list of nodes of the indexed tree 
+                    and/or names of its leaves
+        Output:     lowest common ancestor of all of them, None if one of 
+                    the nodes is not in the indexed tree (ValueError for an
+                    unknown name)
+        """
+        positions = [self._position(x) for x in nodes_or_names]
+        if None in positions:
+            return None
+        # the common ancestor of a set of nodes is the shallowest node of
+        # the tour between the first visits of the leftmost and rightmost
+        return self.__nodes[self._query(min(positions), max(positions))]
+    
+    def height_matrix(self, nodes_or_names):
+        """
+        Acts on:    an LCAIndex
+        Input:      nodes_or_names, a list of n nodes of the indexed tree 
+                    and/or names of its leaves
+        Output:     n x n float64 array of heights of the common ancestors 
+                    of all pairs, computed with vectorized queries
+        """
+        positions = [self._position(x) for x in nodes_or_names]
+        if None in positions:
+            raise ValueError("All nodes have to be in the indexed tree.")
+        positions = np.array(positions, dtype = np.int64)
+        l = np.minimum.outer(positions, positions)
+        r = np.maximum.outer(positions, positions)
+        k = np.floor(np.log2(r - l + 1)).astype(np.int64)
+        a = self.__table[k, l]
+        b = self.__table[k, r - 2**k + 1]
+        best = np.where(self.__depths[a] <= self.__depths[b], a, b)
+        return self.__heights[best]
+
+
+##############################################################################
+##############################################################################
+############################# TREE ENSEMBLE CLASS ############################
+##############################################################################
+##############################################################################
+
+
+class TreeEnsemble(object):
+    
+    
+    """Replicate trees with the same leaves stored as padded NumPy arrays.
+    In every replicate the leaves are nodes 0, ..., n - 1, every node comes 
+    before its parent and the root is the last node.
+    Attributes:
+    parent      -- (R, M) int64 array, parents of the nodes (-1 for the 
+                   roots and for the padding)
+    heights     -- (R, M) float64 array, heights of the nodes
+    sizes       -- (R,) int64 array, number of nodes of every replicate
+    names       -- list of names of the leaves
+    
+    Methods:
+    [r]         -- MetricTree of replicate r, built on demand
+    array(r)    -- ArrayTree of replicate r
+    tmrca       -- heights of the roots of all replicates
+    """
+    
+    
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, parent, heights, sizes, names):
+        parent = np.asarray(parent, dtype = np.int64)
+        heights = np.asarray(heights, dtype = np.float64)
+        sizes = np.asarray(sizes, dtype = np.int64)
+        if parent.ndim != 2 or parent.shape != heights.shape:
+            raise TreeStructureError('''Parent and height arrays have to be 
+            two dimensional arrays of the same shape.''')
+        if sizes.shape != (parent.shape[0],):
+            raise TreeStructureError('''There has to be one size per 
+            replicate.''')
+        self.__parent = parent
+        self.__heights = heights
+        self.__sizes = sizes
+        self.__names = list(names)
+        
+        
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def parent(self):
+        return self.__parent
+    
+    @property
+    def heights(self):
+        return self.__heights
+    
+    @property
+    def sizes(self):
+        return self.__sizes
+    
+    @property
+    def names(self):
+        return self.__names
+    
+    
+##############################################################################
+################################# PROPERTIES #################################
+##############################################################################
+
+
+    @property
+    def Nleaves(self):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      none
+        Output:     number of leaves of every tree
+        Type:       property
+        """
+        return len(self.__names)
+    
+    @property
+    def tmrca(self):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      none
+        Output:     float64 array of heights of the roots of the replicates
+        Type:       property
+        """
+        return self.__heights[np.arange(len(self)), self.__sizes - 1]
+    
+    
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def __len__(self):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      none
+        Output:     number of replicates
+        Short form: len(self)
+        """
+        return len(self.__sizes)
+    
+    def array(self, r):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      r, index of a replicate
+        Output:     ArrayTree of the replicate
+        """
+        size = self.__sizes[r]
+        names = self.__names + [None] * (size - self.Nleaves)
+        return ArrayTree.FromParents(self.__parent[r, :size], 
+                                     self.__heights[r, :size], names)
+    
+    def __getitem__(self, r):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      r, index of a replicate
+        Output:     MetricTree of the replicate
+        Short form: self[r]
+        """
+        return self.array(r).to_tree()
+    
+    def __iter__(self):
+        """
+        Acts on:    a TreeEnsemble
+        Input:      none
+        Output:     iterator over MetricTrees of the replicates, each built 
+                    only when it is reached
+        """
+        for r in range(len(self)):
+            yield self[r]
+
+
+##############################################################################
+##############################################################################
+############################ PERSISTENT TREE CLASS ###########################
+##############################################################################
+##############################################################################
+
+
+class PersistentTree(object):
+    
+    
+    """Immutable tree without parent pointers, so that one subtree can be 
+    shared by any number of trees. Changing a tree gives a new tree in 
+    which only the path from the root to the change is copied, and copying
+    a tree is free. Nodes inside a tree are addressed by paths, tuples of 
+    indices of children starting from the root.
+    Attributes:
+    children        -- tuple of PersistentTrees
+    height          -- a float, None for a tree without heights
+    name            -- name of the tree
+    
+    ClassMethods:
+    FromTree(T)     -- persistent copy of a Combinatorial/MetricTree
+    
+    Methods:
+    to_tree()       -- equivalent CombinatorialTree or MetricTree
+    node(path)      -- subtree at the end of path
+    replace(path, subtree), link(path, child), cut(path), 
+    insert(path, other)
+                    -- new trees sharing everything off the path with self
+    """
+    
+    
+##############################################################################
+################################# CONSTANTS ##################################
+##############################################################################
+
+
+    __slots__ = ('__children', '__height', '__name', '__hash', '__Nleaves')
+    
+    
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, children, height = None, name = None):
+        children = tuple(children)
+        for child in children:
+            if type(child) is not PersistentTree:
+                raise TreeStructureError('''Every child has to be a 
+                PersistentTree.''')
+            if (child.__height is None) != (height is None):
+                raise TreeStructureError('''Either all trees have heights or 
+                none of them do.''')
+            if height is not None and child.__height >= height:
+                raise TreeStructureError('''Height of children has to be 
+                smaller than height of parent.''')
+        if (height is not None and type(height) is not float 
+            and type(height) is not np.float64):
+            raise TypeError('''Height has to be a float or None.''')
+        self.__children = children
+        self.__height = height
+        self.__name = name
+        # children never change, so the aggregates are computed only once
+        self.__hash = CombinatorialTree._digest(name, height, 
+                                                [child.__hash 
+                                                 for child in children])
+        self.__Nleaves = max(sum(child.__Nleaves for child in children), 1)
+        
+        
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def children(self):
+        return self.__children
+    
+    @property
+    def height(self):
+        return self.__height
+    
+    @property
+    def name(self):
+        return self.__name
+    
+    
+##############################################################################
+################################# PROPERTIES #################################
+##############################################################################
+
+
+    @property
+    def metric(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     True if the tree has heights (converts to a MetricTree)
+        Type:       property
+        """
+        return self.__height is not None
+    
+    @property
+    def is_leaf(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     True if the tree has no children
+        Type:       property
+        """
+        return len(self.__children) == 0
+    
+    @property
+    def Nleaves(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     number of leaves the tree has
+        Type:       property
+        """
+        return self.__Nleaves
+    
+    @property
+    def leaves_names(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     sorted list of names of the leaves
+        Type:       property
+        """
+        return sorted(node.name for node in self.preorder() if node.is_leaf)
+    
+    @property
+    def canonical_hash(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     16 byte digest of the tree, the same as the canonical 
+                    hash of the equivalent CombinatorialTree or MetricTree
+        Type:       property
+        """
+        return self.__hash
+    
+    
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def preorder(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     generator of the trees below self, every tree before its
+                    children
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.__children))
+    
+    def node(self, path):
+        """
+        Acts on:    a PersistentTree
+        Input:      path, a tuple of indices of children
+        Output:     the subtree reached from self by following path
+        """
+        node = self
+        for k in path:
+            node = node.__children[k]
+        return node
+    
+    def replace(self, path, subtree):
+        """
+        Acts on:    a PersistentTree
+        Input:      - path, a tuple of indices of children
+                    - subtree, a PersistentTree, or None to remove the 
+                    subtree at the end of path
+        Output:     new tree in which subtree stands at the end of path; 
+                    only the nodes on the path are copied, the rest is shared
+                    with self (None if the whole tree is removed)
+        """
+        if subtree is not None and type(subtree) is not PersistentTree:
+            raise TypeError('Second input has to be a PersistentTree.')
+        nodes = [self]
+        for k in path:
+            nodes.append(nodes[-1].__children[k])
+        new = subtree
+        for (node, k) in zip(reversed(nodes[:-1]), reversed(path)):
+            if new is None:
+                children = node.__children[:k] + node.__children[k + 1:]
+            else:
+                children = (node.__children[:k] + (new,) 
+                            + node.__children[k + 1:])
+            new = PersistentTree(children, node.__height, node.__name)
+        return new
+    
+    def link(self, path, child):
+        """
+        Acts on:    a PersistentTree
+        Input:      - path, a tuple of indices of children
+                    - child, a PersistentTree
+        Output:     new tree in which child is added to the children of the
+                    tree at the end of path
+        """
+        node = self.node(path)
+        return self.replace(path, PersistentTree(node.__children + (child,), 
+                                                 node.__height, node.__name))
+    
+    def cut(self, path):
+        """
+        Acts on:    a PersistentTree
+        Input:      path, a tuple of indices of children
+        Output:     2-tuple of the subtree at the end of path and the new tree
+                    without it
+        """
+        return (self.node(path), self.replace(path, None))
+    
+    def insert(self, path, other):
+        """
+        Acts on:    a PersistentTree
+        Input:      - path, a tuple of indices of children
+                    - other, a PersistentTree
+        Output:     new tree in which other is inserted above the tree at the
+                    end of path, which becomes the last child of other
+        """
+        if type(other) is not PersistentTree:
+            raise TypeError('Second input has to be a PersistentTree.')
+        node = self.node(path)
+        return self.replace(path, PersistentTree(other.__children + (node,), 
+                                                 other.__height, other.__name))
+    
+    def copy(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     self, which can be shared since it never changes
+        """
+        return self
+    
+    def delete(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     nothing; there are no parent pointers to undo, the nodes
+                    are freed once nothing refers to them
+        """
+        return None
+    
+    def to_tree(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     equivalent CombinatorialTree or MetricTree, built with 
+                    new nodes
+        """
+        built = []
+        stack = [(self, False)]
+        while stack:
+            (node, visited) = stack.pop()
+            if visited:
+                k = len(built) - len(node.__children)
+                children = built[k:]
+                del built[k:]
+                if node.__height is None:
+                    built.append(CombinatorialTree(children, None, 
+                                                   node.__name))
+                else:
+                    built.append(MetricTree(children, None, node.__height, 
+                                            node.__name))
+            else:
+                stack.append((node, True))
+                for child in reversed(node.__children):
+                    stack.append((child, False))
+        return built[0]
+    
+    def __eq__(self, other):
+        """
+        Acts on:    a PersistentTree
+        Input:      other, a PersistentTree
+        Output:     a boolean indicating the equivalance of self and other
+        Short form: self == other
+        """
+        if type(other) is not PersistentTree:
+            raise TypeError('''Input has to be a tree.''')
+        return self.__hash == other.__hash
+    
+    def __hash__(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     integer hash consistent with __eq__
+        Short form: hash(self)
+        """
+        return int.from_bytes(self.__hash[:8], 'little')
+    
+    def __str__(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     the tree in pexp form
+        Short form: print(self)
+        """
+        return self.to_tree().__str__()
+    
+    def __repr__(self):
+        """
+        Acts on:    a PersistentTree
+        Input:      none
+        Output:     expression that creates an equivalent PersistentTree
+        Short form: self (enter)
+        """
+        return 'PersistentTree.FromTree(' + self.to_tree().__repr__() + ')'
+    
+    
+##############################################################################
+################################ CLASSMETHODS ################################
+##############################################################################
+
+
+    @classmethod
+    def FromTree(cls, tree):
+        """
+        Acts on:    PersistentTree class
+        Input:      tree, a CombinatorialTree or MetricTree
+        Output:     equivalent PersistentTree (with heights for a MetricTree)
+        Type:       classmethod
+        """
+        if not isinstance(tree, CombinatorialTree):
+            raise TypeError('Input has to be a tree.')
+        metric = tree.__class__._check_height()
+        built = dict()
+        for node in tree.postorder():
+            children = [built.pop(id(child)) for child in node.children]
+            if metric:
+                built[id(node)] = cls(children, node.height, node.name)
+            else:
+                built[id(node)] = cls(children, None, node.name)
+        return built[id(tree)]
@@ -58,11 +58,12 @@ class MultiTree:
     def __str__(self):
         string = ''
         for tree in self.trees:
-            string += 'Tree: ' + tree.__str__() + ' Parent: ' + tree.name + '\n'
+            string += ('Tree: ' + tree.__str__() + ' Parent: ' 
+                       + str(tree.name) + '\n')
             for child in tree.children:
-                string += '  Child: ' + child.name + '\n'
+                string += '  Child: ' + str(child.name) + '\n'
                 for child2 in child.children:
-                    string += '    Child: ' + child2.name + '\n'
+                    string += '    Child: ' + str(child2.name) + '\n'
         return string
     
     def copy(self):
@@ -143,6 +144,8 @@ class MultiTree:
         """         
         if len(self.trees) == 1:
             return self
+        if len(self.trees) > 0 and type(self.trees[0]) is PersistentTree:
+            return self.__add_persistent(other)
         top_mult = other
         bottom_mult = self
         for tree_top in top_mult.trees[:]:
@@ -151,7 +154,10 @@ class MultiTree:
                 root = bottom_mult.name_tree_in_mult(name)
                 if root is None:
                     if len(tree_top.children) == 1:
-                        top_mult.__trees.remove(tree_top)
+                        # by identity, == compares trees by their content
+                        del top_mult.__trees[next(
+                            i for (i, tree) in enumerate(top_mult.__trees) 
+                            if tree is tree_top)]
                         tree_top.delete()
                     else:
                         child.delete()
@@ -167,11 +173,37 @@ class MultiTree:
         return top_mult
     
     
+    def __add_persistent(self, other):
+        """
+        Acts on:    MultiTree object of PersistentTrees, bottom MultiTree
+        Input:      other, a MultiTree object of PersistentTrees of height 1
+        Output:     new MultiTree like self += other, in which every leaf of 
+                    other takes the children of the root of self with its 
+                    name; the trees of self are shared, not copied
+        Used in:    __iadd__
+        """
+        trees = []
+        for tree_top in other.trees:
+            children = []
+            for child in tree_top.children:
+                root = self.name_tree_in_mult(child.name)
+                if root is None:
+                    continue
+                tied = PersistentTree(root.children, child.height, child.name)
+                if len(tied.children) == 1:
+                    tied = tied.children[0]
+                children.append(tied)
+            if len(children) > 0:
+                trees.append(PersistentTree(children, tree_top.height, 
+                                            tree_top.name))
+        return MultiTree(trees)
+    
     def __eq__(self, other):
         if len(self.trees) != len(other.trees):
             return False
+        other_hashes = set(tree.canonical_hash for tree in other.trees)
         for tree in self.trees:
-            if tree not in other.trees:
+            if tree.canonical_hash not in other_hashes:
                 return False
         return True
     
@@ -314,7 +346,7 @@ class Forest:
             string += 'Interval: ' + str(self.recombinations[i]) + '\n'
             for tree in self.multitrees[i].trees:
                 string += '  Tree: ' + tree.__str__() 
-                string += ' Parent: ' + tree.name + '\n'
+                string += ' Parent: ' + str(tree.name) + '\n'
         return string
 
     def forest_subdivide(self, new_recomb_list):
@@ -354,12 +386,16 @@ class Forest:
 
 
     @classmethod
-    def forest_one_iteration(cls, children, N0, rho, t):
+    def forest_one_iteration(cls, children, N0, rho, t, persistent = False,
+                             integer_ids = False):
         """
         Input:  - children, list of integers 
                 - N0, positive integer, number of parents to choose from
                 - rho, float between 0 and 1, rate of recombination
                 - t, non-negative float, height of leaves
+                - persistent, a boolean, whether the trees are PersistentTrees
+                - integer_ids, a boolean, whether trees are named by the 
+                integers themselves rather than by their strings
         Output: a Forest of height one (all multitrees in it have tress of 
                 height one) grown for the input children where parents were 
                 chosen by pairs out of a pool of N0 parents (N0/2 pairs)
@@ -381,23 +417,30 @@ class Forest:
             new_mult = MultiTree([])
             # this is loop for trees within multitree
             for i in range(m):
-                newtree = MetricTree([], None, float(t), str(children[i]))
+                child_name = children[i]
                 parent_name = cls.parent_in_interval(interval_start, 
                                                      interval_end, 
                                                      data_list[i])
-                parent_tree = new_mult.name_tree_in_mult(str(parent_name))
+                if not integer_ids:
+                    child_name = str(child_name)
+                    parent_name = str(parent_name)
+                newtree = MetricTree([], None, float(t), child_name)
+                parent_tree = new_mult.name_tree_in_mult(parent_name)
                 if parent_tree is None:
-                    parent_tree = MetricTree([], None, t + 1., 
-                                             str(parent_name))
+                    parent_tree = MetricTree([], None, t + 1., parent_name)
                     new_mult.add_to_trees(parent_tree)
                 parent_tree._link(newtree)
+            if persistent:
+                new_mult = MultiTree([PersistentTree.FromTree(tree) 
+                                      for tree in new_mult.trees])
             forest.__multitrees.append(new_mult)
             interval_start = interval_end
         return forest, parent_list
 
     
     @classmethod
-    def forest_n_iterations(cls, m, N0, rho):
+    def forest_n_iterations(cls, m, N0, rho, persistent = False, 
+                            integer_ids = False):
         """
         Acts on:    Forest class
         Input:      - m, positive integer, number of individuals in first 
@@ -405,6 +448,12 @@ class Forest:
                     - N0, positive integer, number of parents to choose from
                     - rho, float between 0 and 1, constant in poisson process 
                     for recombination
+                    - persistent, a boolean, if True the Forest is built of 
+                    PersistentTrees, so that intervals share their subtrees
+                    and copying an interval costs nothing
+                    - integer_ids, a boolean, if True trees are named by 
+                    integers (individual 0, ..., m - 1 of the first 
+                    generation is leaf i) instead of their strings
         Output:     a Forest of Trees on genome intervals defined by 
                     recombination sites grown until common ancestor is found
                     for all individuals in the first generation on that 
@@ -413,11 +462,13 @@ class Forest:
         """
         t = 0
         base_f, parent_u_1 = cls.forest_one_iteration(list(range(m)), N0, rho, 
-                                                      float(t))
+                                                      float(t), persistent,
+                                                      integer_ids)
         t += 1
         while base_f.number_trees > len(base_f.multitrees):
             top_f, parent_u_2 = cls.forest_one_iteration(parent_u_1, N0, rho, 
-                                                         float(t))
+                                                         float(t), persistent,
+                                                         integer_ids)
             total_set_recombinations = set(base_f.recombinations)
             total_set_recombinations.update(top_f.recombinations)
             recombination_union = sorted(list(total_set_recombinations)) 
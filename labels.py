@@ -0,0 +1,202 @@
+import numpy as np
+import Tree
+import DistMatr
+import sample
+
+
+##############################################################################
+############################### LABEL TABLE CLASS ############################
+##############################################################################
+
+
+class LabelTable(object):
+
+
+    """Table of names of leaves numbered 0, 1, 2, ... . Trees, Samples,
+    DistanceMatrices and Forests can use the numbers as names (made with
+    integer_ids = True, or with to_ids), so that they hash and sort small
+    integers, and one table shared by all of them turns the numbers back
+    into names when they are printed or written (to_names).
+    Properties:
+    names           -- list of names, the name of i is names[i]
+
+    Methods:
+    add(name)       -- number of name, added at the end if it is new
+    id(name)        -- number of name
+    name(i)         -- name of number i
+    to_ids(obj)     -- copy of a tree, Sample or DistanceMatrix with names
+                       replaced by numbers
+    to_names(obj)   -- copy with numbers replaced by names
+
+    ClassMethods:
+    Default(n)      -- table of the names a, b, ..., z, aa, ab, ... given to
+                       leaves by MetricTree.Evolve
+    """
+
+
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, names = ()):
+        self.__names = []
+        self.__ids = dict()
+        for name in names:
+            self.add(name)
+
+
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def names(self):
+        return self.__names
+
+
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def __len__(self):
+        """
+        Acts on:    a LabelTable
+        Input:      none
+        Output:     number of names in the table
+        Short form: len(self)
+        """
+        return len(self.__names)
+
+    def __contains__(self, name):
+        """
+        Acts on:    a LabelTable
+        Input:      name, a name
+        Output:     True if the name is in the table
+        Short form: name in self
+        """
+        return name in self.__ids
+
+    def add(self, name):
+        """
+        Acts on:    a LabelTable
+        Input:      name, a string
+        Output:     number of the name, which is added to the end of the
+                    table if it is not there yet
+        """
+        if type(name) is not str:
+            raise TypeError('Input has to be a string.')
+        if name not in self.__ids:
+            self.__ids[name] = len(self.__names)
+            self.__names.append(name)
+        return self.__ids[name]
+
+    def id(self, name):
+        """
+        Acts on:    a LabelTable
+        Input:      name, a string in the table
+        Output:     number of the name
+        """
+        if name not in self.__ids:
+            raise ValueError('Name ' + str(name) + ' is not in the table.')
+        return self.__ids[name]
+
+    def name(self, i):
+        """
+        Acts on:    a LabelTable
+        Input:      i, a number in the table
+        Output:     name of the number
+        """
+        if type(i) is not int and not isinstance(i, np.integer):
+            raise TypeError('Input has to be an integer.')
+        if not 0 <= i < len(self.__names):
+            raise ValueError('Number ' + str(i) + ' is not in the table.')
+        return self.__names[i]
+
+    def ids(self, names):
+        """
+        Acts on:    a LabelTable
+        Input:      names, an iterable of names in the table
+        Output:     int64 array of their numbers
+        """
+        return np.array([self.id(name) for name in names], dtype = np.int64)
+
+    def __relabel(self, obj, rename):
+        """
+        Acts on:    a LabelTable
+        Input:      - obj, a Combinatorial/Metric/PersistentTree, Sample or
+                    DistanceMatrix
+                    - rename, function giving the new name of a name (None
+                    stays None)
+        Output:     copy of obj with the names of its leaves (keys) renamed
+        Used in:    to_ids, to_names
+        """
+        if type(obj) is sample.Sample:
+            return sample.Sample({rename(key): obj[key].copy()
+                                  for key in obj.keys})
+        if type(obj) is DistMatr.DistanceMatrix:
+            (keys, array) = obj.to_array()
+            return DistMatr.DistanceMatrix.FromArray(
+                [rename(key) for key in keys], array)
+        if type(obj) is Tree.PersistentTree:
+            return Tree.PersistentTree.FromTree(
+                self.__relabel(obj.to_tree(), rename))
+        if not isinstance(obj, Tree.CombinatorialTree):
+            raise TypeError('''Input has to be a tree, a Sample or a
+            DistanceMatrix.''')
+        metric = obj.__class__._check_height()
+        built = dict()
+        for node in obj.postorder():
+            children = [built.pop(id(child)) for child in node.children]
+            if node.children == [] and node.name is not None:
+                name = rename(node.name)
+            else:
+                name = node.name
+            if metric:
+                built[id(node)] = Tree.MetricTree(children, None,
+                                                  node.height, name)
+            else:
+                built[id(node)] = Tree.CombinatorialTree(children, None, name)
+        return built[id(obj)]
+
+    def to_ids(self, obj):
+        """
+        Acts on:    a LabelTable
+        Input:      obj, a tree, Sample or DistanceMatrix with string names
+        Output:     copy of obj named by the numbers of the names (names not
+                    in the table are added to it)
+        """
+        return self.__relabel(obj, self.add)
+
+    def to_names(self, obj):
+        """
+        Acts on:    a LabelTable
+        Input:      obj, a tree, Sample or DistanceMatrix named by numbers
+                    of the table
+        Output:     copy of obj with the numbers replaced by the names
+        """
+        return self.__relabel(obj, self.name)
+
+    def __repr__(self):
+        return 'LabelTable(' + repr(self.__names) + ')'
+
+
+##############################################################################
+################################ CLASSMETHODS ################################
+##############################################################################
+
+
+    @classmethod
+    def Default(cls, n):
+        """
+        Acts on:    LabelTable class
+        Input:      n, a nonnegative integer
+        Output:     LabelTable of the names MetricTree.Evolve gives to leaves
+                    0, ..., n - 1
+        Type:       classmethod
+        """
+        if type(n) is not int:
+            raise TypeError('Input has to be an integer.')
+        return cls(Tree.MetricTree._leaf_name(i) for i in range(n))
@@ -0,0 +1,681 @@
+import numpy as np
+from scipy import optimize
+import Tree
+import sample
+
+
+##############################################################################
+################################## FUNCTIONS #################################
+##############################################################################
+
+
+def site_patterns(sample_input):
+    """
+    Input:      sample_input, a Sample
+    Output:     3-tuple of the list of keys in alphabetical order, the uint8
+                matrix of the distinct site patterns (keys as rows, one 
+                column per pattern) and the int64 array of the number of 
+                loci with every pattern; a pattern and its complement have
+                the same likelihood (the model is symmetric and the root is
+                0 or 1 with equal probability), so loci are first flipped
+                to have a 0 in the first row
+    """
+    if type(sample_input) is not sample.Sample:
+        raise TypeError('Input has to be a Sample.')
+    (keys, data) = sample_input.to_array()
+    data = data ^ data[:1]
+    # every column packed into bytes, compared as one opaque value
+    packed = np.ascontiguousarray(np.packbits(data, axis = 0).T)
+    rows = packed.view(np.dtype((np.void, packed.shape[1]))).ravel()
+    (_, first, weights) = np.unique(rows, return_index = True, 
+                                    return_counts = True)
+    return (keys, data[:, first], weights.astype(np.int64))
+
+
+def _leaf_partial(row):
+    """
+    Input:      row, uint8 array of the states of a leaf at every pattern
+    Output:     2-tuple of the partials of the leaf (P x 2 array) and their
+                log scale
+    Used in:    log_likelihood, PruningLikelihood
+    """
+    partial = np.zeros((len(row), 2))
+    partial[np.arange(len(row)), row] = 1.
+    return (partial, np.zeros(len(row)))
+
+
+def _combine(children, lengths, mu):
+    """
+    Input:      - children, list of 2-tuples of partials and log scales of 
+                the children of a node
+                - lengths, list of the lengths of the branches above them
+                - mu, a float, mutation rate
+    Output:     2-tuple of the partials of the node, scaled so that their
+                largest entry per pattern is 1, and their log scale
+    Used in:    log_likelihood, PruningLikelihood
+    """
+    partial = None
+    scale = 0.
+    for ((child_partial, child_scale), length) in zip(children, lengths):
+        flip = 1. - np.exp(-mu * length)
+        stay = child_partial * (1. - flip)
+        stay += child_partial[:, ::-1] * flip
+        if partial is None:
+            partial = stay
+        else:
+            partial *= stay
+        scale = scale + child_scale
+    top = partial.max(axis = 1)
+    top[top == 0.] = 1.
+    partial /= top[:, None]
+    return (partial, scale + np.log(top))
+
+
+def _root_log_likelihood(partial, scale, weights):
+    """
+    Input:      - partial, scale, partials of the root and their log scale
+                - weights, array of the number of loci with every pattern
+    Output:     log-likelihood of the sample
+    Used in:    log_likelihood, PruningLikelihood
+    """
+    with np.errstate(divide = 'ignore'):
+        return float(np.dot(weights, np.log(0.5 * partial.sum(axis = 1)) 
+                            + scale))
+
+
+def log_likelihood(tree, sample_input, mu):
+    """
+    Input:      - tree, a MetricTree
+                - sample_input, a Sample with the leaves of tree
+                - mu, a float, mutation rate
+    Output:     log-likelihood of the sample given the tree under the model
+                of Genotype.mutate, by Felsenstein pruning over the distinct
+                site patterns at once (time proportional to their number,
+                not to the length of the genotypes)
+    """
+    if type(tree) is not Tree.MetricTree:
+        raise TypeError('First input has to be a MetricTree.')
+    if type(mu) is not float:
+        raise TypeError('Third input has to be a float.')
+    (keys, patterns, weights) = site_patterns(sample_input)
+    if keys != tree.leaves_names:
+        raise ValueError('Sample has to have the leaves of the tree.')
+    rows = {key: patterns[k] for (k, key) in enumerate(keys)}
+    partials = dict()
+    for node in tree.postorder():
+        if node.is_leaf:
+            partials[id(node)] = _leaf_partial(rows[node.name])
+        else:
+            partials[id(node)] = _combine(
+                [partials.pop(id(child)) for child in node.children],
+                [node.height - child.height for child in node.children], mu)
+    return _root_log_likelihood(*partials[id(tree)], weights)
+
+
+def fit_heights(tree, sample_input, mu):
+    """
+    Input:      - tree, a binary Combinatorial/Metric/PersistentTree, the
+                topology (its heights, if any, are the starting point)
+                - sample_input, a Sample with the leaves of tree
+                - mu, a float, mutation rate
+    Output:     2-tuple of the MetricTree with the topology of tree and the
+                heights of maximum likelihood, and its log-likelihood
+                (HeightLikelihood.fit)
+    """
+    return HeightLikelihood(tree, sample_input, mu).fit()
+
+
+##############################################################################
+############################# PRUNING LIKELIHOOD #############################
+##############################################################################
+
+
+class PruningLikelihood(object):
+
+
+    """Likelihood of a Sample given a MetricTree under the model of
+    Genotype.mutate: along a branch of length t every locus flips with
+    probability 1 - exp(-mu t), the root is 0 or 1 with equal probability.
+    Loci are compressed to distinct site patterns with weights 
+    (site_patterns). Partial likelihoods of every node are kept (rescaled, 
+    with the log of the scale per pattern), so that after a change only the
+    nodes on the path to the root are computed again.
+    Properties:
+    tree            -- root of the tree
+    mu              -- mutation rate
+    weights         -- number of loci with every site pattern
+    log_likelihood  -- log-likelihood of the sample
+
+    Methods:
+    update(nodes)   -- recomputes nodes and their ancestors after a change
+    accept()        -- forgets the partials replaced since the last call
+    reject()        -- brings them back (after the change was undone)
+    """
+
+
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, tree, sample_input, mu):
+        if type(tree) is not Tree.MetricTree:
+            raise TypeError('First input has to be a MetricTree.')
+        if type(sample_input) is not sample.Sample:
+            raise TypeError('Second input has to be a Sample.')
+        if type(mu) is not float:
+            raise TypeError('Third input has to be a float.')
+        (keys, patterns, weights) = site_patterns(sample_input)
+        if keys != tree.leaves_names:
+            raise ValueError('Sample has to have the leaves of the tree.')
+        self.__mu = mu
+        self.__weights = weights
+        self.__leaf_data = {key: patterns[k] for (k, key) in enumerate(keys)}
+        # id of a node -> (partials, log scale), partials is a P x 2
+        # array scaled so that its largest entry per pattern is 1
+        self.__partials = dict()
+        self.__saved = dict()
+        self.__tree = tree.my_root
+        for node in self.__tree.postorder():
+            self.__partials[id(node)] = self.__compute(node)
+        self.__log_likelihood = self.__root_log_likelihood()
+        self.__saved_log_likelihood = self.__log_likelihood
+
+
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def tree(self):
+        return self.__tree
+
+    @property
+    def mu(self):
+        return self.__mu
+
+    @property
+    def weights(self):
+        return self.__weights
+
+    @property
+    def log_likelihood(self):
+        return self.__log_likelihood
+
+
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def __compute(self, node):
+        """
+        Acts on:    a PruningLikelihood
+        Input:      node, a MetricTree whose children have partials
+        Output:     2-tuple of the partials of node and their log scale
+        """
+        if node.is_leaf:
+            return _leaf_partial(self.__leaf_data[node.name])
+        return _combine([self.__partials[id(child)] 
+                         for child in node.children],
+                        [node.height - child.height 
+                         for child in node.children], self.__mu)
+
+    def __root_log_likelihood(self):
+        """
+        Acts on:    a PruningLikelihood
+        Input:      none
+        Output:     log-likelihood of the sample from the partials of the
+                    root
+        """
+        (partial, scale) = self.__partials[id(self.__tree)]
+        return _root_log_likelihood(partial, scale, self.__weights)
+
+    def update(self, nodes):
+        """
+        Acts on:    a PruningLikelihood
+        Input:      nodes, list of MetricTrees of the tree whose children or
+                    heights of children changed
+        Output:     recomputes the partials of nodes and of all their
+                    ancestors (each once, lower nodes first) and returns the
+                    new log-likelihood
+        """
+        path = dict()
+        for node in nodes:
+            while node is not None and id(node) not in path:
+                path[id(node)] = node
+                node = node.parent
+        for node in sorted(path.values(), key = lambda x: x.height):
+            key = id(node)
+            if key not in self.__saved:
+                self.__saved[key] = self.__partials.get(key)
+            self.__partials[key] = self.__compute(node)
+            if node.parent is None:
+                self.__tree = node
+        self.__log_likelihood = self.__root_log_likelihood()
+        return self.__log_likelihood
+
+    def accept(self):
+        """
+        Acts on:    a PruningLikelihood
+        Input:      none
+        Output:     keeps the partials computed since the last accept or
+                    reject
+        """
+        self.__saved = dict()
+        self.__saved_log_likelihood = self.__log_likelihood
+
+    def reject(self, root):
+        """
+        Acts on:    a PruningLikelihood
+        Input:      root, root of the tree after the change was undone
+        Output:     restores the partials and log-likelihood of the last
+                    accept
+        """
+        for (key, value) in self.__saved.items():
+            if value is None:
+                del self.__partials[key]
+            else:
+                self.__partials[key] = value
+        self.__saved = dict()
+        self.__tree = root
+        self.__log_likelihood = self.__saved_log_likelihood
+
+
+##############################################################################
+############################## HEIGHT LIKELIHOOD #############################
+##############################################################################
+
+
+class HeightLikelihood(object):
+
+
+    """Likelihood of a Sample as a function of the heights of the inner
+    nodes of a fixed binary topology, with its gradient, under the model of
+    PruningLikelihood. Nodes are those of the ArrayTree of the topology. 
+    A node keeps partials only for the site patterns that are not constant
+    on the leaves below it (its active patterns), and one row for each
+    state of the constant ones. The gradient is found going back down the
+    tree (reverse mode), the derivatives of the constant patterns of a node
+    added up in its two constant rows. The rows of all nodes are in flat
+    arrays allocated once and overwritten at every evaluation, and the 
+    nodes of one level (longest path down to a leaf) are computed 
+    together, so an evaluation costs time proportional to the number of 
+    pairs of a node and an active pattern.
+    Properties:
+    array           -- ArrayTree of the topology
+    mu              -- mutation rate
+    weights         -- number of loci with every site pattern
+
+    Methods:
+    evaluate(h)     -- log-likelihood and its gradient at the heights h
+    fit(heights)    -- maximum likelihood heights, with L-BFGS-B
+    """
+
+
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, tree, sample_input, mu):
+        if type(tree) is Tree.PersistentTree:
+            tree = tree.to_tree()
+        if not isinstance(tree, Tree.CombinatorialTree):
+            raise TypeError('First input has to be a tree.')
+        if type(mu) is not float:
+            raise TypeError('Third input has to be a float.')
+        array = Tree.ArrayTree.FromTree(tree)
+        n_children = array.n_children
+        if np.any((n_children != 0) & (n_children != 2)):
+            raise Tree.TreeStructureError('Tree has to be binary.')
+        (keys, patterns, weights) = site_patterns(sample_input)
+        if keys != sorted(array.leaves_names):
+            raise ValueError('Sample has to have the leaves of the tree.')
+        self.__array = array
+        self.__mu = mu
+        self.__weights = weights.astype(np.float64)
+        n = array.size
+        parent = array.parent
+        inner = np.flatnonzero(n_children == 2)
+        first = array.child_offsets[inner]
+        self.__left = np.full(n, -1, dtype = np.int64)
+        self.__right = np.full(n, -1, dtype = np.int64)
+        self.__left[inner] = array.child_index[first]
+        self.__right[inner] = array.child_index[first + 1]
+        # children come before parents, so levels are found in one pass
+        level = np.zeros(n, dtype = np.int64)
+        for i in range(n - 1):
+            level[parent[i]] = max(level[parent[i]], level[i] + 1)
+        self.__levels = [np.flatnonzero(level == k) 
+                         for k in range(1, level[n - 1] + 1)]
+        # inner nodes below the root, their heights are fractions of the
+        # heights of their parents
+        self.__inner = inner[inner != n - 1]
+        # inner nodes may be named like leaves (ancestors in a Forest)
+        leaf_of = {array.names[i]: i
+                   for i in np.flatnonzero(n_children == 0).tolist()}
+        self.__leaf_states = dict()
+        for (k, key) in enumerate(keys):
+            self.__leaf_states[leaf_of[key]] = patterns[k]
+        self.__index_patterns()
+        # one row per state, a column per row of a node
+        T = self.__offsets[-1]
+        self.__D = np.zeros((2, T))
+        self.__E = np.zeros((2, T))
+        self.__S = np.zeros(T)
+        self.__top = np.ones(T)
+        self.__alpha = np.zeros((2, T))
+        self.__flip = np.zeros(n)
+        for leaf in self.__leaf_states:
+            self.__D[0, self.__offsets[leaf]] = 1.
+            self.__D[1, self.__offsets[leaf] + 1] = 1.
+
+    def __index_patterns(self):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      none
+        Output:     finds the active patterns of every node and lays out 
+                    the rows: node c has rows offsets[c], ..., offsets[c+1]
+                    - 1, its active patterns in order and then the constant
+                    patterns of state 0 and of state 1; every row of an 
+                    inner node gets the rows of its children it is computed
+                    from, and every level the lists of rows it works on
+        Used in:    __init__
+        """
+        n = self.__array.size
+        (left, right) = (self.__left, self.__right)
+        states = dict(self.__leaf_states)
+        active = [np.zeros(0, dtype = np.int64)] * n
+        # position among the rows of its node of the row of a child used by
+        # every row of a parent, -1 for the leaves
+        local = [(None, None)] * n
+        for p in range(n):
+            if left[p] < 0:
+                continue
+            (L, R) = (states.pop(left[p]), states.pop(right[p]))
+            # 2 where the pattern is not constant below p
+            state = np.where(L == R, L, 2).astype(np.uint8)
+            active[p] = np.flatnonzero(state == 2)
+            gathers = []
+            for (c, child) in ((left[p], L), (right[p], R)):
+                on = child[active[p]].astype(np.int64)
+                rows = np.searchsorted(active[c], active[p])
+                rows = np.where(on == 2, rows, len(active[c]) + on)
+                constant = len(active[c]) + np.arange(2)
+                gathers.append(np.concatenate((rows, constant)))
+            local[p] = tuple(gathers)
+            states[p] = state
+        root = states.pop(n - 1)
+        sizes = np.array([len(a) + 2 for a in active], dtype = np.int64)
+        offsets = np.zeros(n + 1, dtype = np.int64)
+        np.cumsum(sizes, out = offsets[1:])
+        self.__offsets = offsets
+        owner = np.repeat(np.arange(n), sizes)
+        self.__owner = owner
+        self.__by_level = []
+        for nodes in self.__levels:
+            targets = np.concatenate([np.arange(offsets[p], offsets[p + 1]) 
+                                      for p in nodes])
+            from_left = np.concatenate([offsets[left[p]] + local[p][0] 
+                                        for p in nodes])
+            from_right = np.concatenate([offsets[right[p]] + local[p][1] 
+                                         for p in nodes])
+            children = np.concatenate((left[nodes], right[nodes]))
+            below = np.concatenate([np.arange(offsets[c], offsets[c + 1]) 
+                                    for c in children])
+            # position in below of every row of a child used by the level
+            position = np.full(offsets[-1], -1, dtype = np.int64)
+            position[below] = np.arange(len(below))
+            used = np.concatenate((from_left, from_right))
+            self.__by_level.append((targets, from_left, from_right, below, 
+                                    owner[below], 
+                                    np.concatenate((targets, targets)), used,
+                                    np.concatenate((from_right, from_left)),
+                                    owner[used], position[used]))
+        m = len(active[n - 1])
+        rows = np.searchsorted(active[n - 1], np.arange(len(root)))
+        rows = np.where(root == 2, rows, m + root.astype(np.int64))
+        self.__root_rows = offsets[n - 1] + rows
+        # weight of every row of the root, the constant rows get the total
+        # weight of their patterns
+        self.__root_weights = np.concatenate((
+            self.__weights[active[n - 1]], 
+            [self.__weights[root == 0].sum(), 
+             self.__weights[root == 1].sum()]))
+
+
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def array(self):
+        return self.__array
+
+    @property
+    def mu(self):
+        return self.__mu
+
+    @property
+    def weights(self):
+        return self.__weights
+
+
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def evaluate(self, heights):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      heights, float array of the heights of the nodes of 
+                    array (0 for the leaves, every parent above its 
+                    children)
+        Output:     2-tuple of the log-likelihood of the sample and the 
+                    array of its derivatives by the heights of the nodes 
+                    (0 for the leaves); one pass up and one pass down
+        """
+        mu = self.__mu
+        (D, E, S, top, alpha) = (self.__D, self.__E, self.__S, self.__top, 
+                                 self.__alpha)
+        F = self.__flip
+        parent = self.__array.parent
+        n = self.__array.size
+        F[:n - 1] = 1. - np.exp(-mu * (heights[parent[:n - 1]] 
+                                       - heights[:n - 1]))
+        for (targets, from_left, from_right, below, 
+             below_owner) in (level[:5] for level in self.__by_level):
+            f = F[below_owner]
+            (zero, one) = (D[0, below], D[1, below])
+            E[0, below] = zero + f * (one - zero)
+            E[1, below] = one + f * (zero - one)
+            zero = E[0, from_left] * E[0, from_right]
+            one = E[1, from_left] * E[1, from_right]
+            scale = np.maximum(zero, one)
+            scale[scale == 0.] = 1.
+            top[targets] = scale
+            D[0, targets] = zero / scale
+            D[1, targets] = one / scale
+            S[targets] = S[from_left] + S[from_right] + np.log(scale)
+        rows = slice(self.__offsets[n - 1], self.__offsets[n])
+        total = D[0, rows] + D[1, rows]
+        with np.errstate(divide = 'ignore'):
+            root = self.__root_rows
+            value = float(np.dot(self.__weights, 
+                                 np.log(0.5 * (D[0, root] + D[1, root]))
+                                 + S[root]))
+        # derivatives of the log-likelihood by the partials, times the 
+        # weights; a constant row holds the sum over its patterns
+        alpha[:, rows] = self.__root_weights / total
+        dt = np.zeros(n)
+        for (targets, from_left, from_right, below, below_owner, above, 
+             child, sibling, child_owner, 
+             position) in reversed(self.__by_level):
+            zero = alpha[0, above] * E[0, sibling] / top[above]
+            one = alpha[1, above] * E[1, sibling] / top[above]
+            change = (zero - one) * (D[1, child] - D[0, child])
+            dt += np.bincount(child_owner, change, minlength = n)
+            # rows of the children get the sums of the rows using them
+            zero = np.bincount(position, zero, minlength = len(below))
+            one = np.bincount(position, one, minlength = len(below))
+            f = F[below_owner]
+            alpha[0, below] = zero + f * (one - zero)
+            alpha[1, below] = one + f * (zero - one)
+        dt[:n - 1] *= mu * (1. - F[:n - 1])
+        gradient = -dt
+        np.add.at(gradient, parent[:n - 1], dt[:n - 1])
+        gradient[self.__array.n_children == 0] = 0.
+        return (value, gradient)
+
+    def __heights(self, theta):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      theta, float array of the log of the height of the root
+                    followed by the logs of the heights of the other inner 
+                    nodes as fractions of the heights of their parents
+        Output:     heights of the nodes (0 for the leaves)
+        Used in:    fit
+        """
+        n = self.__array.size
+        fraction = np.ones(n)
+        fraction[self.__inner] = np.exp(theta[1:])
+        heights = np.zeros(n)
+        heights[n - 1] = np.exp(theta[0])
+        parent = self.__array.parent
+        for nodes in reversed(self.__levels[:-1]):
+            heights[nodes] = fraction[nodes] * heights[parent[nodes]]
+        return heights
+
+    def __initial_heights(self):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      none
+        Output:     heights of the tree if it is metric, else the height of 
+                    every inner node explaining the mean fraction of loci 
+                    that differ between a leaf of its left and a leaf of its
+                    right subtree (raised above its children if needed)
+        Used in:    fit
+        """
+        array = self.__array
+        if array.metric and array.heights[-1] > 0.:
+            return array.heights.copy()
+        n = array.size
+        leaves = list(self.__leaf_states)
+        X = np.array([self.__leaf_states[leaf] for leaf in leaves], 
+                     dtype = np.float64)
+        ones = X @ self.__weights
+        differ = ones[:, None] + ones[None, :] - 2. * ((X * self.__weights) 
+                                                       @ X.T)
+        # rows of the leaves below every node, summed in one pass up
+        below = np.zeros((n, len(leaves)))
+        below[leaves, np.arange(len(leaves))] = 1.
+        heights = np.zeros(n)
+        for p in range(n):
+            if self.__left[p] < 0:
+                continue
+            (L, R) = (below[self.__left[p]], below[self.__right[p]])
+            below[p] = L + R
+            pairs = L.sum() * R.sum() * self.__weights.sum()
+            fraction = min(L @ differ @ R / pairs, 0.5 - 1e-9)
+            # two leaves differ with probability 2f(1 - f) at flip f
+            f = (1. - np.sqrt(1. - 2. * fraction)) / 2.
+            lowest = max(heights[self.__left[p]], heights[self.__right[p]])
+            heights[p] = max(-np.log(1. - f) / self.__mu, 
+                             lowest * (1. + 1e-6), 1e-6)
+        return heights
+
+    def __curvature(self, heights):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      heights, float array of the heights of the nodes
+        Output:     rough second derivative of the log-likelihood by every 
+                    variable of fit (log of the root height, then log
+                    fractions): a branch with m expected changed loci 
+                    gives about m times the square of the derivative of the
+                    log of its length, which is 1 for the branches below 
+                    the node and -h / t for the branch of length t above a
+                    node at height h
+        Used in:    fit
+        """
+        n = self.__array.size
+        parent = self.__array.parent
+        lengths = np.zeros(n)
+        lengths[:n - 1] = heights[parent[:n - 1]] - heights[:n - 1]
+        changed = self.__weights.sum() * (1. - np.exp(-self.__mu * lengths))
+        below = np.zeros(n)
+        for nodes in self.__levels:
+            (L, R) = (self.__left[nodes], self.__right[nodes])
+            below[nodes] = below[L] + changed[L] + below[R] + changed[R]
+        inner = self.__inner
+        result = np.empty(len(inner) + 1)
+        result[0] = below[-1]
+        with np.errstate(divide = 'ignore', invalid = 'ignore'):
+            above = changed[inner] * (heights[inner] / lengths[inner]) ** 2
+        result[1:] = below[inner] + np.nan_to_num(above)
+        return np.maximum(result, 1.)
+
+    def fit(self, heights = None, tolerance = 1e-10, max_iterations = 1000):
+        """
+        Acts on:    a HeightLikelihood
+        Input:      - heights, float array of starting heights of the nodes
+                    of array, or None for those of the tree if it is 
+                    metric, else its scaled depths
+                    - tolerance, a float, relative change of the 
+                    log-likelihood at which to stop
+                    - max_iterations, a positive integer
+        Output:     2-tuple of the MetricTree with the topology and the 
+                    heights of maximum likelihood and its log-likelihood; 
+                    the log of the root height and the log of the height of
+                    every other inner node as a fraction of the height of 
+                    its parent are optimized by L-BFGS-B with the fractions
+                    bounded by 1, so the tree stays ultrametric; they are
+                    scaled by the square roots of their curvatures at the 
+                    start, which differ by orders of magnitude between the
+                    root and the tips
+        """
+        if heights is None:
+            heights = self.__initial_heights()
+        heights = np.asarray(heights, dtype = np.float64)
+        parent = self.__array.parent
+        (low, high) = (np.log(1e-12), np.log1p(-1e-9))
+        theta = np.empty(len(self.__inner) + 1)
+        theta[0] = np.log(heights[-1])
+        with np.errstate(divide = 'ignore'):
+            theta[1:] = np.clip(np.log(heights[self.__inner] 
+                                       / heights[parent[self.__inner]]), 
+                                low, high)
+        scale = np.sqrt(self.__curvature(heights))
+
+        def negative(phi):
+            theta = phi / scale
+            heights = self.__heights(theta)
+            (value, gradient) = self.evaluate(heights)
+            # log h of a node is the sum of theta on its path to the root,
+            # so the derivative by theta of a node collects h dL/dh over 
+            # the inner nodes below it
+            below = gradient * heights
+            for nodes in self.__levels:
+                below[nodes] += (below[self.__left[nodes]] 
+                                 + below[self.__right[nodes]])
+            result = np.empty(len(theta))
+            result[0] = below[-1]
+            result[1:] = below[self.__inner]
+            return (-value, -result / scale)
+
+        bounds = [(None, None)] + [(low * x, high * x) for x in scale[1:]]
+        # a node moves all the nodes below it, a long memory of past 
+        # gradients takes far fewer evaluations on large trees
+        result = optimize.minimize(negative, theta * scale, jac = True, 
+                                   method = 'L-BFGS-B', bounds = bounds,
+                                   options = {'ftol': tolerance, 
+                                              'maxiter': max_iterations,
+                                              'maxcor': 100})
+        heights = self.__heights(result.x / scale)
+        array = self.__array
+        fitted = Tree.ArrayTree(array.parent, heights, array.child_offsets,
+                                array.child_index, array.names, True)
+        return (fitted.to_tree(), -float(result.fun))
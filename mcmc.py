@@ -0,0 +1,349 @@
+import bisect
+import math
+import random as rnd
+import Tree
+import likelihood
+
+
+##############################################################################
+################################ TREE SAMPLER ################################
+##############################################################################
+
+
+class TreeSampler(object):
+
+
+    """Metropolis-Hastings sampler of binary MetricTrees given a Sample.
+    Every step either moves the height of one inner node or prunes a subtree
+    and regrafts it elsewhere (with _unlink and _link, as cut and insert
+    do), and the likelihood is updated only on the paths to the root of the
+    nodes that changed. Both moves change one inner height, so the prior is
+    updated from the sorted inner heights between its old and new rank, and
+    nodes are drawn from lists that moves do not change.
+    Properties:
+    tree            -- current tree (modified in place by the steps)
+    log_likelihood  -- log-likelihood of the sample given tree
+    log_prior       -- log of the coalescent prior of tree (0 if N is None)
+    steps           -- number of steps made
+    accepted        -- number of accepted steps
+
+    Methods:
+    step()          -- one step, True if the proposal was accepted
+    run(n, thin)    -- generator of copies of the tree every thin steps
+    """
+
+
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, tree, sample_input, mu, N = None, spr = 0.5,
+                 window = 0.5):
+        """
+        Input:      - tree, a binary MetricTree, the starting point (copied)
+                    - sample_input, a Sample with the leaves of tree
+                    - mu, a float, mutation rate
+                    - N, population size of the coalescent prior (every
+                    pair of lineages coalesces at rate 1/N), or None for a
+                    flat prior on heights
+                    - spr, a float, probability of a prune and regraft step
+                    - window, a float, half width of the log scale of the
+                    moves of the root height
+        """
+        if type(tree) is not Tree.MetricTree:
+            raise TypeError('First input has to be a MetricTree.')
+        for node in tree.postorder():
+            if len(node.children) not in (0, 2):
+                raise Tree.TreeStructureError('Tree has to be binary.')
+        self.__tree = tree.copy()
+        self.__likelihood = likelihood.PruningLikelihood(self.__tree,
+                                                         sample_input, mu)
+        self.__N = N
+        self.__spr = spr
+        self.__window = window
+        # moves keep the sets of leaves and inner nodes, only the root and
+        # the order of the heights change
+        self.__nodes = list(self.__tree.postorder())
+        self.__inner = [node for node in self.__nodes if not node.is_leaf]
+        self.__root_node = self.__tree
+        self.__heights = sorted(node.height for node in self.__inner)
+        self.__log_prior = self.__coalescent_prior()
+        self.__steps = 0
+        self.__accepted = 0
+
+
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def tree(self):
+        return self.__tree
+
+    @property
+    def steps(self):
+        return self.__steps
+
+    @property
+    def accepted(self):
+        return self.__accepted
+
+    @property
+    def log_prior(self):
+        return self.__log_prior
+
+
+##############################################################################
+################################# PROPERTIES #################################
+##############################################################################
+
+
+    @property
+    def log_likelihood(self):
+        """
+        Acts on:    a TreeSampler
+        Input:      none
+        Output:     log-likelihood of the sample given the current tree
+        Type:       property
+        """
+        return self.__likelihood.log_likelihood
+
+
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def __coalescent_prior(self):
+        """
+        Acts on:    a TreeSampler
+        Input:      none
+        Output:     log density of the heights of the tree under the
+                    coalescent with population N (0 if N is None)
+        """
+        if self.__N is None:
+            return 0.
+        heights = self.__heights
+        n = len(heights) + 1
+        log_prior = 0.
+        below = 0.
+        for (k, height) in zip(range(n, 1, -1), heights):
+            log_prior -= k * (k - 1) / 2. * (height - below) / self.__N
+            log_prior -= math.log(self.__N)
+            below = height
+        return log_prior
+
+    def __prior_change(self, old_height, height):
+        """
+        Acts on:    a TreeSampler
+        Input:      - old_height, a float, height of an inner node
+                    - height, a float, new height of the node
+        Output:     change of the log of the coalescent prior when the node 
+                    moves; the prior is minus the sum of the inner heights,
+                    each times the number of lineages below it minus one,
+                    over N, so only the heights between the old and the new
+                    rank of the node change their factor
+        """
+        if self.__N is None:
+            return 0.
+        heights = self.__heights
+        m = len(heights)
+        old = bisect.bisect_left(heights, old_height)
+        new = bisect.bisect_left(heights, height)
+        if new > old:
+            # the heights passed lose one rank and gain one lineage below
+            new -= 1
+            change = ((m - new) * height - (m - old) * old_height 
+                      + sum(heights[old + 1:new + 1]))
+        else:
+            change = ((m - new) * height - (m - old) * old_height 
+                      - sum(heights[new:old]))
+        return -change / self.__N
+
+    def __move_height(self, old_height, height):
+        """
+        Acts on:    a TreeSampler
+        Input:      - old_height, a float, height of an inner node
+                    - height, a float, new height of the node
+        Output:     moves the height in the sorted inner heights
+        """
+        del self.__heights[bisect.bisect_left(self.__heights, old_height)]
+        bisect.insort(self.__heights, height)
+
+    def __regraft(self, node, target, height):
+        """
+        Acts on:    a TreeSampler
+        Input:      - node, a MetricTree in the tree, not the root
+                    - target, a MetricTree in the tree, not below the parent
+                    of node
+                    - height, a float above node and target and below the
+                    parent of target
+        Output:     takes out the parent of node (its other child takes its
+                    place), and puts it at height above target, so that node
+                    and target become its children; returns the list of
+                    nodes whose partials changed
+        """
+        parent = node.parent
+        sibling = [child for child in parent.children if child is not node][0]
+        grand = parent.parent
+        parent._unlink(sibling)
+        if grand is not None:
+            grand._unlink(parent)
+            grand._link(sibling)
+        parent._set_height(height)
+        above = target.parent
+        if above is not None:
+            above._unlink(target)
+            above._link(parent)
+        parent._link(target)
+        # the root changes only if it was parent or target
+        if parent.parent is None:
+            self.__root_node = parent
+        elif self.__root_node is parent:
+            self.__root_node = sibling
+        if grand is None:
+            return [sibling, parent]
+        return [grand, parent]
+
+    def __spr_step(self):
+        """
+        Acts on:    a TreeSampler
+        Input:      none
+        Output:     3-tuple of the log of the Hastings ratio, the function
+                    undoing the proposal, which is already made, and the old
+                    and new height of the moved node; node and the new 
+                    parent are drawn so that the reverse move, from the same
+                    tree without the pruned subtree, has the same number of
+                    choices
+        """
+        root = self.__root_node
+        node = root
+        while node is root:
+            node = rnd.choice(self.__nodes)
+        parent = node.parent
+        old_height = parent.height
+        old_sibling = [x for x in parent.children if x is not node][0]
+        # uniform on the branches of the tree without parent that reach 
+        # above node, drawn until one does: a branch below node has its top
+        # below node, so only node itself is ruled out by hand (about 
+        # log n draws on average over node)
+        while True:
+            target = rnd.choice(self.__nodes)
+            if target is parent or target is node:
+                continue
+            top = target.parent
+            if top is parent:
+                top = parent.parent
+            if top is None or top.height > node.height:
+                break
+        # the root of the pruned tree gets an exponential branch above it,
+        # its scale depends only on the pruned tree and node, like the 
+        # choices of the reverse move
+        pruned_root = old_sibling if parent.parent is None else root
+        rate = 1. / max(pruned_root.height, node.height)
+
+        def log_density(x, height):
+            lower = max(node.height, x.height)
+            top = x.parent
+            if top is parent:
+                top = parent.parent
+            if top is None:
+                return math.log(rate) - rate * (height - lower)
+            return -math.log(top.height - lower)
+
+        lower = max(node.height, target.height)
+        top = target.parent
+        if top is parent:
+            top = parent.parent
+        if top is None:
+            height = lower + rnd.expovariate(rate)
+        else:
+            height = rnd.uniform(lower, top.height)
+        if height <= lower or (top is not None and height >= top.height):
+            return (None, lambda: None, None)
+        log_hastings = (log_density(old_sibling, old_height)
+                        - log_density(target, height))
+        changed = self.__regraft(node, target, height)
+        self.__likelihood.update(changed)
+
+        def undo():
+            self.__regraft(node, old_sibling, old_height)
+
+        return (log_hastings, undo, (old_height, height))
+
+    def __height_step(self):
+        """
+        Acts on:    a TreeSampler
+        Input:      none
+        Output:     3-tuple of the log of the Hastings ratio, the function
+                    undoing the proposal and the old and new height of the
+                    node; inner nodes move uniformly between their children
+                    and their parent, the root by a factor 
+                    exp(U(-window, window))
+        """
+        node = rnd.choice(self.__inner)
+        old_height = node.height
+        lower = max(child.height for child in node.children)
+        if node.parent is None:
+            height = old_height * math.exp(rnd.uniform(-self.__window,
+                                                       self.__window))
+            log_hastings = math.log(height / old_height)
+        else:
+            height = rnd.uniform(lower, node.parent.height)
+            log_hastings = 0.
+        if height <= lower or (node.parent is not None
+                               and height >= node.parent.height):
+            return (None, lambda: None, None)
+        node._set_height(height)
+        self.__likelihood.update([node])
+
+        def undo():
+            node._set_height(old_height)
+
+        return (log_hastings, undo, (old_height, height))
+
+    def step(self):
+        """
+        Acts on:    a TreeSampler
+        Input:      none
+        Output:     makes one Metropolis-Hastings step, returns True if the
+                    proposal was accepted
+        """
+        self.__steps += 1
+        old_log_likelihood = self.__likelihood.log_likelihood
+        old_log_prior = self.__log_prior
+        if len(self.__nodes) > 3 and rnd.random() < self.__spr:
+            (log_hastings, undo, moved) = self.__spr_step()
+        else:
+            (log_hastings, undo, moved) = self.__height_step()
+        if log_hastings is None:
+            return False
+        log_prior = old_log_prior + self.__prior_change(*moved)
+        log_ratio = (self.__likelihood.log_likelihood - old_log_likelihood
+                     + log_prior - old_log_prior + log_hastings)
+        if log_ratio >= 0. or rnd.random() < math.exp(log_ratio):
+            self.__likelihood.accept()
+            self.__move_height(*moved)
+            self.__log_prior = log_prior
+            self.__tree = self.__root_node
+            self.__accepted += 1
+            return True
+        undo()
+        self.__likelihood.reject(self.__root_node)
+        return False
+
+    def run(self, n, thin = 1):
+        """
+        Acts on:    a TreeSampler
+        Input:      - n, a positive integer, number of steps
+                    - thin, a positive integer
+        Output:     generator of copies of the tree after every thin steps
+                    (can be given to CombinatorialTree.Consensus or
+                    splits.rf_many for posterior support of clades)
+        """
+        for k in range(1, n + 1):
+            self.step()
+            if k % thin == 0:
+                yield self.__tree.copy()
@@ -118,7 +118,7 @@ class Pexp:
             if char != self.openparen and char != self.sepchildren:
                 name.append(char)
             if char == self.sepchildren:
-                return name
+                return ''.join(name)
         return ''.join(name)
     
     @property
@@ -311,19 +311,64 @@ class Pexp:
         """
         Act on:     Pexp class
         Input:      a Node object
-        Output:     Pexp equivalent of the input Node object
+        Output:     Pexp equivalent of the input Node object (the same 
+                    string JoinChildren would give node by node, built in
+                    one pass: first names are found going up, the string is
+                    written going down and joined once)
         Type:       classmethod
         """
         if (type(tree) is not Tree.CombinatorialTree 
             and type(tree) is not Tree.MetricTree):
             raise TypeError("Input has to be a Combinatorial or Metric Tree.")
-        if tree.is_leaf:
-            return cls(tree.name)
-        else:
-            children = []
-            for child in tree.children:
-                children.append(cls.FromTree(child))
-            return cls.JoinChildren(tree.height, children)
+        metric = tree.__class__._check_height()
+        heights = dict()
+        # first_name of the Pexp of every node and whether it has a comma
+        first = dict()
+        ordered = dict()
+        for node in tree.postorder():
+            if node.is_leaf:
+                # integer names (LabelTable ids) are written as numbers
+                name = str(node.name)
+                heights[id(node)] = 0.
+                first[id(node)] = (name, cls.sepchildren in name)
+                continue
+            below = [heights[id(child)] for child in node.children]
+            height = node.height if metric else max(below) + 1.
+            if type(height) is not float:
+                raise TypeError("First input has to be a float.")
+            if max(below) >= height:
+                raise ValueError('''First input has to be greater than 
+                the height of all the Pexp in the list.''')
+            heights[id(node)] = height
+            children = sorted(node.children, 
+                              key = lambda child: first[id(child)][0])
+            ordered[id(node)] = children
+            (name, comma) = first[id(children[0])]
+            if len(children) > 1:
+                first[id(node)] = (name, True)
+            elif comma:
+                first[id(node)] = (name, True)
+            else:
+                first[id(node)] = (name + cls.closeparen + cls.sepheight 
+                                   + str(height), False)
+        parts = []
+        stack = [tree]
+        while stack:
+            item = stack.pop()
+            if type(item) is str:
+                parts.append(item)
+            elif item.is_leaf:
+                parts.append(str(item.name))
+            else:
+                parts.append(cls.openparen)
+                stack.append(cls.closeparen + cls.sepheight 
+                             + str(heights[id(item)]))
+                children = ordered[id(item)]
+                for k in range(len(children) - 1, -1, -1):
+                    stack.append(children[k])
+                    if k != 0:
+                        stack.append(cls.sepchildren)
+        return cls(''.join(parts))
         
             
     @classmethod
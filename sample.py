@@ -307,6 +307,18 @@ class Genotype:
         cls = type(self)
         return cls(self.__length, self.__data)
     
+    def to_array(self, packed = False):
+        """
+        Acts on:    Genotype object
+        Input:      packed, a boolean
+        Output:     NumPy uint8 array of the bits of the Genotype, or of its 
+                    bytes if packed is True (bit i is bit i % 8 of byte i // 8)
+        """
+        data = np.frombuffer(bytes(self.__data), dtype = np.uint8)
+        if packed:
+            return data
+        return np.unpackbits(data, bitorder = 'little')[:self.__length]
+    
     def __iadd__(self, other):
         """
         Acts on:    Genotype object
@@ -471,7 +483,8 @@ class Sample:
                     to be the same length)
         Type:       property
         """
-        return self[self.keys[0]].length
+        # any Genotype will do, no need to sort the keys
+        return next(iter(self.dictionary.values())).length
     
     @property 
     def size(self):
@@ -481,7 +494,7 @@ class Sample:
         Output:     number of Genotypes stored in dictionary of the Sample
         Type:       property
         """
-        return len(self.keys)
+        return len(self.dictionary)
     
 
 ##############################################################################
@@ -524,6 +537,39 @@ class Sample:
         self.dictionary[key] = value
         return self
 
+    def to_array(self, packed = False):
+        """
+        Acts on:    a Sample object
+        Input:      packed, a boolean
+        Output:     2-tuple of the list of keys in alphabetical order and the 
+                    NumPy uint8 matrix with the bits (or the bytes if packed 
+                    is True) of their Genotypes as rows
+        """
+        keys = self.keys
+        return (keys, np.array([self[key].to_array(packed) for key in keys]))
+    
+    def distance_array(self, block = 4096):
+        """
+        Acts on:    a Sample object
+        Input:      block, a positive integer, number of bytes of the 
+                    genotypes handled at once
+        Output:     2-tuple of the list of keys in alphabetical order and the 
+                    NumPy float64 matrix of Humming distances between their 
+                    Genotypes, computed block by block with matrix products
+        """
+        (keys, packed) = self.to_array(packed = True)
+        n = len(keys)
+        D = np.zeros((n, n), dtype = np.float64)
+        for start in range(0, packed.shape[1], block):
+            # unused bits of the last byte are zero in every genotype
+            X = np.unpackbits(packed[:, start:start + block], axis = 1)
+            X = X.astype(np.float32)
+            ones = X.sum(axis = 1)
+            # differences = ones in one row + ones in the other - 2 * common
+            D += ones[:, None] + ones[None, :] - 2. * (X @ X.T)
+        np.fill_diagonal(D, 0.)
+        return (keys, D)
+
     def __repr__(self):
         """
         Acts on:    a Sample object
@@ -563,7 +609,8 @@ class Sample:
     def FromTree(cls, T, mu, init, interval = None):
         """
         Acts on:    Sample class
-        Input:      - T, a MetricTree
+        Input:      - T, a MetricTree, or a PersistentTree with heights (as
+                    in a Forest grown with persistent = True)
                     - mu, a float, the mutation rate of each element of the 
                     Genotype in one increment of time
                     - init, a Genotype which will correspond to node of the  
@@ -578,7 +625,8 @@ class Sample:
                     the whole Genotype was subject to potential mutations.
         Type:       classmethod
         """
-        if type(T) is not Tree.MetricTree:
+        if (type(T) is not Tree.MetricTree 
+            and not (type(T) is Tree.PersistentTree and T.metric)):
             raise TypeError('First input has to be a MetricTree.')
         if type(mu) is not float:
             raise TypeError('Second input has to be a float.')
@@ -0,0 +1,138 @@
+import numpy as np
+import Tree
+
+
+##############################################################################
+################################## FUNCTIONS #################################
+##############################################################################
+
+
+def leaf_index(names):
+    """
+    Input:      names, list of names of leaves
+    Output:     dictionary from the names in sorted order to the bit
+                positions 0, 1, 2, ... used to encode clades
+    """
+    return {name: k for (k, name) in enumerate(sorted(names))}
+
+
+def _parent_clades(parent, heights, leaf_bits):
+    """
+    Input:      - parent, list of parents of nodes, children before parents
+                and the root last
+                - heights, list of heights of the nodes
+                - leaf_bits, list of bitsets of the nodes that are leaves
+                (0 for the other nodes)
+    Output:     dictionary from the bitset of every clade below the root to
+                the length of the branch above it (lengths of branches with
+                the same clade, above unary nodes, are added up)
+    Used in:    clades, rf_many
+    """
+    bits = list(leaf_bits)
+    found = dict()
+    for i in range(len(parent) - 1):
+        p = parent[i]
+        bits[p] |= bits[i]
+        found[bits[i]] = found.get(bits[i], 0.) + heights[p] - heights[i]
+    return found
+
+
+def clades(tree, index = None):
+    """
+    Input:      - tree, a Combinatorial/Metric/PersistentTree or ArrayTree
+                - index, dictionary from names of leaves to bit positions
+                (leaf_index of the leaves of tree if None)
+    Output:     dictionary from the bitset (an integer with bit index[name]
+                set for every leaf below) of every clade below the root to
+                the length of the branch above it, found in one postorder
+                pass
+    """
+    array = Tree.ArrayTree.FromAny(tree)
+    if index is None:
+        index = leaf_index(array.leaves_names)
+    leaf = (array.n_children == 0).tolist()
+    leaf_bits = []
+    for (i, name) in enumerate(array.names):
+        if not leaf[i]:
+            leaf_bits.append(0)
+        elif name in index:
+            leaf_bits.append(1 << index[name])
+        else:
+            raise ValueError('Leaf ' + str(name) + ' is not in the index.')
+    return _parent_clades(array.parent.tolist(), array.heights.tolist(),
+                          leaf_bits)
+
+
+def _distance(reference, other, weighted):
+    """
+    Input:      - reference, other, dictionaries of clades
+                - weighted, a boolean
+    Output:     Robinson-Foulds distance between the clades (number of
+                clades with more than one leaf that are in only one of
+                them), or the weighted distance (sum over all clades of
+                differences of lengths of their branches, 0 when missing)
+    Used in:    rf_distance, rf_many
+    """
+    if not weighted:
+        count = 0
+        for bits in reference:
+            if bits & (bits - 1) and bits not in other:
+                count += 1
+        for bits in other:
+            if bits & (bits - 1) and bits not in reference:
+                count += 1
+        return count
+    total = 0.
+    for (bits, length) in reference.items():
+        total += abs(length - other.get(bits, 0.))
+    for (bits, length) in other.items():
+        if bits not in reference:
+            total += abs(length)
+    return total
+
+
+def rf_distance(tree_a, tree_b, weighted = False):
+    """
+    Input:      - tree_a, tree_b, trees with the same leaves
+                - weighted, a boolean
+    Output:     Robinson-Foulds distance between the rooted trees, or the
+                weighted one (sum of differences of branch lengths) if
+                weighted is True
+    """
+    # converted once, clades takes the ArrayTree as it is
+    array = Tree.ArrayTree.FromAny(tree_a)
+    index = leaf_index(array.leaves_names)
+    return _distance(clades(array, index), clades(tree_b, index), weighted)
+
+
+def rf_many(reference, candidates, weighted = False):
+    """
+    Input:      - reference, a tree
+                - candidates, a TreeEnsemble or list of trees with the
+                same leaves as reference
+                - weighted, a boolean
+    Output:     NumPy array of Robinson-Foulds (or weighted) distances from
+                reference to every candidate; the clades of the reference
+                are hashed once and every candidate costs one pass
+    """
+    array = Tree.ArrayTree.FromAny(reference)
+    index = leaf_index(array.leaves_names)
+    ref = clades(array, index)
+    distances = np.zeros(len(candidates),
+                         dtype = np.float64 if weighted else np.int64)
+    if type(candidates) is Tree.TreeEnsemble:
+        n = candidates.Nleaves
+        if sorted(candidates.names) != sorted(index):
+            raise ValueError('Ensemble has to have the leaves of reference.')
+        leaf_bits = [1 << index[name] for name in candidates.names]
+        for r in range(len(candidates)):
+            size = int(candidates.sizes[r])
+            parent = candidates.parent[r, :size].tolist()
+            heights = candidates.heights[r, :size].tolist()
+            found = _parent_clades(parent, heights,
+                                   leaf_bits + [0] * (size - n))
+            distances[r] = _distance(ref, found, weighted)
+        return distances
+    for (r, tree) in enumerate(candidates):
+        distances[r] = _distance(ref, clades(tree, index), weighted)
+    return distances
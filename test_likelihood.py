@@ -0,0 +1,93 @@
+import itertools
+import random
+import numpy as np
+import Tree
+import sample
+import likelihood
+
+
+def test_fit_heights_inner_node_named_like_leaf():
+    a = Tree.MetricTree([], None, 0., '0')
+    b = Tree.MetricTree([], None, 0., '1')
+    c = Tree.MetricTree([], None, 0., '2')
+    d = Tree.MetricTree([], None, 0., '3')
+    # inner nodes named after ancestors, as in a Forest
+    ab = Tree.MetricTree([a, b], None, 2., '3')
+    cd = Tree.MetricTree([c, d], None, 3., '0')
+    tree = Tree.MetricTree([ab, cd], None, 6., '2')
+    S = sample.Sample.FromTree(tree, 0.05, sample.Genotype(500))
+    (fitted, value) = likelihood.fit_heights(tree, S, 0.05)
+    assert fitted.leaves_names == tree.leaves_names
+    assert np.isclose(value, likelihood.log_likelihood(fitted, S, 0.05))
+    assert value >= likelihood.log_likelihood(tree, S, 0.05) - 1e-6
+
+
+def brute_force_log_likelihood(tree, S, mu):
+    # every locus summed over all the states of the inner nodes
+    (keys, data) = S.to_array()
+    rows = dict(zip(keys, data))
+    nodes = list(tree.preorder())
+    inner = [node for node in nodes if not node.is_leaf]
+    total = 0.
+    for locus in range(data.shape[1]):
+        probability = 0.
+        for states in itertools.product((0, 1), repeat = len(inner)):
+            state = {id(node): s for (node, s) in zip(inner, states)}
+            for node in nodes:
+                if node.is_leaf:
+                    state[id(node)] = rows[node.name][locus]
+            p = 0.5
+            for node in nodes[1:]:
+                flip = 1. - np.exp(-mu * (node.parent.height - node.height))
+                same = state[id(node)] == state[id(node.parent)]
+                p *= (1. - flip) if same else flip
+            probability += p
+        total += np.log(probability)
+    return total
+
+
+def test_log_likelihood_matches_brute_force():
+    random.seed(53)
+    a = Tree.MetricTree([], None, 0., 'a')
+    b = Tree.MetricTree([], None, 0., 'b')
+    c = Tree.MetricTree([], None, 0., 'c')
+    d = Tree.MetricTree([], None, 0., 'd')
+    e = Tree.MetricTree([], None, 0., 'e')
+    # a unary node and a node with three children
+    unary = Tree.MetricTree([Tree.MetricTree([a, b], None, 1.5)], None, 2.)
+    tree = Tree.MetricTree([unary, Tree.MetricTree([c, d, e], None, 3.)], 
+                           None, 4.)
+    for mu in (0.05, 0.3):
+        S = sample.Sample.FromTree(tree, mu, sample.Genotype(40))
+        expected = brute_force_log_likelihood(tree, S, mu)
+        assert np.isclose(likelihood.log_likelihood(tree, S, mu), expected)
+        pruning = likelihood.PruningLikelihood(tree, S, mu)
+        assert np.isclose(pruning.log_likelihood, expected)
+    T = Tree.MetricTree.Kingman(5, 5)
+    S = sample.Sample.FromTree(T, 0.1, sample.Genotype(40))
+    H = likelihood.HeightLikelihood(T, S, 0.1)
+    heights = H.array.heights.copy()
+    (value, gradient) = H.evaluate(heights)
+    assert np.isclose(value, brute_force_log_likelihood(T, S, 0.1))
+    step = 1e-6
+    for k in np.flatnonzero(H.array.n_children > 0):
+        moved = heights.copy()
+        moved[k] += step
+        assert np.isclose((H.evaluate(moved)[0] - value) / step, 
+                          gradient[k], rtol = 1e-3, atol = 1e-3)
+
+
+def test_site_patterns_weights_rebuild_the_loci():
+    random.seed(59)
+    T = Tree.MetricTree.Kingman(6, 6)
+    S = sample.Sample.FromTree(T, 0.05, sample.Genotype(300))
+    (keys, patterns, weights) = likelihood.site_patterns(S)
+    (sample_keys, data) = S.to_array()
+    assert keys == sample_keys
+    assert weights.sum() == data.shape[1]
+    assert np.all(patterns[0] == 0)
+    columns = {tuple(column) for column in patterns.T}
+    assert len(columns) == patterns.shape[1]
+    flipped = data ^ data[:1]
+    for (column, weight) in zip(patterns.T, weights):
+        assert np.all(flipped == column[:, None], axis = 0).sum() == weight
@@ -0,0 +1,21 @@
+import random
+import pytest
+import Tree
+import sample
+import likelihood
+import mcmc
+
+
+def test_incremental_prior_and_root():
+    random.seed(2)
+    T = Tree.MetricTree.Kingman(20, 200)
+    S = sample.Sample.FromTree(T, 0.01, sample.Genotype(80))
+    sampler = mcmc.TreeSampler(T, S, 0.01, N = 200.)
+    for _ in range(2000):
+        sampler.step()
+    root = sampler.tree
+    assert root.parent is None and root.Nleaves == 20
+    fresh = mcmc.TreeSampler(root, S, 0.01, N = 200.)
+    assert sampler.log_prior == pytest.approx(fresh.log_prior, abs = 1e-8)
+    full = likelihood.PruningLikelihood(root, S, 0.01)
+    assert sampler.log_likelihood == pytest.approx(full.log_likelihood)
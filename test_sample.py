@@ -0,0 +1,29 @@
+import random
+import pytest
+import Tree
+import forest
+import sample
+
+
+@pytest.mark.parametrize('persistent', [False, True])
+def test_from_forest(persistent):
+    random.seed(7)
+    F = forest.Forest.forest_n_iterations(5, 12, 0.3, persistent = persistent)
+    S, trees = sample.Sample.FromForest(F, 0.05, 60, sample.Genotype(60))
+    assert sorted(S.keys) == ['0', '1', '2', '3', '4']
+    assert all(S[key].length == 60 for key in S.keys)
+    if persistent:
+        assert type(trees[0]) is Tree.PersistentTree
+
+
+def test_from_tree_persistent_matches_metric():
+    T = Tree.MetricTree.Kingman(6, 100)
+    P = Tree.PersistentTree.FromTree(T)
+    random.seed(3)
+    expected = sample.Sample.FromTree(T, 0.01, sample.Genotype(50))
+    random.seed(3)
+    found = sample.Sample.FromTree(P, 0.01, sample.Genotype(50))
+    assert str(found) == str(expected)
+    with pytest.raises(TypeError):
+        sample.Sample.FromTree(Tree.PersistentTree.FromTree(T.demote()), 
+                               0.01, sample.Genotype(50))
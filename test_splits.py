@@ -0,0 +1,48 @@
+import numpy as np
+import Tree
+import splits
+
+
+def naive_clades(T):
+    found = dict()
+    for node in T.preorder():
+        for child in node.children:
+            clade = frozenset(child.leaves_names)
+            found[clade] = found.get(clade, 0.) + node.height - child.height
+    return found
+
+
+def naive_rf(A, B, weighted = False):
+    (a, b) = (naive_clades(A), naive_clades(B))
+    if weighted:
+        return sum(abs(a.get(clade, 0.) - b.get(clade, 0.)) 
+                   for clade in set(a) | set(b))
+    return len([clade for clade in set(a) ^ set(b) if len(clade) > 1])
+
+
+def decode(bits, index):
+    return frozenset(name for (name, k) in index.items() if bits >> k & 1)
+
+
+def test_clades_and_distances_match_naive_sets():
+    np.random.seed(37)
+    E = Tree.MetricTree.EvolveMany(10, 12, 15)
+    trees = list(E)
+    index = splits.leaf_index(trees[0].leaves_names)
+    assert sorted(index.values()) == list(range(10))
+    for T in trees:
+        found = splits.clades(T)
+        assert {decode(bits, index): length 
+                for (bits, length) in found.items()} == naive_clades(T)
+        assert splits.clades(Tree.PersistentTree.FromTree(T)) == found
+        assert splits.clades(T.demote()).keys() == found.keys()
+    reference = trees[0]
+    for weighted in (False, True):
+        expected = [naive_rf(reference, T, weighted) for T in trees]
+        assert np.allclose([splits.rf_distance(reference, T, weighted) 
+                            for T in trees], expected)
+        assert np.allclose(splits.rf_many(reference, trees, weighted), 
+                           expected)
+        assert np.allclose(splits.rf_many(reference, E, weighted), expected)
+    assert splits.rf_distance(reference, reference) == 0
+    assert splits.rf_many(reference, trees).dtype == np.int64
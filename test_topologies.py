@@ -0,0 +1,68 @@
+import random
+import numpy as np
+import pytest
+import Tree
+import topologies
+
+
+def ranking(tree):
+    # clades of the inner nodes in the order they merge
+    inner = [node for node in tree.postorder() if not node.is_leaf]
+    inner.sort(key = lambda node: node.height)
+    return [frozenset(node.leaves_names) for node in inner]
+
+
+@pytest.mark.parametrize('ranked', [False, True])
+def test_encode_decode_bijection(ranked):
+    expected = [1, 1, 3, 18, 180, 2700] if ranked else [1, 1, 3, 15, 105, 945]
+    for n in range(1, 7):
+        names = 'abcdef'[:n]
+        assert topologies.count(n, ranked) == expected[n - 1]
+        seen = set()
+        for (code, T) in enumerate(topologies.topologies(names, ranked)):
+            assert sorted(T.leaves_names) == sorted(names)
+            for node in T.postorder():
+                assert len(node.children) in (0, 2)
+            assert topologies.encode(T, ranked) == code
+            if ranked:
+                seen.add(tuple(ranking(T)))
+            else:
+                seen.add(T.canonical_hash)
+        assert len(seen) == expected[n - 1]
+
+
+def test_encode_matches_decoded_topology():
+    random.seed(43)
+    names = 'abcdefg'
+    for _ in range(20):
+        T = Tree.MetricTree.Kingman(7, 30)
+        code = topologies.encode(T)
+        assert topologies.decode(code, names) == T.demote()
+        code = topologies.encode(T, ranked = True)
+        assert ranking(topologies.decode(code, names, True)) == ranking(T)
+        assert topologies.encode(Tree.PersistentTree.FromTree(T), True) == code
+    with pytest.raises(TypeError):
+        topologies.encode(T.demote(), ranked = True)
+    with pytest.raises(ValueError):
+        topologies.decode(topologies.count(7), names)
+    with pytest.raises(Tree.TreeStructureError):
+        topologies.encode(Tree.CombinatorialTree([Tree.CombinatorialTree(
+            [], None, name) for name in 'abc'], None))
+
+
+def test_tally_kingman_ranked_topologies_uniform():
+    random.seed(47)
+    trees = [Tree.MetricTree.Kingman(4, 30) for _ in range(3600)]
+    counts = topologies.tally(trees, ranked = True)
+    assert counts.sum() == 3600 and len(counts) == 18
+    assert np.all(np.abs(counts - 200) < 60)
+    counts = topologies.tally(trees)
+    balanced = [code for (code, T) in enumerate(topologies.topologies('abcd'))
+                if sorted(child.Nleaves for child in T.children) == [2, 2]]
+    assert len(balanced) == 3
+    assert abs(counts[balanced].sum() / 3600. - 1. / 3.) < 0.03
+    np.random.seed(47)
+    E = Tree.MetricTree.EvolveMany(4, 2000, 300)
+    assert np.array_equal(topologies.tally(E), topologies.tally(list(E)))
+    assert np.array_equal(topologies.tally(E, True), 
+                          topologies.tally(list(E), True))
@@ -0,0 +1,577 @@
+import random
+import numpy as np
+import pytest
+import Tree
+import DistMatr
+import sample
+import pexp
+
+
+def test_common_ancestor_integer_ids():
+    T = Tree.MetricTree.Kingman(8, 100, integer_ids = True)
+    pair = T.leaf(0).common_ancestor([1])
+    assert pair is T.leaf(0).common_ancestor([T.leaf(1)])
+    assert T.lca_index.lca(0, 1) is pair
+    assert T.leaf(0).common_ancestor([1]) is pair
+    with pytest.raises(ValueError):
+        T.lca_index.lca(0, 99)
+    with pytest.raises(ValueError):
+        T.common_ancestor([0, 99])
+
+
+def test_repr_round_trip_integer_ids():
+    T = Tree.MetricTree.Kingman(6, 100, integer_ids = True)
+    namespace = vars(Tree)
+    assert eval(repr(T), namespace) == T
+    C = T.demote()
+    assert eval(repr(C), namespace) == C
+    assert type(eval(repr(C), namespace)) is Tree.CombinatorialTree
+    D = DistMatr.DistanceMatrix.FromTree(T)
+    assert D.submatrix([0, 2])[0, 2] == D[0, 2]
+
+
+def test_neighbor_joining_identical_genotypes():
+    S = sample.Sample.FromTree(Tree.MetricTree.Kingman(5, 100), 0., 
+                               sample.Genotype(200))
+    T = Tree.MetricTree.FromSample(S, 'nj')
+    assert T.leaves_names == S.keys
+    T = Tree.MetricTree.NeighborJoining(['a', 'b', 'c'], np.zeros((3, 3)))
+    assert T.leaves_names == ['a', 'b', 'c']
+
+
+def test_pexp_from_tree_matches_join_children():
+    leaves = [Tree.MetricTree([], None, 0., name) for name in 'dcba']
+    unary = Tree.MetricTree([leaves[0]], None, 1., None)
+    pair = Tree.MetricTree([unary, leaves[1]], None, 2., None)
+    root = Tree.MetricTree([leaves[2], pair, leaves[3]], None, 3., None)
+    P = pexp.Pexp
+    expected = P.JoinChildren(3., [P('b'), P('a'), P.JoinChildren(2., 
+                              [P.JoinChildren(1., [P('d')]), P('c')])])
+    assert str(root) == expected.string
+
+
+def caterpillar(n):
+    node = Tree.MetricTree([], None, 0., 'l0')
+    for i in range(1, n):
+        leaf = Tree.MetricTree([], None, 0., 'l' + str(i))
+        node = Tree.MetricTree([node, leaf], None, float(i))
+    return node
+
+
+def test_pexp_from_tree_deep_caterpillar():
+    node = caterpillar(20000)
+    assert str(node).startswith('(' * 19999 + 'l0,l1):1.0')
+
+
+def test_from_pexp_deep_caterpillar_round_trip():
+    node = caterpillar(20000)
+    namespace = dict(vars(Tree), Pexp = pexp.Pexp)
+    assert eval(repr(node), namespace) == node
+    assert eval(repr(node.demote()), namespace) == node.demote()
+
+
+def test_restrict_many_leaves_outside_subtree():
+    T = Tree.MetricTree.Kingman(6, 100)
+    child = T.children[0]
+    names = child.leaves_names
+    outside = [name for name in T.leaves_names if name not in names]
+    assert child.restrict_many([names])[0].leaves_names == names
+    with pytest.raises(ValueError):
+        child.restrict_many([[names[0], outside[0]]])
+
+
+def test_consensus_builds_the_class_acted_on():
+    trees = [Tree.MetricTree.Kingman(6, 100) for _ in range(5)]
+    C = Tree.CombinatorialTree.Consensus(trees)
+    M = Tree.MetricTree.Consensus(trees)
+    assert type(C) is Tree.CombinatorialTree
+    assert type(M) is Tree.MetricTree
+    assert M.demote() == C
+    assert M.height == C.height
+
+
+def test_unlink_identical_siblings_by_identity():
+    first = Tree.MetricTree([], None, 0., 'a')
+    second = Tree.MetricTree([], None, 0., 'a')
+    root = Tree.MetricTree([first, second], None, 1.)
+    assert first == second
+    root._unlink(second)
+    assert root.children[0] is first
+    assert first.parent is root and second.parent is None
+
+
+def structure(tree):
+    return [(node.name, node.height, len(node.children)) 
+            for node in tree.postorder()]
+
+
+def test_array_tree_round_trip():
+    T = Tree.MetricTree.Kingman(30, 1000)
+    A = Tree.ArrayTree.FromTree(T)
+    assert A.size == 59 and A.Nleaves == 30 and A.root == 58
+    assert A.leaves_names == T.leaves_names
+    U = A.to_tree()
+    assert type(U) is Tree.MetricTree
+    assert structure(U) == structure(T)
+    C = T.demote()
+    V = Tree.ArrayTree.FromTree(C).to_tree()
+    assert type(V) is Tree.CombinatorialTree
+    assert structure(V) == structure(C)
+
+
+def test_array_tree_unary_nodes_round_trip():
+    a = Tree.MetricTree([], None, 0., 'a')
+    b = Tree.MetricTree([], None, 0., 'b')
+    top = Tree.MetricTree([Tree.MetricTree([a], None, 1., 'a'), b], None, 2.)
+    assert structure(Tree.ArrayTree.FromTree(top).to_tree()) == structure(top)
+
+
+def test_array_tree_from_parents_any_order():
+    A = Tree.ArrayTree.FromTree(Tree.MetricTree.Kingman(12, 100))
+    permutation = np.random.RandomState(0).permutation(A.size)
+    position = np.empty(A.size, dtype = np.int64)
+    position[permutation] = np.arange(A.size)
+    parent = np.where(A.parent >= 0, position[np.maximum(A.parent, 0)], -1)
+    B = Tree.ArrayTree.FromParents(parent[permutation], 
+                                   A.heights[permutation], 
+                                   [A.names[i] for i in permutation])
+    assert B.to_tree() == A.to_tree()
+    assert np.all(B.parent[:-1] > np.arange(B.size - 1))
+
+
+def naive_depth(node):
+    depth = dict()
+    for x in node.postorder():
+        depth[id(x)] = max([depth[id(c)] + 1. for c in x.children], 
+                           default = 0.)
+    return depth[id(node)]
+
+
+def check_aggregates(root):
+    for node in root.postorder():
+        names = sorted(x.name for x in node.preorder() if x.children == [])
+        assert node.leaves_names == names
+        assert node.Nleaves == len(names)
+        assert node.height == naive_depth(node)
+        assert node.canonical_hash == node.copy().canonical_hash
+
+
+def naive_lca(u, v):
+    above = set()
+    while u is not None:
+        above.add(id(u))
+        u = u.parent
+    while id(v) not in above:
+        v = v.parent
+    return v
+
+
+def test_cached_aggregates_follow_link_and_unlink():
+    T = Tree.MetricTree.Kingman(16, 100).demote()
+    check_aggregates(T)
+    T.lca_index
+    depth = {id(T): 0}
+    for node in T.preorder():
+        for child in node.children:
+            depth[id(child)] = depth[id(node)] + 1
+    deep = max(T.leaves, key = lambda leaf: depth[id(leaf)])
+    (cut, rest) = deep.cut()
+    assert rest is T
+    check_aggregates(T)
+    above = Tree.CombinatorialTree([], None)
+    assert T.children[0].insert(above) is T
+    above._link(cut)
+    check_aggregates(T)
+    assert T.Nleaves == 16
+    other = T.leaf(T.leaves_names[0])
+    assert T.lca_index.lca(deep, other) is naive_lca(deep, other)
+    T.children[-1].delete()
+    check_aggregates(T)
+
+
+def test_lca_index_matches_naive_walk():
+    T = Tree.MetricTree.Evolve(20, 60)
+    index = T.lca_index
+    nodes = list(T.postorder())
+    for u in nodes:
+        for v in nodes:
+            assert index.lca(u, v) is naive_lca(u, v)
+    leaves = T.leaves
+    for (u, v) in zip(leaves, leaves[1:]):
+        assert index.lca(u.name, v.name) is naive_lca(u, v)
+    group = leaves[::3]
+    expected = group[0]
+    for leaf in group[1:]:
+        expected = naive_lca(expected, leaf)
+    assert index.common_ancestor(group) is expected
+    # common_ancestor of a node includes the node itself
+    assert group[0].common_ancestor([leaf.name for leaf in group[1:]]) \
+        is expected
+    heights = index.height_matrix(group)
+    for (i, u) in enumerate(group):
+        for (j, v) in enumerate(group):
+            assert heights[i, j] == naive_lca(u, v).height
+
+
+def test_cophenetic_matrix_matches_naive_walk():
+    T = Tree.MetricTree.Evolve(15, 40)
+    for tree in (T, T.demote()):
+        (names, D) = tree.cophenetic_matrix()
+        leaves = tree.leaves
+        assert names == [leaf.name for leaf in leaves]
+        for (i, u) in enumerate(leaves):
+            for (j, v) in enumerate(leaves):
+                expected = 0. if i == j else 2. * naive_lca(u, v).height
+                assert D[i, j] == expected
+    M = DistMatr.DistanceMatrix.FromTree(T)
+    (u, v) = (T.leaves[0], T.leaves[-1])
+    assert M[u.name, v.name] == 2. * naive_lca(u, v).height
+
+
+def check_genealogy(T, N0):
+    assert sorted(T.leaves_names) == sorted(Tree.MetricTree._leaf_names(N0, 
+                                                                        False))
+    for node in T.postorder():
+        assert node.height == float(int(node.height))
+        for child in node.children:
+            assert child.height < node.height
+        assert len(node.children) != 1
+
+
+def test_evolve_fast_wright_fisher_distribution():
+    random.seed(11)
+    for _ in range(20):
+        check_genealogy(Tree.MetricTree.EvolveFast(7, 10), 7)
+    # two lineages meet in every generation with probability 1/N
+    heights = [Tree.MetricTree.EvolveFast(2, 5).height for _ in range(4000)]
+    assert abs(np.mean(heights) - 5.) < 0.35
+    # three lineages out of three parents: a generation with a merge has
+    # all three in one parent with probability (1/9) / (7/9)
+    triple = [len(Tree.MetricTree.EvolveFast(3, 3).children) == 3 
+              for _ in range(4000)]
+    assert abs(np.mean(triple) - 1. / 7.) < 0.03
+
+
+def test_evolve_many_replicates_wright_fisher_distribution():
+    np.random.seed(12)
+    E = Tree.MetricTree.EvolveMany(7, 10, 20)
+    assert len(E) == 20 and E.Nleaves == 7
+    for r in range(len(E)):
+        T = E[r]
+        check_genealogy(T, 7)
+        assert T.height == E.tmrca[r]
+        assert Tree.ArrayTree.FromTree(T).size == E.sizes[r]
+    assert np.all(E.parent[:, :7] >= 7)
+    assert abs(Tree.MetricTree.EvolveMany(2, 5, 4000).tmrca.mean() - 5.) < 0.35
+    E = Tree.MetricTree.EvolveMany(3, 3, 4000)
+    assert abs(np.mean(E.sizes == 4) - 1. / 7.) < 0.03
+    with pytest.raises(TypeError):
+        Tree.MetricTree.EvolveMany(3, 3, 2.)
+    with pytest.raises(ValueError):
+        Tree.MetricTree.EvolveMany(3, 3, 0)
+
+
+def test_kingman_coalescent_distribution():
+    random.seed(13)
+    for _ in range(20):
+        check_genealogy(Tree.MetricTree.Kingman(7, 10, discrete = True), 7)
+    # E[TMRCA] = 2N(1 - 1/N0), a 4-leaf tree is balanced with probability 1/3
+    trees = [Tree.MetricTree.Kingman(4, 10) for _ in range(4000)]
+    assert abs(np.mean([T.height for T in trees]) - 15.) < 0.8
+    balanced = [sorted(child.Nleaves for child in T.children) == [2, 2] 
+                for T in trees]
+    assert abs(np.mean(balanced) - 1. / 3.) < 0.03
+    for node in trees[0].postorder():
+        assert len(node.children) in (0, 2)
+
+
+def tree_clades(tree):
+    return {frozenset(node.leaves_names): node.height 
+            for node in tree.postorder() if not node.is_leaf}
+
+
+def naive_single_linkage(names, D):
+    clusters = [[i] for i in range(len(names))]
+    clades = {}
+    while len(clusters) > 1:
+        (d, a, b) = min((min(D[i, j] for i in u for j in v), a, b) 
+                        for (a, u) in enumerate(clusters) 
+                        for (b, v) in enumerate(clusters) if a < b)
+        for part in (clusters[a], clusters[b]):
+            part = frozenset(names[i] for i in part)
+            if len(part) > 1 and clades[part] == d / 2:
+                del clades[part]
+        merged = clusters[a] + clusters[b]
+        clades[frozenset(names[i] for i in merged)] = d / 2
+        clusters = [u for (c, u) in enumerate(clusters) if c not in (a, b)]
+        clusters.append(merged)
+    return clades
+
+
+def test_from_dist_array_matches_naive_single_linkage():
+    random.seed(17)
+    for T in (Tree.MetricTree.Evolve(12, 30), Tree.MetricTree.Kingman(12, 30)):
+        (names, D) = T.cophenetic_matrix()
+        S = Tree.MetricTree.FromDistArray(names, D)
+        assert S == T
+        assert tree_clades(S) == tree_clades(T)
+        assert tree_clades(S) == naive_single_linkage(names, D)
+        M = DistMatr.DistanceMatrix.FromTree(T)
+        assert Tree.MetricTree.FromDistMatr(M) == T
+        D = D.copy()
+        D[0, -1] = D[-1, 0] = D[0, -1] + 1.
+        with pytest.raises(ValueError):
+            Tree.MetricTree.FromDistArray(names, D)
+
+
+def naive_upgma(names, D):
+    # merges follow MetricTree._merge: a merge at the height of one of the 
+    # merged clusters joins that cluster's node
+    clusters = [frozenset([name]) for name in names]
+    D = [list(row) for row in D]
+    clades = {cluster: 0. for cluster in clusters}
+    while len(clusters) > 1:
+        m = len(clusters)
+        (d, i, j) = min((D[i][j], i, j) for i in range(m) 
+                        for j in range(i + 1, m))
+        (a, b) = (clusters[i], clusters[j])
+        height = max(d / 2, clades[a], clades[b])
+        for part in (a, b):
+            if len(part) > 1 and clades[part] == height:
+                del clades[part]
+        new = [(D[i][k] * len(a) + D[j][k] * len(b)) / (len(a) + len(b)) 
+               for k in range(m)]
+        keep = [k for k in range(m) if k not in (i, j)]
+        D = [[D[k][l] for l in keep] + [new[k]] for k in keep] + \
+            [[new[k] for k in keep] + [0.]]
+        clusters = [clusters[k] for k in keep] + [a | b]
+        clades[a | b] = height
+    return {clade: height for (clade, height) in clades.items() 
+            if len(clade) > 1}
+
+
+def naive_neighbor_joining_splits(names, D):
+    clusters = [frozenset([name]) for name in names]
+    D = [list(row) for row in D]
+    joined = []
+    while len(clusters) > 3:
+        m = len(clusters)
+        R = [sum(row) for row in D]
+        (q, i, j) = min(((m - 2) * D[i][j] - R[i] - R[j], i, j) 
+                        for i in range(m) for j in range(i + 1, m))
+        new = [(D[i][k] + D[j][k] - D[i][j]) / 2 for k in range(m)]
+        keep = [k for k in range(m) if k not in (i, j)]
+        D = [[D[k][l] for l in keep] + [new[k]] for k in keep] + \
+            [[new[k] for k in keep] + [0.]]
+        joined.append(clusters[i] | clusters[j])
+        clusters = [clusters[k] for k in keep] + [joined[-1]]
+    return splits(names, joined)
+
+
+def splits(names, clades):
+    # unrooted splits, each given by its side without the first name
+    everything = frozenset(names)
+    result = set()
+    for clade in clades:
+        if names[0] in clade:
+            clade = everything - clade
+        if 1 < len(clade) < len(names) - 1:
+            result.add(clade)
+    return result
+
+
+def random_distances(n):
+    X = np.random.rand(n, n)
+    D = X + X.T
+    np.fill_diagonal(D, 0.)
+    return D
+
+
+def test_upgma_and_neighbor_joining_match_naive_references():
+    np.random.seed(19)
+    for n in (2, 3, 7, 25, 60):
+        names = [str(i) for i in range(n)]
+        D = random_distances(n)
+        T = Tree.MetricTree.UPGMA(names, D)
+        assert sorted(T.leaves_names) == sorted(names)
+        assert tree_clades(T) == naive_upgma(names, D)
+        T = Tree.MetricTree.NeighborJoining(names, D)
+        assert sorted(T.leaves_names) == sorted(names)
+        assert splits(names, tree_clades(T)) == \
+            naive_neighbor_joining_splits(names, D)
+        for node in T.postorder():
+            for child in node.children:
+                assert child.height < node.height
+
+
+def test_plot_layout_and_file_output(tmp_path):
+    T = Tree.MetricTree.Kingman(30, 50)
+    (nodes, xs, ys) = T._layout()
+    assert [id(node) for node in nodes] == [id(node) for node in T.postorder()]
+    position = {id(node): k for (k, node) in enumerate(nodes)}
+    leaves = [node for node in nodes if node.is_leaf]
+    assert [xs[position[id(leaf)]] for leaf in leaves] == list(range(30))
+    for (k, node) in enumerate(nodes):
+        assert ys[k] == node.height
+        if not node.is_leaf:
+            (first, last) = (node.children[0], node.children[-1])
+            assert xs[k] == (xs[position[id(first)]] 
+                             + xs[position[id(last)]]) / 2
+    for (tree, name) in ((T, 'metric.png'), (T.demote(), 'combinatorial.png')):
+        filename = str(tmp_path / name)
+        tree.plot(filename = filename, labels = False)
+        assert (tmp_path / name).stat().st_size > 0
+
+
+def check_shared_off_path(P, Q, path):
+    # every child off the path above its last node is the very same object
+    (p, q) = (P, Q)
+    for k in path[:-1]:
+        assert len(p.children) == len(q.children)
+        for (i, (a, b)) in enumerate(zip(p.children, q.children)):
+            assert (a is b) != (i == k)
+        (p, q) = (p.children[k], q.children[k])
+    return (p, q)
+
+
+def test_persistent_tree_round_trip_and_sharing():
+    T = Tree.MetricTree.Kingman(20, 50)
+    for tree in (T, T.demote()):
+        P = Tree.PersistentTree.FromTree(tree)
+        assert P.metric == (tree is T)
+        assert P.canonical_hash == tree.canonical_hash
+        assert P.to_tree() == tree and str(P) == str(tree)
+        assert type(P.to_tree()) is type(tree)
+        assert P.Nleaves == tree.Nleaves
+        assert P.leaves_names == tree.leaves_names
+        assert P.copy() is P
+    C = T.demote()
+    P = Tree.PersistentTree.FromTree(C)
+    before = str(P)
+    path = (0,)
+    while not P.node(path).is_leaf:
+        path += (len(P.node(path).children) - 1,)
+    mutable = C
+    for k in path:
+        mutable = mutable.children[k]
+    (sub, Q) = P.cut(path)
+    assert sub is P.node(path)
+    (p, q) = check_shared_off_path(P, Q, path)
+    assert q.children == p.children[:path[-1]] + p.children[path[-1] + 1:]
+    assert all(a is b for (a, b) in zip(q.children, p.children))
+    reference = C.copy()
+    node = reference
+    for k in path[:-1]:
+        node = node.children[k]
+    node._unlink(node.children[path[-1]])
+    assert Q == Tree.PersistentTree.FromTree(reference)
+    leaf = Tree.PersistentTree([], None, 'z')
+    Q = P.link(path[:-1], leaf)
+    (p, q) = check_shared_off_path(P, Q, path)
+    assert q.children[:-1] == p.children and q.children[-1] is leaf
+    assert all(a is b for (a, b) in zip(q.children, p.children))
+    assert sorted(Q.leaves_names) == sorted(P.leaves_names + ['z'])
+    Q = P.insert(path, Tree.PersistentTree([leaf], None, None))
+    check_shared_off_path(P, Q, path)
+    assert Q.node(path).children == (leaf, P.node(path))
+    reference = C.copy()
+    node = reference
+    for k in path:
+        node = node.children[k]
+    above = Tree.CombinatorialTree([Tree.CombinatorialTree([], None, 'z')], 
+                                   None)
+    node.insert(above)
+    assert Q == Tree.PersistentTree.FromTree(reference)
+    Q = P.replace(path, leaf)
+    check_shared_off_path(P, Q, path)
+    assert Q.node(path) is leaf
+    assert P.replace((), None) is None
+    assert str(P) == before and P == Tree.PersistentTree.FromTree(C)
+    with pytest.raises(TypeError):
+        P.insert(path, C)
+    with pytest.raises(Tree.TreeStructureError):
+        Tree.PersistentTree([Tree.PersistentTree([], 1., 'a')], 1.)
+
+
+def naive_majority_clades(trees, threshold):
+    counts = dict()
+    for T in trees:
+        for node in T.preorder():
+            clade = frozenset(node.leaves_names)
+            if node is not T and len(clade) > 1:
+                counts[clade] = counts.get(clade, 0) + 1
+    return ({clade for (clade, count) in counts.items() 
+             if count > threshold * len(trees)}, counts)
+
+
+def test_consensus_matches_naive_majority_rule():
+    random.seed(41)
+    np.random.seed(41)
+    # noisy copies of one tree share most but not all of its clades
+    (names, D) = Tree.MetricTree.Kingman(8, 10).cophenetic_matrix()
+    trees = [Tree.MetricTree.UPGMA(names, D + 6. * random_distances(8)) 
+             for _ in range(40)]
+    for threshold in (0.5, 0.75, 0.9):
+        (expected, counts) = naive_majority_clades(trees, threshold)
+        M = Tree.MetricTree.Consensus(trees, threshold)
+        assert set(tree_clades(M)) - {frozenset(names)} == expected
+        assert Tree.MetricTree.Consensus(iter(trees), threshold) == M
+        assert Tree.MetricTree.Consensus(trees, threshold, 
+                                         max_clades = len(counts)) == M
+        for node in M.postorder():
+            assert node.height == max([child.height + 1. 
+                                       for child in node.children] + [0.])
+    G = set(tree_clades(Tree.MetricTree.Consensus(trees, greedy = True)))
+    assert naive_majority_clades(trees, 0.5)[0] <= G
+    for a in G:
+        for b in G:
+            assert not a & b or a <= b or b <= a
+    E = Tree.MetricTree.EvolveMany(6, 6, 40)
+    assert Tree.MetricTree.Consensus(E, 0.1) == \
+        Tree.MetricTree.Consensus(list(E), 0.1)
+    with pytest.raises(ValueError):
+        Tree.MetricTree.Consensus([])
+
+
+def check_leaf_index(tree):
+    root = tree.my_root
+    expected = {node.name: node for node in root.preorder() 
+                if node.children == []}
+    index = tree.leaf_index
+    assert index.keys() == expected.keys()
+    for (name, leaf) in expected.items():
+        assert index[name] is leaf and tree.leaf(name) is leaf
+
+
+def test_leaf_index_follows_link_and_unlink():
+    T = Tree.MetricTree.Kingman(12, 40).demote()
+    check_leaf_index(T)
+    subtree = next(node for node in T.preorder() 
+                   if not node.is_leaf and node.parent is not None)
+    check_leaf_index(subtree)
+    (cut, rest) = subtree.cut()
+    check_leaf_index(rest)
+    check_leaf_index(cut)
+    assert all(rest.leaf(name) is None for name in cut.leaves_names)
+    # a leaf that becomes a parent leaves the index
+    leaf = rest.leaf(rest.leaves_names[0])
+    leaf._link(cut)
+    check_leaf_index(rest)
+    assert rest.leaf(leaf.name) is None
+    # a parent that loses its last child enters it
+    leaf._unlink(cut)
+    check_leaf_index(rest)
+    assert rest.leaf(leaf.name) is leaf
+    check_leaf_index(cut)
+    above = Tree.CombinatorialTree([], None, 'above')
+    assert leaf.insert(above) is rest
+    check_leaf_index(rest)
+    above._link(cut)
+    check_leaf_index(rest)
+    names = rest.leaves_names
+    assert rest.common_ancestor(names) is rest
+    with pytest.raises(ValueError):
+        rest.common_ancestor(names + ['missing'])
+    check_leaf_index(rest.children[0])
+    rest.children[0].delete()
+    check_leaf_index(rest)
@@ -0,0 +1,64 @@
+import random
+import numpy as np
+import pytest
+import Tree
+import treefile
+
+
+def trees():
+    T = Tree.MetricTree.Kingman(9, 40)
+    unicode = Tree.MetricTree([Tree.MetricTree([], None, 0., 'ä'), 
+                               Tree.MetricTree([], None, 0., '木')], None, 1.)
+    return [T, T.demote(), Tree.MetricTree.Kingman(5, 40, integer_ids = True),
+            unicode, Tree.MetricTree([], None, 0., 'a')]
+
+
+def check_same(loaded, tree):
+    assert type(loaded) is type(tree)
+    assert loaded == tree and str(loaded) == str(tree)
+
+
+def test_dump_load_round_trip(tmp_path):
+    filename = str(tmp_path / 'trees.bin')
+    random.seed(29)
+    for tree in trees():
+        treefile.dump(tree, filename)
+        check_same(treefile.load(filename), tree)
+    written = trees()
+    treefile.dump_many(written, filename)
+    loaded = treefile.load_many(filename)
+    assert len(loaded) == len(written)
+    for (tree, expected) in zip(loaded, written):
+        check_same(tree, expected)
+    check_same(treefile.load(filename, -2), written[-2])
+
+
+def test_tree_file_reads_single_records(tmp_path):
+    filename = str(tmp_path / 'trees.bin')
+    np.random.seed(23)
+    E = Tree.MetricTree.EvolveMany(8, 20, 15)
+    treefile.dump_many(E, filename)
+    with treefile.TreeFile(filename) as F:
+        assert len(F) == 15
+        for r in (14, 0, 7):
+            A = F.array(r)
+            expected = E.array(r)
+            assert np.array_equal(A.parent, expected.parent)
+            assert np.array_equal(A.heights, expected.heights)
+            assert not A.parent.flags.writeable
+            check_same(F[r], E[r])
+        assert [str(T) for T in F] == [str(T) for T in E]
+        with pytest.raises(IndexError):
+            F.array(15)
+
+
+def test_tree_file_errors(tmp_path):
+    filename = tmp_path / 'bad.bin'
+    filename.write_bytes(b'')
+    with pytest.raises(treefile.TreeFileError):
+        treefile.TreeFile(str(filename))
+    filename.write_bytes(b'NOTTREES' + bytes(24))
+    with pytest.raises(treefile.TreeFileError):
+        treefile.TreeFile(str(filename))
+    with pytest.raises(TypeError):
+        treefile.dump_many([1], str(tmp_path / 'trees.bin'))
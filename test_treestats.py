@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import Tree
+import treestats
+
+
+def naive_summary(T):
+    n = T.Nleaves
+    stats = {'tmrca': T.height, 'total': 0., 'internal': 0., 'external': 0.,
+             'sfs': np.zeros(n + 1)}
+    for node in T.preorder():
+        for child in node.children:
+            length = node.height - child.height
+            stats['total'] += length
+            stats['external' if child.is_leaf else 'internal'] += length
+            stats['sfs'][len(child.leaves_names)] += length
+    return stats
+
+
+def check_close(stats, expected):
+    assert list(stats) == list(expected)
+    for key in expected:
+        assert np.allclose(stats[key], expected[key])
+
+
+def test_summary_matches_naive_walk():
+    np.random.seed(31)
+    E = Tree.MetricTree.EvolveMany(9, 20, 12)
+    trees = list(E)
+    for T in trees:
+        expected = naive_summary(T)
+        check_close(treestats.summary(T), expected)
+        check_close(treestats.summary(Tree.PersistentTree.FromTree(T)), 
+                    expected)
+        check_close(treestats.summary(Tree.ArrayTree.FromTree(T)), expected)
+    from_list = treestats.summary_many(trees)
+    check_close(treestats.summary_many(E), from_list)
+    for (r, T) in enumerate(trees):
+        check_close({key: value[r] for (key, value) in from_list.items()}, 
+                    naive_summary(T))
+
+
+def test_summary_selects_statistics():
+    T = Tree.MetricTree.Kingman(6, 30)
+    stats = treestats.summary(T, ('sfs', 'tmrca'))
+    assert list(stats) == ['sfs', 'tmrca']
+    assert stats['tmrca'] == T.height
+    assert list(treestats.summary_many([T, T])) == list(treestats.STATISTICS)
+    with pytest.raises(ValueError):
+        treestats.summary(T, ('height',))
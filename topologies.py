@@ -0,0 +1,233 @@
+import numpy as np
+import Tree
+import splits
+
+
+##############################################################################
+################################## FUNCTIONS #################################
+##############################################################################
+
+
+# Rooted binary topologies on n leaves are numbered 0, ..., count(n) - 1.
+# Leaves are the bit positions of splits.leaf_index (sorted names).
+# Unranked: leaf k = 1, ..., n - 1 is added above one of the 2k - 1 clades
+# (leaves, inner nodes and root, sorted as bitsets) of the tree on leaves
+# 0, ..., k - 1, the digit of leaf k is the position of that clade.
+# Ranked: going up from the leaves, the m lineages left (sorted as bitsets)
+# lose one of their m(m - 1)/2 pairs, the digit of the pair i < j is
+# j(j - 1)/2 + i.
+# In both cases the first digit is the least significant.
+
+
+def count(n, ranked = False):
+    """
+    Input:      - n, a positive integer, number of leaves
+                - ranked, a boolean
+    Output:     number of rooted binary topologies on n labelled leaves,
+                (2n - 3)!! unranked or n!(n - 1)!/2^(n - 1) ranked
+    """
+    if type(n) is not int:
+        raise TypeError('First input has to be integer.')
+    if n < 1:
+        raise ValueError('First input has to be positive.')
+    total = 1
+    if ranked:
+        for m in range(2, n + 1):
+            total *= m * (m - 1) // 2
+    else:
+        for k in range(1, n):
+            total *= 2 * k - 1
+    return total
+
+
+def _clade_codes(parent, heights, leaf_bits, n, ranked):
+    """
+    Input:      - parent, list of parents of nodes, children before parents
+                and the root last
+                - heights, list of heights of the nodes
+                - leaf_bits, list of bitsets of the nodes that are leaves
+                (0 for the other nodes)
+                - n, number of leaves
+                - ranked, a boolean
+    Output:     number of the topology (unary nodes are skipped, ties of
+                heights are ranked in postorder)
+    Used in:    encode, tally
+    """
+    bits = list(leaf_bits)
+    children = [0] * len(parent)
+    for i in range(len(parent) - 1):
+        bits[parent[i]] |= bits[i]
+        children[parent[i]] += 1
+    if any(c > 2 for c in children):
+        raise Tree.TreeStructureError('Tree has to be binary.')
+    code = 0
+    radix = 1
+    if ranked:
+        lineages = sorted(bits[i] for i in range(len(parent))
+                          if leaf_bits[i])
+        order = sorted((i for i in range(len(parent)) if children[i] == 2),
+                       key = lambda i: heights[i])
+        for i in order:
+            merged = bits[i]
+            pair = [k for (k, b) in enumerate(lineages) if b & merged]
+            (low, high) = pair
+            m = len(lineages)
+            code += (high * (high - 1) // 2 + low) * radix
+            radix *= m * (m - 1) // 2
+            del lineages[high]
+            lineages[low] = merged
+            lineages.sort()
+        return code
+    found = set(bits)
+    found.discard(0)
+    digits = []
+    for k in range(n - 1, 0, -1):
+        leaf = 1 << k
+        above = min((c for c in found if c & leaf and c != leaf),
+                    key = lambda c: bin(c).count('1'))
+        sibling = above ^ leaf
+        found = set(c ^ leaf if c & leaf else c for c in found
+                    if c != leaf and c != above)
+        found.add(sibling)
+        digits.append(sorted(found).index(sibling))
+    for (k, digit) in zip(range(1, n), reversed(digits)):
+        code += digit * radix
+        radix *= 2 * k - 1
+    return code
+
+
+def encode(tree, ranked = False, index = None):
+    """
+    Input:      - tree, a binary Combinatorial/Metric/PersistentTree or
+                ArrayTree (a MetricTree if ranked)
+                - ranked, a boolean, if True the order of the heights of
+                the inner nodes is part of the topology
+                - index, dictionary from names of leaves to bit positions
+                (splits.leaf_index of the leaves of tree if None)
+    Output:     number of the topology of tree, between 0 and
+                count(n, ranked) - 1; it is computed from the clades in
+                time depending only on the number of leaves, so trees are
+                tallied in arrays instead of being compared with __eq__
+    """
+    array = Tree.ArrayTree.FromAny(tree)
+    if ranked and not array.metric:
+        raise TypeError('Ranked topologies need a MetricTree.')
+    if index is None:
+        index = splits.leaf_index(array.leaves_names)
+    leaf = (array.n_children == 0).tolist()
+    leaf_bits = []
+    for (i, name) in enumerate(array.names):
+        if not leaf[i]:
+            leaf_bits.append(0)
+        elif name in index:
+            leaf_bits.append(1 << index[name])
+        else:
+            raise ValueError('Leaf ' + str(name) + ' is not in the index.')
+    return _clade_codes(array.parent.tolist(), array.heights.tolist(),
+                        leaf_bits, len(index), ranked)
+
+
+def decode(code, names, ranked = False):
+    """
+    Input:      - code, a nonnegative integer below count(len(names), ranked)
+                - names, list of names of the leaves
+                - ranked, a boolean
+    Output:     topology number code on the leaves, a CombinatorialTree, or
+                if ranked a MetricTree whose inner nodes have heights
+                1, 2, ..., n - 1 in the order they merge
+    """
+    if type(code) is not int and not isinstance(code, np.integer):
+        raise TypeError('First input has to be integer.')
+    n = len(names)
+    if not 0 <= code < count(n, ranked):
+        raise ValueError('First input has to be a number of a topology.')
+    code = int(code)
+    index = splits.leaf_index(names)
+    ordered = sorted(index, key = lambda name: index[name])
+    if ranked:
+        lineages = [(1 << k, Tree.MetricTree([], None, 0., name))
+                    for (k, name) in enumerate(ordered)]
+        for m in range(n, 1, -1):
+            (code, digit) = divmod(code, m * (m - 1) // 2)
+            high = 1
+            while (high + 1) * high // 2 <= digit:
+                high += 1
+            low = digit - high * (high - 1) // 2
+            (high_bits, high_tree) = lineages.pop(high)
+            (low_bits, low_tree) = lineages[low]
+            lineages[low] = (low_bits | high_bits,
+                             Tree.MetricTree([low_tree, high_tree], None,
+                                             float(n - m + 1)))
+            lineages.sort(key = lambda pair: pair[0])
+        return lineages[0][1]
+    found = {1}
+    for k in range(1, n):
+        (code, digit) = divmod(code, 2 * k - 1)
+        sibling = sorted(found)[digit]
+        leaf = 1 << k
+        found = set(c | leaf if c & sibling == sibling and c != sibling
+                    else c for c in found)
+        found.update((sibling | leaf, leaf))
+    # every clade hangs below the smallest clade holding it
+    by_size = sorted(found, key = lambda c: bin(c).count('1'))
+    children = {c: [] for c in by_size}
+    for (k, c) in enumerate(by_size[:-1]):
+        for up in by_size[k + 1:]:
+            if up & c == c:
+                children[up].append(c)
+                break
+    built = dict()
+    for c in by_size:
+        if children[c] == []:
+            built[c] = Tree.CombinatorialTree([], None,
+                                              ordered[c.bit_length() - 1])
+        else:
+            built[c] = Tree.CombinatorialTree([built.pop(x) for x in
+                                               sorted(children[c])], None)
+    return built[by_size[-1]]
+
+
+def topologies(names, ranked = False):
+    """
+    Input:      - names, list of names of the leaves
+                - ranked, a boolean
+    Output:     generator of all rooted binary topologies on the leaves in
+                the order of their numbers (CombinatorialTrees, or
+                MetricTrees with heights 1, ..., n - 1 if ranked)
+    """
+    for code in range(count(len(names), ranked)):
+        yield decode(code, names, ranked)
+
+
+def tally(trees, ranked = False):
+    """
+    Input:      - trees, a TreeEnsemble or an iterable of binary trees with
+                the same leaves
+                - ranked, a boolean
+    Output:     int64 array of length count(n, ranked), the number of trees
+                with every topology
+    """
+    counts = None
+    if type(trees) is Tree.TreeEnsemble:
+        index = splits.leaf_index(trees.names)
+        n = trees.Nleaves
+        counts = np.zeros(count(n, ranked), dtype = np.int64)
+        leaf_bits = [1 << index[name] for name in trees.names]
+        for r in range(len(trees)):
+            size = int(trees.sizes[r])
+            code = _clade_codes(trees.parent[r, :size].tolist(),
+                                trees.heights[r, :size].tolist(),
+                                leaf_bits + [0] * (size - n), n, ranked)
+            counts[code] += 1
+        return counts
+    index = None
+    for tree in trees:
+        # converted once, encode takes the ArrayTree as it is
+        tree = Tree.ArrayTree.FromAny(tree)
+        if index is None:
+            index = splits.leaf_index(tree.leaves_names)
+            counts = np.zeros(count(len(index), ranked), dtype = np.int64)
+        counts[encode(tree, ranked, index)] += 1
+    if counts is None:
+        raise ValueError('Input has to contain at least one tree.')
+    return counts
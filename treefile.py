@@ -0,0 +1,280 @@
+import mmap
+import struct
+import numpy as np
+import Tree
+
+
+##############################################################################
+################################## CONSTANTS #################################
+##############################################################################
+
+
+# File layout (all numbers little endian, every block 8 byte aligned):
+#   header  -- MAGIC, then int64 version, number of trees, offset of index
+#   records -- one per tree: int64 number of nodes n, int64 metric flag,
+#              n int64 parents (-1 for the root, children before parents,
+#              root last), n float64 heights, n int64 lengths of names in
+#              bytes (-1 for no name, -2 for an integer name stored as 8
+#              bytes), UTF-8 names, zero padding
+#   index   -- int64 offset of every record
+MAGIC = b'FORESTTR'
+VERSION = 1
+HEADER = struct.Struct('<8sqqq')
+RECORD = struct.Struct('<qq')
+
+
+##############################################################################
+################################## EXCEPTION #################################
+##############################################################################
+
+
+class TreeFileError(Exception):
+    pass
+
+
+##############################################################################
+############################### TREE FILE CLASS ##############################
+##############################################################################
+
+
+class TreeFile(object):
+
+
+    """Memory mapped file of trees written by dump_many. Opening the file
+    reads only its header, a tree is read when it is asked for.
+    Properties:
+    filename        -- name of the file
+
+    Methods:
+    len(obj)        -- number of trees in the file
+    array(r)        -- ArrayTree of tree r, its arrays are read only views
+                       into the file
+    obj[r]          -- CombinatorialTree or MetricTree of tree r
+    close()         -- closes the file (also at the end of a with block)
+    """
+
+
+##############################################################################
+################################# INITIALIZE #################################
+##############################################################################
+
+
+    def __init__(self, filename):
+        self.__filename = filename
+        self.__file = open(filename, 'rb')
+        try:
+            self.__map = mmap.mmap(self.__file.fileno(), 0,
+                                   access = mmap.ACCESS_READ)
+        except ValueError:
+            self.__file.close()
+            raise TreeFileError('File is empty.')
+        if len(self.__map) < HEADER.size:
+            self.close()
+            raise TreeFileError('File is too short to be a tree file.')
+        (magic, version, count, index) = HEADER.unpack_from(self.__map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise TreeFileError('File is not a tree file.')
+        if version != VERSION:
+            self.close()
+            raise TreeFileError('Unknown version of tree file.')
+        self.__offsets = np.frombuffer(self.__map, dtype = '<i8',
+                                       count = count, offset = index)
+
+
+##############################################################################
+########################### ATTRIBUTE PROPERTIES #############################
+##############################################################################
+
+
+    @property
+    def filename(self):
+        return self.__filename
+
+
+##############################################################################
+################################## METHODS ###################################
+##############################################################################
+
+
+    def __len__(self):
+        """
+        Acts on:    a TreeFile
+        Input:      none
+        Output:     number of trees in the file
+        Short form: len(self)
+        """
+        return len(self.__offsets)
+
+    def array(self, r):
+        """
+        Acts on:    a TreeFile
+        Input:      r, index of a tree
+        Output:     ArrayTree of tree r, read without touching the other
+                    trees of the file
+        """
+        if r < 0:
+            r += len(self)
+        if not 0 <= r < len(self):
+            raise IndexError('Tree index out of range.')
+        offset = int(self.__offsets[r])
+        (n, metric) = RECORD.unpack_from(self.__map, offset)
+        offset += RECORD.size
+        parent = np.frombuffer(self.__map, dtype = '<i8', count = n,
+                               offset = offset)
+        heights = np.frombuffer(self.__map, dtype = '<f8', count = n,
+                                offset = offset + 8 * n)
+        lengths = np.frombuffer(self.__map, dtype = '<i8', count = n,
+                                offset = offset + 16 * n)
+        start = offset + 24 * n
+        names = []
+        for length in lengths.tolist():
+            if length == -1:
+                names.append(None)
+            elif length == -2:
+                names.append(int.from_bytes(self.__map[start:start + 8], 
+                                            'little', signed = True))
+                start += 8
+            else:
+                name = self.__map[start:start + length]
+                names.append(name.decode('utf-8', 'surrogatepass'))
+                start += length
+        # children of every node in increasing order, the root is last
+        child_index = np.argsort(parent[:-1], kind = 'stable')
+        child_offsets = np.concatenate(([0], np.cumsum(np.bincount(
+            parent[:-1], minlength = n))))
+        return Tree.ArrayTree(parent, heights, child_offsets, child_index,
+                              names, bool(metric))
+
+    def __getitem__(self, r):
+        """
+        Acts on:    a TreeFile
+        Input:      r, index of a tree
+        Output:     CombinatorialTree or MetricTree of tree r
+        Short form: self[r]
+        """
+        return self.array(r).to_tree()
+
+    def __iter__(self):
+        """
+        Acts on:    a TreeFile
+        Input:      none
+        Output:     iterator over the trees of the file, each read only when
+                    it is reached
+        """
+        for r in range(len(self)):
+            yield self[r]
+
+    def close(self):
+        """
+        Acts on:    a TreeFile
+        Input:      none
+        Output:     closes the memory map and the file
+        """
+        self.__offsets = np.empty(0, dtype = '<i8')
+        try:
+            self.__map.close()
+        except BufferError:
+            # arrays returned by array() still look into the map, which 
+            # is then unmapped once they are gone
+            pass
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        return 'TreeFile(' + repr(self.__filename) + ')'
+
+
+##############################################################################
+################################## FUNCTIONS #################################
+##############################################################################
+
+
+def _write_record(f, array_tree):
+    """
+    Input:      - f, a binary file open for writing
+                - array_tree, an ArrayTree
+    Output:     writes the record of the tree to f
+    Used in:    dump_many
+    """
+    encoded = []
+    lengths = []
+    for name in array_tree.names:
+        if name is None:
+            lengths.append(-1)
+        elif type(name) is str:
+            encoded.append(name.encode('utf-8', 'surrogatepass'))
+            lengths.append(len(encoded[-1]))
+        elif type(name) is int or isinstance(name, np.integer):
+            # LabelTable ids
+            encoded.append(int(name).to_bytes(8, 'little', signed = True))
+            lengths.append(-2)
+        else:
+            raise TypeError('''Names of trees have to be strings, integers or
+            None.''')
+    blob = b''.join(encoded)
+    f.write(RECORD.pack(array_tree.size, int(array_tree.metric)))
+    f.write(array_tree.parent.astype('<i8').tobytes())
+    f.write(array_tree.heights.astype('<f8').tobytes())
+    f.write(np.array(lengths, dtype = '<i8').tobytes())
+    f.write(blob + b'\0' * (-len(blob) % 8))
+
+
+def dump_many(trees, filename):
+    """
+    Input:      - trees, an iterable of CombinatorialTrees, MetricTrees,
+                ArrayTrees or a TreeEnsemble
+                - filename, a string
+    Output:     writes all the trees to the file, one record after another
+    """
+    if type(trees) is Tree.TreeEnsemble:
+        ensemble = trees
+        trees = (ensemble.array(r) for r in range(len(ensemble)))
+    offsets = []
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+        for tree in trees:
+            if type(tree) is not Tree.ArrayTree:
+                if not isinstance(tree, Tree.CombinatorialTree):
+                    raise TypeError('Input has to be a list of trees.')
+                tree = Tree.ArrayTree.FromTree(tree)
+            offsets.append(f.tell())
+            _write_record(f, tree)
+        index = f.tell()
+        f.write(np.array(offsets, dtype = '<i8').tobytes())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, len(offsets), index))
+
+
+def dump(tree, filename):
+    """
+    Input:      - tree, a CombinatorialTree, MetricTree or ArrayTree
+                - filename, a string
+    Output:     writes the tree to the file
+    """
+    dump_many([tree], filename)
+
+
+def load_many(filename):
+    """
+    Input:      filename, a string, file written by dump_many
+    Output:     list of all CombinatorialTrees and MetricTrees in the file
+    """
+    with TreeFile(filename) as treefile:
+        return list(treefile)
+
+
+def load(filename, r = 0):
+    """
+    Input:      - filename, a string, file written by dump or dump_many
+                - r, index of the tree in the file
+    Output:     CombinatorialTree or MetricTree number r of the file, read
+                through a memory map without parsing the other trees
+    """
+    with TreeFile(filename) as treefile:
+        return treefile[r]
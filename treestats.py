@@ -0,0 +1,122 @@
+import numpy as np
+import Tree
+
+
+##############################################################################
+################################## CONSTANTS #################################
+##############################################################################
+
+
+# names of the statistics, the default selection and order of the output
+STATISTICS = ('tmrca', 'total', 'internal', 'external', 'sfs')
+
+
+##############################################################################
+################################## FUNCTIONS #################################
+##############################################################################
+
+
+def _ensemble_summary(ensemble):
+    """
+    Input:      ensemble, a TreeEnsemble
+    Output:     dictionary of statistics of all replicates, computed on the
+                padded arrays a column at a time for all replicates at once
+    Used in:    summary_many
+    """
+    parent = ensemble.parent
+    heights = ensemble.heights
+    (R, M) = parent.shape
+    n = ensemble.Nleaves
+    rows = np.arange(R)
+    valid = parent >= 0
+    safe = np.where(valid, parent, 0)
+    lengths = np.where(valid, heights[rows[:, None], safe] - heights, 0.)
+    # every node comes before its parent, so one sweep over the columns
+    # finishes the leaf counts of a node before they reach its parent
+    counts = np.zeros((R, M), dtype = np.int64)
+    counts[:, :n] = 1
+    for j in range(M):
+        mask = valid[:, j]
+        counts[rows[mask], parent[mask, j]] += counts[mask, j]
+    sfs = np.zeros((R, n + 1), dtype = np.float64)
+    np.add.at(sfs, (np.broadcast_to(rows[:, None], (R, M))[valid],
+                    counts[valid]), lengths[valid])
+    external = lengths[:, :n].sum(axis = 1)
+    total = lengths.sum(axis = 1)
+    return {'tmrca': ensemble.tmrca.copy(), 'total': total,
+            'internal': total - external, 'external': external,
+            'sfs': sfs}
+
+
+def _select(stats, statistics):
+    """
+    Input:      - stats, dictionary of all the statistics
+                - statistics, iterable of names of statistics
+    Output:     dictionary of the statistics asked for, in their order
+    Used in:    summary_many
+    """
+    selected = dict()
+    for key in statistics:
+        if key not in STATISTICS:
+            raise ValueError('Statistic ' + str(key) + ' is not known.')
+        selected[key] = stats[key]
+    return selected
+
+
+def summary(tree, statistics = STATISTICS):
+    """
+    Input:      - tree, a MetricTree, PersistentTree or ArrayTree
+                - statistics, names of the statistics to return, among 
+                STATISTICS
+    Output:     dictionary of the statistics of the tree, all computed in
+                one postorder pass:
+                - 'tmrca', height of the root
+                - 'total', sum of lengths of all branches
+                - 'internal', sum of lengths of branches above inner nodes
+                - 'external', sum of lengths of branches above leaves
+                - 'sfs', float64 array of length n + 1 whose entry k is the
+                total length of branches with k leaves below them
+    """
+    stats = summary_many([tree], statistics)
+    return {key: value[0] for (key, value) in stats.items()}
+
+
+def summary_many(trees, statistics = STATISTICS):
+    """
+    Input:      - trees, a TreeEnsemble or a list of MetricTrees,
+                PersistentTrees or ArrayTrees
+                - statistics, names of the statistics to return, among 
+                STATISTICS
+    Output:     dictionary of the same statistics as summary, each a NumPy
+                array with one entry (one row for 'sfs', padded with zeros
+                to the largest number of leaves) per tree
+    """
+    if type(trees) is Tree.TreeEnsemble:
+        return _select(_ensemble_summary(trees), statistics)
+    arrays = [Tree.ArrayTree.FromAny(tree) for tree in trees]
+    R = len(arrays)
+    width = max([array.Nleaves for array in arrays] + [0]) + 1
+    stats = {'tmrca': np.zeros(R), 'total': np.zeros(R),
+             'internal': np.zeros(R), 'external': np.zeros(R),
+             'sfs': np.zeros((R, width))}
+    for (r, array) in enumerate(arrays):
+        parent = array.parent
+        heights = array.heights
+        size = array.size
+        # postorder, so the leaves below a node are all counted before its
+        # own count is passed up
+        counts_list = (array.n_children == 0).astype(np.int64).tolist()
+        parent_list = parent.tolist()
+        for i in range(size - 1):
+            counts_list[parent_list[i]] += counts_list[i]
+        counts = np.array(counts_list, dtype = np.int64)
+        lengths = np.zeros(size)
+        lengths[:-1] = heights[parent[:-1]] - heights[:-1]
+        leaf = array.n_children == 0
+        stats['tmrca'][r] = heights[-1]
+        stats['total'][r] = lengths.sum()
+        stats['external'][r] = lengths[leaf].sum()
+        stats['internal'][r] = stats['total'][r] - stats['external'][r]
+        stats['sfs'][r] = np.bincount(counts[:-1], weights = lengths[:-1],
+                                      minlength = width)
+    return _select(stats, statistics)